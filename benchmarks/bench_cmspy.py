@@ -0,0 +1,391 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+""" Benchmarks of the cmspy hot paths (prediction kernels,
+    coordinate conversions, MS I/O and metadata access).
+
+    Every case runs in a fresh process on synthetic inputs or on
+    a small MS created natively in a temporary directory (neither
+    network nor makems are needed). Results are written as JSON,
+    with the best wall time, the throughput (visibilities per
+    second when relevant) and the peak RSS of each case.
+
+    Run the suite:
+
+        python3 benchmarks/bench_cmspy.py -o results.json
+
+    Compare two runs (e.g. before and after a change):
+
+        python3 benchmarks/bench_cmspy.py --compare old.json new.json
+"""
+
+
+__author__ = 'Alan Loh'
+__copyright__ = 'Copyright 2020, cmspy'
+__credits__ = ['Alan Loh']
+__maintainer__ = 'Alan'
+__email__ = 'alan.loh@obspm.fr'
+__status__ = 'Production'
+
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join, dirname, abspath
+
+import numpy as np
+
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+
+# ============================================================= #
+# -------------------------- Helpers -------------------------- #
+# ============================================================= #
+def _best_time(func, repeat):
+    """ Best wall time of ``repeat`` calls of ``func``, after a
+        warm-up call (numba compilation, caches...).
+    """
+    func()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _sky_model(nsrcs, seed=0):
+    """ Random point sources around (ra, dec) = (0, 60) deg.
+    """
+    rng = np.random.default_rng(seed)
+    return {
+        'src{}'.format(i): {
+            'ra': rng.uniform(-5, 5),
+            'dec': 60 + rng.uniform(-5, 5),
+            'flux': rng.uniform(0.1, 10)
+        } for i in range(nsrcs)
+    }
+
+
+def _antenna_subset(nant, workdir):
+    """ Zipped copy of the first ``nant`` NenuFAR antennas.
+    """
+    from casacore.tables import table
+    from cmspy.AntennaTable import nenufar_antennas
+    name = 'NENUFAR{}_ANTENNA'.format(nant)
+    with zipfile.ZipFile(nenufar_antennas) as zipf:
+        zipf.extractall(workdir)
+    full = table(join(workdir, 'NENUFAR_ANTENNA'), ack=False)
+    subset = full.selectrows(list(range(nant)))
+    subset.copy(join(workdir, name), deep=True).close()
+    full.close()
+    archive = join(workdir, name + '.zip')
+    with zipfile.ZipFile(archive, 'w') as zipf:
+        for root, _, files in os.walk(join(workdir, name)):
+            for f in files:
+                path = join(root, f)
+                zipf.write(path, os.path.relpath(path, workdir))
+    return archive
+
+
+def _measurement_set(workdir, nant, nt, nchans, cls='MeasurementSet'):
+    """ Small MS created natively with ``nant`` antennas, ``nt``
+        time steps and ``nchans`` channels in one subband.
+    """
+    import cmspy.CustomMS
+    ms = getattr(cmspy.CustomMS, cls)(
+        savepath=workdir,
+        msname='bench.ms',
+        ra=0,
+        dec=60,
+        f0=50,
+        nf=nchans,
+        nbands=1,
+        nt=nt,
+        t0='2020-01-01T00:00:00'
+    )
+    ms._antennatable = _antenna_subset(nant, workdir)
+    ms.init_empty(native=True)
+    return ms
+
+
+# ============================================================= #
+# --------------------------- Cases --------------------------- #
+# ============================================================= #
+def bench_compute_ft(size, repeat):
+    from cmspy.MS.util_func import compute_ft
+    rng = np.random.default_rng(0)
+    ul, vm, wn = rng.normal(size=(3, size, 16))
+    seconds = _best_time(lambda: compute_ft(ul, vm, wn), repeat)
+    return {'seconds': seconds, 'visibilities': size * 16}
+
+
+def bench_add_src(size, repeat):
+    from cmspy.MS import add_src
+    rng = np.random.default_rng(0)
+    uvw = rng.normal(size=(size, 16, 3)) * 1000
+    seconds = _best_time(
+        lambda: add_src(uvw, (1., 61.), 1., (0., 60.)),
+        repeat
+    )
+    return {'seconds': seconds, 'visibilities': size * 16}
+
+
+def bench_radec2lmn(size, repeat):
+    from cmspy.Astro import radec2lmn
+    seconds = _best_time(
+        lambda: radec2lmn((299.8681, 40.7339), (0., 90.)),
+        repeat
+    )
+    return {'seconds': seconds}
+
+
+def bench_catalog2lmn(size, repeat):
+    from cmspy.Astro import catalog2lmn
+    rng = np.random.default_rng(0)
+    ra = rng.uniform(0, 360, size)
+    dec = rng.uniform(-30, 90, size)
+    seconds = _best_time(
+        lambda: catalog2lmn((ra, dec), phase_center=(0., 90.)),
+        repeat
+    )
+    return {'seconds': seconds, 'sources': size}
+
+
+def bench_add_data_table(nant, nt, nchans, nsrcs, engine, repeat,
+        virtual=False, precision='double'):
+    sources = _sky_model(nsrcs)
+    with tempfile.TemporaryDirectory() as workdir:
+        ms = _measurement_set(
+            workdir, nant, nt, nchans,
+            cls='VirtualMeasurementSet' if virtual else 'MeasurementSet'
+        )
+        seconds = _best_time(
+            lambda: ms.add_data_table(
+                sources,
+                engine=engine,
+                precision=precision
+            ),
+            repeat
+        )
+        nrows = ms.nrows
+    return {'seconds': seconds, 'visibilities': nrows * nchans}
+
+
+def bench_phase_center(size, repeat):
+    with tempfile.TemporaryDirectory() as workdir:
+        ms = _measurement_set(workdir, 8, 2, 4)
+        def access():
+            for _ in range(size):
+                ms.phase_center
+        seconds = _best_time(access, repeat) / size
+    return {'seconds': seconds}
+
+
+def bench_plot_uv(nt, repeat):
+    from cmspy.MS import plot_uv
+    with tempfile.TemporaryDirectory() as workdir:
+        ms = _measurement_set(workdir, 56, nt, 1)
+        seconds = _best_time(
+            lambda: plot_uv(ms.msfile, figname=join(workdir, 'uv.png')),
+            repeat
+        )
+        nrows = ms.nrows
+    return {'seconds': seconds, 'rows': nrows}
+
+
+def bench_uv_density(nt, nchans, repeat):
+    from cmspy.MS import uv_density
+    with tempfile.TemporaryDirectory() as workdir:
+        ms = _measurement_set(workdir, 56, nt, nchans)
+        seconds = _best_time(
+            lambda: uv_density(ms.msfile, unit='lambda', chunksize=10000),
+            repeat
+        )
+        nrows = ms.nrows
+    return {'seconds': seconds, 'visibilities': nrows * nchans}
+
+
+def cases(quick=False):
+    """ List of (name, function, kwargs) benchmark cases.
+    """
+    repeat = 2 if quick else 5
+    sizes = [
+        # nant, nt, nchans, nsrcs
+        (8, 10, 16, 10),
+        (24, 20, 32, 50),
+    ]
+    if not quick:
+        sizes.append((56, 30, 64, 200))
+    suite = [
+        ('compute_ft', bench_compute_ft, {'size': 100000, 'repeat': repeat}),
+        ('add_src', bench_add_src, {'size': 100000, 'repeat': repeat}),
+        ('radec2lmn', bench_radec2lmn, {'size': 1, 'repeat': 100}),
+        ('catalog2lmn', bench_catalog2lmn, {'size': 100000, 'repeat': repeat}),
+        ('phase_center', bench_phase_center, {'size': 100, 'repeat': repeat}),
+        ('plot_uv', bench_plot_uv, {'nt': 20 if quick else 100, 'repeat': repeat}),
+        ('uv_density', bench_uv_density, {'nt': 20 if quick else 100, 'nchans': 16, 'repeat': repeat}),
+    ]
+    for nant, nt, nchans, nsrcs in sizes:
+        for engine in ['loop', 'fused', 'antenna', 'recurrence']:
+            suite.append((
+                'add_data_table', bench_add_data_table, {
+                    'nant': nant,
+                    'nt': nt,
+                    'nchans': nchans,
+                    'nsrcs': nsrcs,
+                    'engine': engine,
+                    'repeat': repeat
+                }
+            ))
+        suite.append((
+            'add_data_table', bench_add_data_table, {
+                'nant': nant,
+                'nt': nt,
+                'nchans': nchans,
+                'nsrcs': nsrcs,
+                'engine': 'fused',
+                'repeat': repeat,
+                'virtual': True
+            }
+        ))
+        suite.append((
+            'add_data_table', bench_add_data_table, {
+                'nant': nant,
+                'nt': nt,
+                'nchans': nchans,
+                'nsrcs': nsrcs,
+                'engine': 'fused',
+                'repeat': repeat,
+                'precision': 'single'
+            }
+        ))
+    # Dense sky model, direct sum versus FFT/degridding
+    for engine in ['fused', 'fft']:
+        suite.append((
+            'add_data_table', bench_add_data_table, {
+                'nant': 24,
+                'nt': 20,
+                'nchans': 32,
+                'nsrcs': 500 if quick else 5000,
+                'engine': engine,
+                'repeat': repeat
+            }
+        ))
+    return suite
+
+
+# ============================================================= #
+# -------------------------- Runner --------------------------- #
+# ============================================================= #
+def _run_case(func, kwargs):
+    """ Run one case, in its own process so that the peak RSS
+        is the one of this case only.
+    """
+    import logging
+    logging.disable(logging.INFO)
+    result = func(**kwargs)
+    result['peak_rss_mb'] = resource.getrusage(
+        resource.RUSAGE_SELF
+    ).ru_maxrss / 1024.
+    return result
+
+
+def run(quick=False, select=None):
+    """ Run the suite and return the results as a dictionnary.
+    """
+    import cmspy
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=dirname(abspath(__file__)),
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name, func, kwargs in cases(quick):
+        if (select is not None) and (select not in name):
+            continue
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(_run_case, func, kwargs).result()
+        if 'visibilities' in result:
+            result['visibilities_per_second'] =\
+                result['visibilities'] / result['seconds']
+        params = {k: v for k, v in kwargs.items() if k != 'repeat'}
+        results.append({'name': name, 'params': params, **result})
+        print(
+            '{:<16} {:<70} {:>10.4g} s {:>12} {:>8.1f} MB'.format(
+                name,
+                json.dumps(params),
+                result['seconds'],
+                '{:.3g} vis/s'.format(result['visibilities_per_second'])\
+                    if 'visibilities_per_second' in result else '',
+                result['peak_rss_mb']
+            )
+        )
+    return {
+        'cmspy_version': cmspy.__version__,
+        'git_revision': revision,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results
+    }
+
+
+def compare(old_file, new_file):
+    """ Print the time ratio new/old of the cases found in both
+        result files.
+    """
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    key = lambda r: (r['name'], json.dumps(r['params'], sort_keys=True))
+    previous = {key(r): r for r in old['results']}
+    for result in new['results']:
+        ref = previous.get(key(result))
+        if ref is None:
+            continue
+        print(
+            '{:<16} {:<70} {:>8.3f}x time {:>8.3f}x RSS'.format(
+                result['name'],
+                json.dumps(result['params']),
+                result['seconds'] / ref['seconds'],
+                result['peak_rss_mb'] / ref['peak_rss_mb']
+            )
+        )
+    return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-o', '--output', help='JSON result file')
+    parser.add_argument('-q', '--quick', action='store_true',
+        help='smaller sizes and fewer repetitions')
+    parser.add_argument('-k', '--select',
+        help='only run the cases whose name contains this string')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+        help='compare two result files')
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+    else:
+        report = run(quick=args.quick, select=args.select)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=4)
@@ -9,17 +9,151 @@ __maintainer__ = 'Alan'
 __email__ = 'alan.loh@obspm.fr'
 __status__ = 'Production'
 __all__ = [
-    'nenufar_antennas'
+    'nenufar_antennas',
+    'cache_dir',
+    'extract_antennas',
+    'read_antennas'
 ]
 
 
 from os.path import (
     join,
-    dirname
+    dirname,
+    basename,
+    expanduser,
+    isdir
 )
+import os
+import shutil
+import hashlib
+import zipfile
+import tempfile
 
 
 nenufar_antennas = join(
     dirname(__file__),
     'NENUFAR_ANTENNA.zip',
-)
\ No newline at end of file
+)
+
+
+# In-process caches: zip (path, size, mtime) -> content hash and
+# extracted table -> (names, positions)
+_zip_hashes = {}
+_antennas = {}
+
+
+# ============================================================= #
+# ------------------------- cache_dir ------------------------- #
+# ============================================================= #
+def cache_dir():
+    """ Directory shared by all processes to cache extracted
+        antenna tables: ``$CMSPY_CACHE_DIR`` if set, otherwise
+        ``$XDG_CACHE_HOME/cmspy`` (``~/.cache/cmspy`` by
+        default).
+
+        :returns: Path to the cache directory (created if
+            needed).
+        :rtype: `str`
+    """
+    path = os.environ.get('CMSPY_CACHE_DIR')
+    if not path:
+        path = join(
+            os.environ.get('XDG_CACHE_HOME') or expanduser('~/.cache'),
+            'cmspy'
+        )
+    os.makedirs(path, exist_ok=True)
+    return path
+# ============================================================= #
+
+
+# ============================================================= #
+# --------------------- extract_antennas ---------------------- #
+# ============================================================= #
+def _zip_hash(archive):
+    """ SHA-256 of the content of ``archive``, computed once per
+        process as long as the file is not modified.
+    """
+    stat = os.stat(archive)
+    key = (archive, stat.st_size, stat.st_mtime_ns)
+    if key not in _zip_hashes:
+        sha = hashlib.sha256()
+        with open(archive, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        _zip_hashes[key] = sha.hexdigest()
+    return _zip_hashes[key]
+
+
+def extract_antennas(antennatable=nenufar_antennas):
+    """ Path to a casacore ANTENNA table. A zip archive is
+        extracted once per content hash in :func:`cache_dir`,
+        later calls (from any process) reusing the cached copy.
+
+        The archive is extracted in a temporary directory next
+        to its final location, then renamed, so that concurrent
+        processes never see a partially written table.
+
+        :param antennatable:
+            Path to the antenna table (or to its zip archive).
+        :type antennatable:
+            `str`
+
+        :returns: Path to the (extracted) antenna table.
+        :rtype: `str`
+    """
+    if not antennatable.endswith('.zip'):
+        return antennatable
+    name = basename(antennatable)[:-len('.zip')]
+    target = join(cache_dir(), 'antennas', _zip_hash(antennatable))
+    if not isdir(target):
+        os.makedirs(dirname(target), exist_ok=True)
+        tmpdir = tempfile.mkdtemp(dir=dirname(target), prefix='.tmp')
+        try:
+            with zipfile.ZipFile(antennatable) as zipf:
+                zipf.extractall(tmpdir)
+            os.rename(tmpdir, target)
+        except OSError:
+            # Another process populated the cache first
+            if not isdir(target):
+                raise
+        finally:
+            if isdir(tmpdir):
+                shutil.rmtree(tmpdir)
+    return join(target, name)
+# ============================================================= #
+
+
+# ============================================================= #
+# ----------------------- read_antennas ----------------------- #
+# ============================================================= #
+def read_antennas(antennatable=nenufar_antennas):
+    """ Read the names and ITRF positions of the antennas of
+        a casacore ANTENNA table, possibly zipped (see
+        :func:`extract_antennas`). Tables are only read once
+        per process.
+
+        :param antennatable:
+            Path to the antenna table (or to its zip archive).
+        :type antennatable:
+            `str`
+
+        :returns: (names, positions (antennas, 3) in meters)
+        :rtype: `tuple`
+    """
+    antennatable = extract_antennas(antennatable)
+    if antennatable not in _antennas:
+        from casacore.tables import table
+        ant = table(
+            tablename=antennatable,
+            ack=False,
+            readonly=True
+        )
+        _antennas[antennatable] = (
+            ant.getcol('NAME'),
+            ant.getcol('POSITION')
+        )
+        ant.close()
+    names, positions = _antennas[antennatable]
+    return list(names), positions.copy()
+# ============================================================= #
+
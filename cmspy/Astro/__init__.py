@@ -2,6 +2,20 @@
 # -*- coding: utf-8 -*-
 
 
-from .astro_func import *
+from cmspy import _lazy_exports
 
- 
\ No newline at end of file
+
+_exports = {
+    'to_skycoord': '.astro_func',
+    'radec2lmn': '.astro_func',
+    'radec2lmn_rad': '.astro_func',
+    'read_catalog': '.astro_func',
+    'read_image': '.astro_func',
+    'catalog2lmn': '.astro_func',
+    'earth_rotation': '.astro_func',
+    'antenna_uvw': '.astro_func',
+    'baseline_uvw': '.astro_func',
+    'elevation': '.astro_func'
+}
+__all__ = list(_exports)
+__getattr__, __dir__ = _lazy_exports(__name__, _exports)
@@ -10,7 +10,15 @@ __email__ = 'alan.loh@obspm.fr'
 __status__ = 'Production'
 __all__ = [
     'to_skycoord',
-    'radec2lmn'
+    'radec2lmn',
+    'radec2lmn_rad',
+    'read_catalog',
+    'read_image',
+    'catalog2lmn',
+    'earth_rotation',
+    'antenna_uvw',
+    'baseline_uvw',
+    'elevation'
 ]
 
 
@@ -18,7 +26,9 @@ import numpy as np
 from astropy.coordinates import (
     SkyCoord
 )
+from astropy.time import Time
 import astropy.units as u
+import erfa
 
 
 # ============================================================= #
@@ -68,22 +78,468 @@ def radec2lmn(skycoord, phase_center):
             )
 
     """
-    if not isinstance(skycoord, SkyCoord):
-        skycoord = to_skycoord(skycoord)
-    if not isinstance(phase_center, SkyCoord):
-        phase_center = to_skycoord(phase_center)
-
-    r = skycoord.ra.rad
-    d = skycoord.dec.rad
-    r0 = phase_center.ra.rad
-    d0 = phase_center.dec.rad
-    dr = r - r0
-
-    l = np.cos(d)*np.sin(dr)
-    m = np.sin(d)*np.cos(d0) -\
-        np.cos(d)*np.sin(d0)*np.cos(dr)
+    ra, dec = _radec_rad(skycoord)
+    ra0, dec0 = _radec_rad(phase_center)
+    return radec2lmn_rad(ra, dec, ra0, dec0)
+# ============================================================= #
+
+
+# ============================================================= #
+# ----------------------- radec2lmn_rad ----------------------- #
+# ============================================================= #
+def radec2lmn_rad(ra, dec, ra0, dec0):
+    """ Vectorized conversion of equatorial coordinates to
+        image domain coordinates (l, m, n).
+
+        :param ra:
+            Right Ascensions of the sources in radians.
+        :type ra:
+            `float` or `np.ndarray`
+        :param dec:
+            Declinations of the sources in radians.
+        :type dec:
+            `float` or `np.ndarray`
+        :param ra0:
+            Right Ascension of the phase center in radians.
+        :type ra0:
+            `float`
+        :param dec0:
+            Declination of the phase center in radians.
+        :type dec0:
+            `float`
+
+        :returns: (l, m, n) coordinates
+        :rtype: `tuple`
+    """
+    dr = ra - ra0
+    cos_d = np.cos(dec)
+
+    l = cos_d*np.sin(dr)
+    m = np.sin(dec)*np.cos(dec0) -\
+        cos_d*np.sin(dec0)*np.cos(dr)
     n = np.sqrt(1 - l**2. - m**2.)
 
     return l, m, n
 # ============================================================= #
 
+
+# ============================================================= #
+# ----------------------- read_catalog ------------------------ #
+# ============================================================= #
+def read_catalog(catalog):
+    """ Convert a sky model to NumPy arrays.
+
+        :param catalog:
+            Sky model, either a dictionnary like
+            ``{'src1': {'ra': 0, 'dec': 0, 'flux': 1}, ...}``,
+            a structured array or an :class:`astropy.table.Table`
+            with ``'ra'``, ``'dec'`` (and ``'flux'``) columns.
+            Coordinates are in degrees unless given as
+            :class:`astropy.units.Quantity`.
+        :type catalog:
+            `dict`, `np.ndarray` or :class:`astropy.table.Table`
+
+        :returns: Dictionnary of arrays with keys ``'name'``,
+            ``'ra'``, ``'dec'`` (in degrees) and ``'flux'``
+            (`None` if not provided)
+        :rtype: `dict`
+    """
+    if isinstance(catalog, dict):
+        names = list(catalog.keys())
+        columns = {
+            key: [catalog[name][key] for name in names]
+            for key in ['ra', 'dec', 'flux']
+            if all(key in catalog[name] for name in names)
+        }
+    else:
+        columns = {
+            key: catalog[key]
+            for key in ['ra', 'dec', 'flux']
+            if key in _colnames(catalog)
+        }
+        names = list(catalog['name'])\
+            if 'name' in _colnames(catalog)\
+            else list(range(len(catalog)))
+    if ('ra' not in columns) or ('dec' not in columns):
+        raise KeyError(
+            'Sky model should provide ra and dec.'
+        )
+    return {
+        'name': names,
+        'ra': _to_unit(columns['ra'], u.deg),
+        'dec': _to_unit(columns['dec'], u.deg),
+        'flux': _to_unit(columns['flux'], u.Jy)\
+            if 'flux' in columns else None
+    }
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------ read_image ------------------------- #
+# ============================================================= #
+def read_image(image, cell=None, phase_center=None, threshold=0.):
+    """ Convert a model image to a sky model of one point
+        source per pixel (at its center), which may then be
+        predicted like any catalog, e.g. with the ``'fft'``
+        engine of
+        :meth:`~cmspy.CustomMS.MeasurementSet.add_data_table`.
+
+        Pixel values are taken as fluxes in Jy (i.e. in
+        Jy/pixel, not Jy/beam). Only the first plane of images
+        with more than two axes (frequency, Stokes...) is read.
+
+        :param image:
+            Path to a FITS image (its celestial WCS giving the
+            pixel coordinates), or a 2D array ``(dec, ra)`` in
+            SIN projection centered on ``phase_center``, the
+            first axis being along the declination and the
+            right ascension decreasing along the second one, as
+            displayed by FITS viewers.
+        :type image:
+            `str` or `np.ndarray`
+        :param cell:
+            Pixel size (in degrees unless given as
+            :class:`astropy.units.Quantity`) of an array image.
+        :type cell:
+            `float` or :class:`astropy.units.Quantity`
+        :param phase_center:
+            Center of an array image.
+        :type phase_center:
+            `tuple` or :class:`astropy.coordinates.SkyCoord`
+        :param threshold:
+            Pixels whose absolute value does not exceed
+            ``threshold`` are skipped.
+        :type threshold:
+            `float`
+
+        :returns: Sky model with ``'name'``, ``'ra'``, ``'dec'``
+            (in degrees) and ``'flux'`` columns. For SIN
+            projections, the pixel sizes (in degrees) are stored
+            in its ``meta['cell']``, so that the ``'fft'`` engine
+            places the pixels directly on its grid when the image
+            is centered on the phase center.
+        :rtype: :class:`astropy.table.Table`
+
+        :Example:
+
+        >>> from cmspy.Astro import read_image
+        >>> sky = read_image('model.fits', threshold=1e-3)
+        >>> ms.add_data_table(sources=sky, engine='fft')
+
+    """
+    from astropy.table import Table
+    from astropy.wcs import WCS
+    if isinstance(image, str):
+        from astropy.io import fits
+        with fits.open(image) as hdus:
+            data = np.asarray(hdus[0].data, dtype=np.float64)
+            wcs = WCS(hdus[0].header).celestial
+    else:
+        if (cell is None) or (phase_center is None):
+            raise ValueError(
+                'cell and phase_center are needed for an array image.'
+            )
+        data = np.asarray(image, dtype=np.float64)
+        ra0, dec0 = np.degrees(_radec_rad(phase_center))
+        cell = float(_to_unit(np.atleast_1d(cell), u.deg)[0])
+        wcs = WCS(naxis=2)
+        wcs.wcs.ctype = ['RA---SIN', 'DEC--SIN']
+        wcs.wcs.crval = [float(ra0), float(dec0)]
+        wcs.wcs.cdelt = [-cell, cell]
+        wcs.wcs.crpix = [data.shape[-1]//2 + 1, data.shape[-2]//2 + 1]
+    if data.ndim < 2:
+        raise ValueError(
+            'Model image should have at least 2 dimensions.'
+        )
+    data = data.reshape((-1,) + data.shape[-2:])[0]
+    y, x = np.nonzero(np.isfinite(data) & (np.abs(data) > threshold))
+    ra, dec = wcs.pixel_to_world_values(x, y)
+    meta = {}
+    if all(ctype.endswith('SIN') for ctype in wcs.wcs.ctype):
+        meta['cell'] = [
+            float(scale.to_value(u.deg))
+            for scale in wcs.proj_plane_pixel_scales()
+        ]
+    return Table({
+        'name': ['pix_{}_{}'.format(j, i) for j, i in zip(y, x)],
+        'ra': np.asarray(ra, dtype=np.float64) % 360.,
+        'dec': np.asarray(dec, dtype=np.float64),
+        'flux': data[y, x]
+    }, meta=meta)
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------ catalog2lmn ------------------------ #
+# ============================================================= #
+def catalog2lmn(catalog, phase_center=None, phase_center_rad=None):
+    """ Convert a whole sky model to image domain coordinates
+        (l, m, n) in a single vectorized pass.
+
+        :param catalog:
+            Sky model (see :func:`read_catalog`), or a tuple of
+            (ra, dec) arrays in degrees.
+        :type catalog:
+            `dict`, `tuple`, `np.ndarray` or
+            :class:`astropy.table.Table`
+        :param phase_center:
+            Phase center of the observation.
+        :type phase_center:
+            `tuple` or :class:`astropy.coordinates.SkyCoord`
+        :param phase_center_rad:
+            Phase center (ra0, dec0) in radians, used instead
+            of ``phase_center`` to skip any conversion.
+        :type phase_center_rad:
+            `tuple`
+
+        :returns: (l, m, n) arrays
+        :rtype: `tuple`
+
+        :Example:
+
+        >>> from cmspy.Astro import catalog2lmn
+        >>> import numpy as np
+        >>> l, m, n = catalog2lmn(
+                catalog=(np.random.uniform(0, 360, 100000),
+                    np.random.uniform(0, 90, 100000)),
+                phase_center=(0, 90)
+            )
+
+    """
+    if phase_center_rad is None:
+        if phase_center is None:
+            raise ValueError(
+                'A phase center should be provided.'
+            )
+        phase_center_rad = _radec_rad(phase_center)
+    ra0, dec0 = phase_center_rad
+    if isinstance(catalog, tuple):
+        ra = _to_unit(catalog[0], u.deg)
+        dec = _to_unit(catalog[1], u.deg)
+    else:
+        columns = read_catalog(catalog)
+        ra = columns['ra']
+        dec = columns['dec']
+    return radec2lmn_rad(
+        np.radians(ra),
+        np.radians(dec),
+        ra0,
+        dec0
+    )
+# ============================================================= #
+
+
+# ============================================================= #
+# ---------------------- earth_rotation ----------------------- #
+# ============================================================= #
+def earth_rotation(times):
+    """ Celestial (GCRS, i.e. J2000 within a few mas) to
+        terrestrial (ITRF) rotation matrices, computed once for
+        each time step. UT1 is approximated by UTC and polar
+        motion is neglected, which amounts to an error of the
+        order of the arcsecond.
+
+        :param times:
+            Times in MJD seconds (UTC), as stored in the TIME
+            column of a MS.
+        :type times:
+            `np.ndarray`
+
+        :returns: Rotation matrices (times, 3, 3)
+        :rtype: `np.ndarray`
+    """
+    utc = Time(np.asarray(times) / 86400., format='mjd', scale='utc')
+    tt = utc.tt
+    return erfa.c2t06a(
+        tt.jd1, tt.jd2,
+        utc.jd1, utc.jd2,
+        0., 0.
+    )
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------ antenna_uvw ------------------------ #
+# ============================================================= #
+def antenna_uvw(positions, times, phase_center):
+    """ Compute the UVW coordinates (J2000 frame) of each
+        antenna at each time step, in one batched pass. The
+        Earth rotation is evaluated once per time step (see
+        :func:`earth_rotation`).
+
+        :param positions:
+            ITRF positions (antennas, 3) in meters.
+        :type positions:
+            `np.ndarray`
+        :param times:
+            Time steps in MJD seconds (UTC).
+        :type times:
+            `np.ndarray`
+        :param phase_center:
+            Phase center of the observation.
+        :type phase_center:
+            `tuple` or :class:`astropy.coordinates.SkyCoord`
+
+        :returns: UVW (times, antennas, 3) in meters
+        :rtype: `np.ndarray`
+    """
+    ra, dec = _radec_rad(phase_center)
+    basis = np.array([
+        [-np.sin(ra), np.cos(ra), 0.],
+        [-np.sin(dec)*np.cos(ra), -np.sin(dec)*np.sin(ra), np.cos(dec)],
+        [np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)]
+    ])
+    # Terrestrial to celestial is the transposed rotation
+    return np.einsum(
+        'ij,tkj,ak->tai',
+        basis,
+        earth_rotation(np.atleast_1d(times)),
+        np.asarray(positions, dtype=np.float64)
+    )
+# ============================================================= #
+
+
+# ============================================================= #
+# ----------------------- baseline_uvw ------------------------ #
+# ============================================================= #
+def baseline_uvw(positions, times, phase_center, ant1=None, ant2=None):
+    """ Compute the UVW coordinates of baselines, following the
+        MS convention ``uvw(ANTENNA2) - uvw(ANTENNA1)``.
+
+        :param positions:
+            ITRF positions (antennas, 3) in meters.
+        :type positions:
+            `np.ndarray`
+        :param times:
+            Time steps in MJD seconds (UTC).
+        :type times:
+            `np.ndarray`
+        :param phase_center:
+            Phase center of the observation.
+        :type phase_center:
+            `tuple` or :class:`astropy.coordinates.SkyCoord`
+        :param ant1:
+            First antenna of each baseline. If `None`, all the
+            baselines (autocorrelations included) are computed.
+        :type ant1:
+            `np.ndarray`
+        :param ant2:
+            Second antenna of each baseline.
+        :type ant2:
+            `np.ndarray`
+
+        :returns: UVW (times, baselines, 3) in meters
+        :rtype: `np.ndarray`
+    """
+    if ant1 is None:
+        ant1, ant2 = np.triu_indices(len(positions))
+    ant_uvw = antenna_uvw(positions, times, phase_center)
+    return ant_uvw[:, ant2] - ant_uvw[:, ant1]
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------- elevation ------------------------- #
+# ============================================================= #
+def elevation(catalog, times, location):
+    """ Elevation of sources seen from ``location``, the Earth
+        rotation being evaluated once per time step (see
+        :func:`earth_rotation`) and shared by all the sources.
+        Refraction and aberration (up to 20 arcsec) are
+        neglected.
+
+        :param catalog:
+            Sky model (see :func:`read_catalog`), or a tuple of
+            (ra, dec) arrays in degrees.
+        :type catalog:
+            `dict`, `tuple`, `np.ndarray` or
+            :class:`astropy.table.Table`
+        :param times:
+            Time steps in MJD seconds (UTC).
+        :type times:
+            `np.ndarray`
+        :param location:
+            Observer, either as ITRF coordinates (3,) in meters
+            (e.g. the mean antenna position of a MS) or as an
+            :class:`astropy.coordinates.EarthLocation`.
+        :type location:
+            `np.ndarray` or :class:`astropy.coordinates.EarthLocation`
+
+        :returns: Elevations (sources, times) in degrees
+        :rtype: `np.ndarray`
+    """
+    if isinstance(catalog, tuple):
+        ra = _to_unit(np.atleast_1d(catalog[0]), u.deg)
+        dec = _to_unit(np.atleast_1d(catalog[1]), u.deg)
+    else:
+        columns = read_catalog(catalog)
+        ra = columns['ra']
+        dec = columns['dec']
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    directions = np.stack([
+        np.cos(dec) * np.cos(ra),
+        np.cos(dec) * np.sin(ra),
+        np.sin(dec)
+    ], axis=-1)
+    if hasattr(location, 'to_geocentric'):
+        location = u.Quantity(location.to_geocentric()).to(u.m).value
+    # Local vertical (WGS84 geodetic normal) in ITRF
+    lon, lat, _ = erfa.gc2gd(1, np.asarray(location, dtype=np.float64))
+    up = np.array([
+        np.cos(lat) * np.cos(lon),
+        np.cos(lat) * np.sin(lon),
+        np.sin(lat)
+    ])
+    # Vertical in the celestial frame at each time step
+    up = np.einsum(
+        'tji,j->ti',
+        earth_rotation(np.atleast_1d(times)),
+        up
+    )
+    return np.degrees(np.arcsin(np.clip(directions.dot(up.T), -1., 1.)))
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------- Internal -------------------------- #
+# ============================================================= #
+def _colnames(catalog):
+    """ Column names of a structured array or a Table.
+    """
+    if hasattr(catalog, 'colnames'):
+        return catalog.colnames
+    return catalog.dtype.names or ()
+
+
+def _to_unit(values, unit):
+    """ Convert to a float array expressed in ``unit``, plain
+        numbers being assumed to be already in ``unit``.
+    """
+    if getattr(values, 'unit', None) is not None and\
+        hasattr(values, 'quantity'):
+        # astropy.table.Column
+        values = values.quantity
+    if isinstance(values, u.Quantity):
+        return values.to(unit).value.astype(np.float64)
+    if len(values) and isinstance(values[0], u.Quantity):
+        return np.array([v.to(unit).value for v in values])
+    return np.asarray(values, dtype=np.float64)
+
+
+def _radec_rad(coord):
+    """ (ra, dec) in radians of a SkyCoord or of a (ra, dec)
+        tuple in degrees (or Quantities).
+    """
+    if isinstance(coord, SkyCoord):
+        return coord.ra.rad, coord.dec.rad
+    ra, dec = coord
+    try:
+        ra_rad = np.radians(_to_unit(np.atleast_1d(ra), u.deg))
+        dec_rad = np.radians(_to_unit(np.atleast_1d(dec), u.deg))
+        return ra_rad.reshape(np.shape(ra)), dec_rad.reshape(np.shape(dec))
+    except (TypeError, ValueError, u.UnitsError):
+        coord = to_skycoord(coord)
+        return coord.ra.rad, coord.dec.rad
+# ============================================================= #
+
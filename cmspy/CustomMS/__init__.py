@@ -2,5 +2,17 @@
 # -*- coding: utf-8 -*-
 
 
-from .msparset import MSParset
-from .measurementset import MeasurementSet
+from cmspy import _lazy_exports
+
+
+_exports = {
+    'MSParset': '.msparset',
+    'StageStats': '.instrumentation',
+    'PipelineReport': '.instrumentation',
+    'Instrumentation': '.instrumentation',
+    'MeasurementSet': '.measurementset',
+    'VirtualMeasurementSet': '.virtualms',
+    'Campaign': '.campaign'
+}
+__all__ = list(_exports)
+__getattr__, __dir__ = _lazy_exports(__name__, _exports)
@@ -0,0 +1,397 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+__author__ = 'Alan Loh'
+__copyright__ = 'Copyright 2020, cmspy'
+__credits__ = ['Alan Loh']
+__maintainer__ = 'Alan'
+__email__ = 'alan.loh@obspm.fr'
+__status__ = 'Production'
+__all__ = [
+    'Campaign'
+]
+
+
+from os.path import (
+    join,
+    abspath,
+    isdir
+)
+import os
+import time
+import itertools
+import traceback
+import collections
+import multiprocessing
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    FIRST_COMPLETED,
+    wait
+)
+from concurrent.futures.process import BrokenProcessPool
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+# ============================================================= #
+# ------------------------- Campaign -------------------------- #
+# ============================================================= #
+class Campaign(object):
+    """ Simulate many MeasurementSets concurrently, each job
+        running :meth:`~cmspy.CustomMS.MeasurementSet.init_empty`,
+        :meth:`~cmspy.CustomMS.MeasurementSet.add_desc_tables` and
+        :meth:`~cmspy.CustomMS.MeasurementSet.add_data_table` in
+        its own work directory (``savepath/jobXXXX``), so that
+        makems parsets of different jobs never collide.
+
+        Jobs run in a pool of at most ``workers`` processes. A
+        job raising an exception is reported as failed without
+        stopping the others. If a process dies (e.g. crash of a
+        C extension), the pool is recreated and the unfinished
+        jobs are resubmitted, those which were running being
+        run one at a time so that only the job killing its
+        process is reported as failed.
+
+        :param savepath:
+            Directory in which the job directories are created.
+        :type savepath:
+            `str`
+        :param workers:
+            Maximal number of jobs running at once, defaults to
+            the number of CPUs.
+        :type workers:
+            `int`
+        :param native:
+            Create the MSs with python-casacore instead of
+            makems (see
+            :meth:`~cmspy.CustomMS.MeasurementSet.init_empty`).
+        :type native:
+            `bool`
+        :param prediction:
+            Keyword arguments of
+            :meth:`~cmspy.CustomMS.MeasurementSet.add_data_table`
+            (``chunksize``, ``engine``...), shared by all jobs.
+
+        :Example:
+
+        >>> from cmspy.CustomMS import Campaign
+        >>> campaign = Campaign('/data/sweep', workers=4, native=True)
+        >>> campaign.add_grid(
+                f0=[30, 50, 70],
+                nt=[60, 600],
+                sources=[sky1, sky2]
+            )
+        >>> campaign.run()
+        >>> print(campaign.summary())
+
+    """
+
+    def __init__(self, savepath, workers=None, native=False, **prediction):
+        self.savepath = savepath
+        self.workers = workers
+        self.native = native
+        self.prediction = prediction
+        self.jobs = []
+        self.results = []
+
+
+    def __len__(self):
+        return len(self.jobs)
+
+
+    # --------------------------------------------------------- #
+    # --------------------- Getter/Setter --------------------- #
+    @property
+    def savepath(self):
+        return self._savepath
+    @savepath.setter
+    def savepath(self, s):
+        s = abspath(s)
+        if not isdir(s):
+            raise NotADirectoryError(
+                '{} not found'.format(s)
+            )
+        self._savepath = s
+        return
+
+
+    @property
+    def workers(self):
+        return self._workers
+    @workers.setter
+    def workers(self, w):
+        if w is None:
+            w = os.cpu_count()
+        if int(w) < 1:
+            raise ValueError(
+                'workers should be a positive integer'
+            )
+        self._workers = int(w)
+        return
+
+
+    @property
+    def failed(self):
+        """ Results of the failed jobs.
+        """
+        return [r for r in self.results if r['status'] == 'failed']
+
+
+    # --------------------------------------------------------- #
+    # ------------------------ Methods ------------------------ #
+    def add(self, sources=None, **parset):
+        """ Add a job.
+
+            :param sources:
+                Sky model given to
+                :meth:`~cmspy.CustomMS.MeasurementSet.add_data_table`.
+                If `None`, the data columns are left empty.
+            :type sources:
+                `dict`
+            :param parset:
+                :class:`~cmspy.CustomMS.MSParset` attributes
+                (``f0``, ``nt``, ``dt``, ``ra``, ``dec``...),
+                ``savepath`` being set to the job directory and
+                ``msname`` defaulting to ``'jobXXXX.ms'``.
+
+            :returns: Index of the job.
+            :rtype: `int`
+        """
+        if 'savepath' in parset:
+            raise ValueError(
+                'savepath is set per job by the campaign'
+            )
+        index = len(self.jobs)
+        parset.setdefault('msname', 'job{:04d}.ms'.format(index))
+        self.jobs.append({
+            'index': index,
+            'workdir': join(self.savepath, 'job{:04d}'.format(index)),
+            'parset': parset,
+            'sources': sources
+        })
+        return index
+
+
+    def add_grid(self, **grid):
+        """ Add one job per combination of the given values.
+
+            :param grid:
+                For each :class:`~cmspy.CustomMS.MSParset`
+                attribute (or ``sources``), the list of values
+                to sweep.
+
+            :returns: Indices of the added jobs.
+            :rtype: `list`
+        """
+        keys = list(grid.keys())
+        return [
+            self.add(**dict(zip(keys, values)))
+            for values in itertools.product(*[grid[k] for k in keys])
+        ]
+
+
+    def run(self):
+        """ Run all the jobs.
+
+            :returns: One result dictionnary per job, in job
+                order, with its ``status`` (``'done'`` or
+                ``'failed'``), ``msfile``, ``error`` traceback,
+                per-step wall times in ``seconds`` and pipeline
+                statistics in ``report``.
+            :rtype: `list`
+        """
+        options = {
+            'native': self.native,
+            'prediction': self.prediction
+        }
+        results = {}
+        queue = collections.deque(self.jobs)
+        suspects = set()
+        start = time.perf_counter()
+        while queue:
+            crashed, error = self._run_pool(queue, suspects, options, results)
+            if len(crashed) == 1:
+                # The job ran alone, it killed its process
+                result = _job_result(crashed[0])
+                result['error'] = error
+                self._record(results, result)
+            elif crashed:
+                log.warning(
+                    'Process pool broken, jobs {} resubmitted.'.format(
+                        [job['index'] for job in crashed]
+                    )
+                )
+                suspects.update(job['index'] for job in crashed)
+                queue.extendleft(reversed(crashed))
+        self.results = [results[job['index']] for job in self.jobs]
+        log.info(
+            'Campaign of {} jobs run in {:.1f} s, {} failed.'.format(
+                len(self.jobs),
+                time.perf_counter() - start,
+                len(self.failed)
+            )
+        )
+        return self.results
+
+
+    # --------------------------------------------------------- #
+    # ----------------------- Internal ------------------------ #
+    def _run_pool(self, queue, suspects, options, results):
+        """ Run the jobs of ``queue`` in a new process pool until
+            they are all done or the pool breaks, jobs whose
+            index is in ``suspects`` running alone.
+
+            :returns: (jobs that were running when the pool
+                broke, traceback of the break)
+            :rtype: `tuple`
+        """
+        context = multiprocessing.get_context('spawn')
+        nthreads = max(1, os.cpu_count() // self.workers)
+        running = {}
+        crashed = []
+        error = None
+        with ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(nthreads,)
+            ) as executor:
+            while (queue or running) and not crashed:
+                while queue and (len(running) < self.workers):
+                    alone = queue[0]['index'] in suspects
+                    if running and alone:
+                        break
+                    job = queue.popleft()
+                    try:
+                        future = executor.submit(_run_job, job, options)
+                    except BrokenProcessPool:
+                        queue.appendleft(job)
+                        break
+                    running[future] = job
+                    if alone:
+                        break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        self._record(results, future.result())
+                    except BrokenProcessPool:
+                        # The process running a job died, no result
+                        # to collect from the jobs still running
+                        error = traceback.format_exc()
+                        crashed.append(job)
+            if crashed:
+                crashed += list(running.values())
+                crashed.sort(key=lambda job: job['index'])
+        return crashed, error
+
+
+    def _record(self, results, result):
+        """ Store the ``result`` of a job.
+        """
+        results[result['index']] = result
+        log.info(
+            'Job {} {} ({} / {}).'.format(
+                result['index'],
+                result['status'],
+                len(results),
+                len(self.jobs)
+            )
+        )
+        return
+
+
+    def summary(self):
+        """ Table of the per-job status and wall times.
+        """
+        steps = ['init_empty', 'add_desc_tables', 'add_data_table', 'total']
+        lines = [
+            '{:>5} {:<8} {:>12} {:>16} {:>15} {:>10}  {}'.format(
+                'job', 'status', *steps, 'msfile'
+            )
+        ]
+        row = '{:>5} {:<8} {:>12.3f} {:>16.3f} {:>15.3f} {:>10.3f}  {}'
+        for result in self.results:
+            lines.append(
+                row.format(
+                    result['index'],
+                    result['status'],
+                    *[
+                        result['seconds'].get(step, float('nan'))
+                        for step in steps
+                    ],
+                    result['msfile']
+                )
+            )
+        return '\n'.join(lines)
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------- Workers --------------------------- #
+# ============================================================= #
+def _init_worker(nthreads):
+    """ Share the cores between the jobs running at once.
+    """
+    import numba
+    numba.set_num_threads(min(nthreads, numba.config.NUMBA_NUM_THREADS))
+    return
+
+
+def _job_result(job):
+    """ Result of a job before it runs, i.e. failed.
+    """
+    return {
+        'index': job['index'],
+        'status': 'failed',
+        'msfile': join(job['workdir'], job['parset']['msname']),
+        'error': None,
+        'seconds': {},
+        'report': {}
+    }
+
+
+def _run_job(job, options):
+    """ Run the MS simulation pipeline of one job, any
+        exception being reported in the result.
+    """
+    from cmspy.CustomMS import MeasurementSet
+    result = _job_result(job)
+    start = time.perf_counter()
+    try:
+        os.makedirs(job['workdir'], exist_ok=True)
+        ms = MeasurementSet(savepath=job['workdir'], **job['parset'])
+        ms.enable_instrumentation()
+        steps = [
+            ('init_empty', lambda: ms.init_empty(native=options['native'])),
+            ('add_desc_tables', ms.add_desc_tables)
+        ]
+        if job['sources'] is not None:
+            steps.append((
+                'add_data_table',
+                lambda: ms.add_data_table(
+                    job['sources'],
+                    **options['prediction']
+                )
+            ))
+        for step, func in steps:
+            step_start = time.perf_counter()
+            func()
+            result['seconds'][step] = time.perf_counter() - step_start
+        result['report'] = ms.report.to_dict()
+        result['status'] = 'done'
+    except Exception:
+        result['error'] = traceback.format_exc()
+        log.error(
+            'Job {} failed:\n{}'.format(
+                job['index'],
+                result['error']
+            )
+        )
+    result['seconds']['total'] = time.perf_counter() - start
+    return result
+# ============================================================= #
+
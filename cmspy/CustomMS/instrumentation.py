@@ -0,0 +1,270 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+__author__ = 'Alan Loh'
+__copyright__ = 'Copyright 2020, cmspy'
+__credits__ = ['Alan Loh']
+__maintainer__ = 'Alan'
+__email__ = 'alan.loh@obspm.fr'
+__status__ = 'Production'
+__all__ = [
+    'StageStats',
+    'PipelineReport',
+    'Instrumentation'
+]
+
+
+import time
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+# ============================================================= #
+# ------------------------ StageStats ------------------------- #
+# ============================================================= #
+class StageStats(object):
+    """ Accumulated statistics of one pipeline stage: number of
+        calls, wall time, bytes read/written, rows processed and
+        visibilities (rows x channels) produced.
+    """
+
+    fields = [
+        'calls',
+        'seconds',
+        'bytes_read',
+        'bytes_written',
+        'rows',
+        'visibilities'
+    ]
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.rows = 0
+        self.visibilities = 0
+
+
+    def __repr__(self):
+        return '<StageStats {}: {:.3f} s, {} rows>'.format(
+            self.name,
+            self.seconds,
+            self.rows
+        )
+
+
+    # --------------------------------------------------------- #
+    # --------------------- Getter/Setter --------------------- #
+    @property
+    def visibilities_per_second(self):
+        if self.seconds == 0:
+            return 0.
+        return self.visibilities / self.seconds
+
+
+    # --------------------------------------------------------- #
+    # ------------------------ Methods ------------------------ #
+    def add(self, rows=0, visibilities=0, bytes_read=0, bytes_written=0):
+        """ Count processed rows, visibilities and bytes.
+        """
+        self.rows += rows
+        self.visibilities += visibilities
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+        return
+
+
+    def to_dict(self):
+        stats = {field: getattr(self, field) for field in self.fields}
+        stats['visibilities_per_second'] = self.visibilities_per_second
+        return stats
+# ============================================================= #
+
+
+# ============================================================= #
+# ---------------------- PipelineReport ----------------------- #
+# ============================================================= #
+class PipelineReport(object):
+    """ Statistics of all the stages recorded by an
+        :class:`Instrumentation`, in order of first occurrence.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+
+    def __getitem__(self, name):
+        return self.stages[name]
+
+
+    def __str__(self):
+        lines = [
+            '{:<28} {:>6} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+                'stage', 'calls', 'time (s)', 'rows',
+                'read (MB)', 'write (MB)', 'vis/s'
+            )
+        ]
+        row = '{:<28} {:>6} {:>10.3f} {:>10} {:>10.1f} {:>10.1f} {:>12.3g}'
+        for stats in self.stages.values():
+            lines.append(
+                row.format(
+                    stats.name,
+                    stats.calls,
+                    stats.seconds,
+                    stats.rows,
+                    stats.bytes_read / 1024**2,
+                    stats.bytes_written / 1024**2,
+                    stats.visibilities_per_second
+                )
+            )
+        return '\n'.join(lines)
+
+
+    # --------------------------------------------------------- #
+    # ------------------------ Methods ------------------------ #
+    def stage(self, name):
+        """ Statistics of stage ``name``, created if needed.
+        """
+        if name not in self.stages:
+            self.stages[name] = StageStats(name)
+        return self.stages[name]
+
+
+    def to_dict(self):
+        return {
+            name: stats.to_dict()
+            for name, stats in self.stages.items()
+        }
+
+
+    def merge(self, report):
+        """ Add the statistics of another report (or of its
+            :meth:`to_dict` output, e.g. sent back by a worker
+            process).
+        """
+        if isinstance(report, PipelineReport):
+            report = report.to_dict()
+        for name, stats in report.items():
+            target = self.stage(name)
+            for field in StageStats.fields:
+                setattr(target, field, getattr(target, field) + stats[field])
+        return
+# ============================================================= #
+
+
+# ============================================================= #
+# ---------------------- Instrumentation ---------------------- #
+# ============================================================= #
+class _Stage(object):
+    """ Time a stage while used as a context manager.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.add = stats.add
+
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc):
+        self.stats.seconds += time.perf_counter() - self._start
+        self.stats.calls += 1
+        return False
+
+
+class _NoStage(object):
+    """ Stage of a disabled instrumentation, doing nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        return False
+
+
+    def add(self, **kwargs):
+        return
+
+
+_no_stage = _NoStage()
+
+
+class Instrumentation(object):
+    """ Record per-stage wall time, bytes read/written, rows and
+        visibilities of the MeasurementSet pipeline.
+
+        When disabled (default), :meth:`stage` returns a shared
+        object doing nothing, the overhead being a method call.
+
+        :param enabled:
+            Record statistics.
+        :type enabled:
+            `bool`
+        :param emit_log:
+            Log the report at the end of each pipeline step.
+        :type emit_log:
+            `bool`
+        :param callback:
+            Function called as ``callback(step, report)`` at the
+            end of each pipeline step.
+        :type callback:
+            `callable`
+
+        :Example:
+
+        >>> ms.enable_instrumentation(emit_log=True)
+        >>> ms.add_data_table(sources)
+        >>> ms.report['add_data_table.write'].seconds
+
+    """
+
+    def __init__(self, enabled=False, emit_log=False, callback=None):
+        self.enabled = enabled
+        self.emit_log = emit_log
+        self.callback = callback
+        self.report = PipelineReport()
+
+
+    # --------------------------------------------------------- #
+    # ------------------------ Methods ------------------------ #
+    def stage(self, name):
+        """ Context manager timing stage ``name``, its ``add``
+            method counting rows, visibilities and bytes.
+        """
+        if not self.enabled:
+            return _no_stage
+        return _Stage(self.report.stage(name))
+
+
+    def emit(self, step):
+        """ Publish the report at the end of a pipeline step.
+        """
+        if not self.enabled:
+            return
+        if self.emit_log:
+            log.info(
+                'Pipeline statistics after {}:\n{}'.format(
+                    step,
+                    self.report
+                )
+            )
+        if self.callback is not None:
+            self.callback(step, self.report)
+        return
+
+
+    def reset(self):
+        self.report = PipelineReport()
+        return
+# ============================================================= #
+
@@ -14,20 +14,88 @@ __all__ = [
 
 
 from cmspy.CustomMS import MSParset
-from cmspy.MS import add_src
-from cmspy.Astro import to_skycoord
+from cmspy.CustomMS.instrumentation import Instrumentation
+from cmspy.MS import (
+    add_src,
+    add_srcs,
+    add_srcs_antenna,
+    add_srcs_recurrence,
+    recurrence_error,
+    fft_grid,
+    add_srcs_fft,
+    fft_error,
+    noise_sigma,
+    thermal_noise,
+    jones_table,
+    apply_jones
+)
+from cmspy.Astro import (
+    to_skycoord,
+    read_catalog,
+    catalog2lmn,
+    antenna_uvw,
+    elevation
+)
 
-from casacore.tables import table
+from casacore.tables import (
+    table,
+    default_ms,
+    makearrcoldesc,
+    maketabdesc
+)
 import os
+import json
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+    FIRST_COMPLETED
+)
+import numba
 from os.path import join
 import numpy as np
 from astropy import constants as const
+import astropy.units as u
 import logging
 
 
 log = logging.getLogger(__name__)
 
 
+observation_info = {
+    'OBSERVER': 'alan.loh@obspm.fr',
+    'PROJECT': 'Fake Data',
+    'SCHEDULE_TYPE': 'NenuFAR',
+    'TELESCOPE_NAME': 'NenuFAR'
+}
+
+
+# CORRECTED_DATA keyword recording the predicted sources
+sky_model_keyword = 'CMSPY_SKY_MODEL'
+
+
+# Prediction model of a worker process, sent once by _init_worker
+_worker_model = None
+
+
+# Blocks in flight in _predict_pipelined (read, predicted, written)
+_pipeline_buffers = 3
+
+
+# Cell shape and dtype of the main table columns read by blocks
+_column_buffers = {
+    'UVW': ((3,), np.float64),
+    'TIME': ((), np.float64),
+    'EXPOSURE': ((), np.float64),
+    'DATA_DESC_ID': ((), np.int32),
+    'ANTENNA1': ((), np.int32),
+    'ANTENNA2': ((), np.int32)
+}
+
+
 # ============================================================= #
 # ---------------------- MeasurementSet ----------------------- #
 # ============================================================= #
@@ -36,6 +104,8 @@ class MeasurementSet(MSParset):
     """
     
     def __init__(self, **kwargs):
+        self._metadata = None
+        self.instrumentation = Instrumentation()
         super().__init__(
             **kwargs
         )
@@ -51,27 +121,930 @@ class MeasurementSet(MSParset):
         )
 
 
+    @property
+    def metadata(self):
+        """ Metadata of the MS (phase center, channel
+            frequencies, antenna positions, number of rows...),
+            read once and kept until :meth:`invalidate_metadata`
+            is called. The public methods reading the MS reload
+            them if one of the underlying tables was modified
+            since (checked once per call, not per access).
+        """
+        if self._metadata is None:
+            self._refresh_metadata()
+        return self._metadata
+
+
     @property
     def phase_center(self):
-        ms = table(
-            tablename=join(self.msfile, 'POINTING'),
-            ack=False,
-            readonly=True
-        )
-        center = to_skycoord(
-            np.degrees(ms.getcol('TARGET')[0, 0])
-        )
+        return self.metadata['phase_center']
+
+
+    @property
+    def chan_freq(self):
+        return self.metadata['chan_freq']
+
+
+    @property
+    def chan_width(self):
+        return self.metadata['chan_width']
+
+
+    @property
+    def antenna_positions(self):
+        return self.metadata['antenna_positions']
+
+
+    @property
+    def nrows(self):
+        return self.metadata['nrows']
+
+
+    @property
+    def report(self):
+        """ Statistics recorded since instrumentation was
+            enabled (see :meth:`enable_instrumentation`).
+
+            :rtype: :class:`~cmspy.CustomMS.PipelineReport`
+        """
+        return self.instrumentation.report
+
+
+    @property
+    def sky_model(self):
+        """ Sources predicted in the CORRECTED_DATA column by
+            :meth:`add_data_table`, as a dictionnary
+            ``{name: {'ra': deg, 'dec': deg, 'flux': Jy}}``, or
+            `None` if no compatible sky model is recorded.
+        """
+        self._refresh_metadata()
+        ms = self._main_table(readonly=True)
+        record = self._read_sky_model(ms)
         ms.close()
         del ms
-        return center
-    
-    
+        if (record is None) or\
+            (record['signature'] != self._sky_model_signature()):
+            return None
+        return record['sources']
+
 
     # --------------------------------------------------------- #
     # ------------------------ Methods ------------------------ #
-    def init_empty(self):
+    def invalidate_metadata(self):
+        """ Force the MS metadata to be read again on next
+            access.
+        """
+        self._metadata = None
+        return
+
+
+    def enable_instrumentation(self, emit_log=False, callback=None):
+        """ Record wall time, bytes read/written, rows and
+            visibilities of each stage of :meth:`init_empty`,
+            :meth:`add_desc_tables` and :meth:`add_data_table`
+            (see :attr:`report`).
+
+            :param emit_log:
+                Log the report at the end of each step.
+            :type emit_log:
+                `bool`
+            :param callback:
+                Function called as ``callback(step, report)`` at
+                the end of each step.
+            :type callback:
+                `callable`
+        """
+        self.instrumentation = Instrumentation(
+            enabled=True,
+            emit_log=emit_log,
+            callback=callback
+        )
+        return
+
+
+    def disable_instrumentation(self):
+        """ Stop recording pipeline statistics.
+        """
+        self.instrumentation = Instrumentation()
+        return
+
+
+    def init_empty(self, native=False):
         """ Run `makems` to produce an empty MS thanks to the
             config file defined by current attributes of MSParset
+
+            :param native:
+                If `True`, the MS is directly built with
+                python-casacore instead of `makems`, so that the
+                LOFAR software is not needed.
+            :type native:
+                `bool`
+        """
+        with self.instrumentation.stage('init_empty'):
+            if native:
+                self._create_native()
+            else:
+                self._run_makems()
+        self.invalidate_metadata()
+        self.instrumentation.emit('init_empty')
+        return
+
+
+    def add_desc_tables(self):
+        """ Empty created MS is missing some required tables for
+            further analysis with radio imager softwares.
+        """
+        with self.instrumentation.stage('add_desc_tables'):
+            # OBSERVATION table
+            ms = table(
+                tablename=join(self.msfile, 'OBSERVATION'),
+                ack=False,
+                readonly=False
+            )
+            for key, value in observation_info.items():
+                column = ms.getcol(key)
+                column[0] = value
+                ms.putcol(key, column)
+            ms.flush()
+            ms.close()
+            del column, ms
+
+            # SPECTRAL_WINDOW and DATA_DESCRIPTION tables
+            # I think everything is fine here
+
+            # FIELD and POINTING tables
+            ms = table(
+                tablename=join(self.msfile, 'POINTING'),
+                ack=False,
+                readonly=False
+            )
+            tracking = ms.getcol('TRACKING')
+            tracking[...] = True
+            ms.putcol('TRACKING', tracking)
+            ms.flush()
+            ms.close()
+            del tracking, ms
+
+        self.invalidate_metadata()
+        log.info(
+            'OBSERVATION and POINTING tables updated.'
+        )
+        self.instrumentation.emit('add_desc_tables')
+        return
+
+
+    def add_data_table(self, sources, chunksize=None, memory_limit=None,
+            engine='fused', anchor=32, workers=None, partition='rows',
+            uvw_from='ms', precision='double', incremental=False,
+            pipeline=True, selection=None, epsilon=1e-4,
+            min_elevation=None, min_flux=None, cull_interval=600.,
+            sefd=None, seed=None, gains=None, gain_times=None):
+        """ Add the data related tables, seize opportunity to
+            possibly simulate point sources.
+
+            The main table is walked in blocks of rows, each
+            block is predicted and written back before the next
+            one is read, so that the peak memory only depends on
+            the block size and not on the observation length.
+
+            The predicted sources are recorded (with the phase
+            center and the channel frequencies) in the
+            ``CMSPY_SKY_MODEL`` keyword of CORRECTED_DATA, see
+            :attr:`sky_model`.
+
+            :param sources:
+                Dictionnary like 
+                {
+                    'source1': {'ra': 0, 'dec': 0, 'flux': 1},
+                    'source2': {'ra': 0, 'dec': 0, 'flux': 1}
+                }
+            :type sources:
+                `dict`
+            :param chunksize:
+                Number of rows processed at once. If `None`
+                (and `memory_limit` is `None` too), the whole
+                table is processed in a single block (or in one
+                block per worker).
+            :type chunksize:
+                `int`
+            :param memory_limit:
+                Approximate memory budget (in MB) of one block of
+                rows, used to derive the block size if
+                `chunksize` is not given. With ``pipeline``, it is
+                shared by the blocks being read, predicted and
+                written at once.
+            :type memory_limit:
+                `float`
+            :param engine:
+                Prediction engine, either ``'fused'`` (all the
+                sources are summed in a single parallel pass, see
+                :func:`~cmspy.MS.add_srcs`), ``'antenna'``
+                (phases computed per antenna and combined per
+                baseline, see :func:`~cmspy.MS.add_srcs_antenna`)
+                ``'recurrence'`` (complex-multiply recurrence along
+                evenly spaced channels, see
+                :func:`~cmspy.MS.add_srcs_recurrence`), ``'fft'``
+                (sources gridded and Fourier transformed once per
+                w-plane, visibilities being interpolated from the
+                grids, see :func:`~cmspy.MS.add_srcs_fft`) or
+                ``'loop'`` (one :func:`~cmspy.MS.add_src` call per
+                source).
+
+                The ``'fft'`` engine trades the exactness of the
+                direct sums for a cost that barely depends on the
+                number of sources: planning the w-planes costs
+                about one FFT of ``(4 uvw_max max|l|)^2`` cells
+                per w-plane, the number of w-planes growing with
+                ``uvw_max`` times the spread of n - 1 (i.e. with
+                the field of view), and each visibility costs
+                ``W^3`` kernel operations instead of one complex
+                exponential per source. It pays off for dense sky
+                models (thousands of sources or model images, see
+                :func:`~cmspy.Astro.read_image`) over compact
+                fields, with errors about ``epsilon`` times the
+                total flux.
+            :type engine:
+                `str`
+            :param anchor:
+                Number of channels between two exact exponential
+                evaluations for the ``'recurrence'`` engine.
+            :type anchor:
+                `int`
+            :param workers:
+                Number of processes predicting blocks in parallel.
+                Each worker reads its own rows (without locking)
+                and sends back the visibilities, the current
+                process being the only one writing in the MS.
+                If `None` or 1, everything runs in the current
+                process. As worker processes are spawned, scripts
+                using this option must be protected by
+                ``if __name__ == '__main__':``.
+            :type workers:
+                `int`
+            :param partition:
+                How the main table is split between workers, in
+                contiguous row ranges (``'rows'``) or per spectral
+                window (``'spw'``, i.e. per ``DATA_DESC_ID``).
+            :type partition:
+                `str`
+            :param uvw_from:
+                Either ``'ms'`` to use the UVW column, or
+                ``'antennas'`` to compute UVW from the ANTENNA
+                positions and the TIME column (see
+                :func:`~cmspy.Astro.antenna_uvw`). With the
+                ``'antenna'`` engine, the latter also skips the
+                derivation of per-antenna UVW from the baselines.
+            :type uvw_from:
+                `str`
+            :param precision:
+                ``'double'`` or ``'single'``. In single precision,
+                phases are still computed from float64 UVW, but
+                exponentials and sums over the sources are
+                evaluated in float32/complex64 and the blocks are
+                complex64, the error being bounded as explained in
+                :func:`~cmspy.MS.add_srcs`.
+            :type precision:
+                `str`
+            :param incremental:
+                If `True` and a sky model is recorded for the
+                same phase center and frequencies, only the
+                difference with ``sources`` is predicted (removed
+                or modified sources being subtracted, new or
+                modified ones added) and accumulated in
+                CORRECTED_DATA by blocks of rows. Otherwise, the
+                whole sky model is predicted.
+            :type incremental:
+                `bool`
+            :param pipeline:
+                Without worker processes, read the next block of
+                rows and write the previous one in background
+                threads while the current block is predicted
+                (see :func:`_predict_pipelined`), so that the
+                I/O and the prediction overlap. If `False`, each
+                block is read, predicted and written in turn.
+            :type pipeline:
+                `bool`
+            :param selection:
+                Only predict (read and write) the rows selected
+                by :meth:`select_rows`, other rows of
+                CORRECTED_DATA being left untouched. As the column
+                then no longer holds a single sky model, its
+                record (see :attr:`sky_model`) is removed.
+            :type selection:
+                `str` or `dict`
+            :param epsilon:
+                Target accuracy (relative to the total flux) of
+                the ``'fft'`` engine, setting its kernel support
+                (see :func:`~cmspy.MS.fft_grid`).
+            :type epsilon:
+                `float`
+            :param min_elevation:
+                If set, sources below this elevation (in degrees,
+                seen from the mean antenna position) during a
+                whole time window of ``cull_interval`` seconds
+                are not predicted for the rows of that window
+                (see :meth:`_culling_index`). With the ``'fft'``
+                engine, only the sources below it during the
+                whole observation are dropped.
+            :type min_elevation:
+                `float`
+            :param min_flux:
+                If set, sources whose absolute flux (in Jy) is
+                below it are not predicted.
+            :type min_flux:
+                `float`
+            :param cull_interval:
+                Duration (in seconds) of the time windows over
+                which the visibility of the sources is evaluated
+                (windows are aligned on multiples of it, so that
+                the predicted sources do not depend on the
+                blocks of rows).
+            :type cull_interval:
+                `float`
+            :param sefd:
+                If set, system equivalent flux density (Jy) of
+                all the antennas (or one per antenna), thermal
+                noise of standard deviation
+                ``sqrt(SEFD1 SEFD2 / (2 df dt))`` (see
+                :func:`~cmspy.MS.noise_sigma`) on the real and
+                imaginary parts being added to the predicted
+                visibilities, with ``df`` the CHAN_WIDTH and
+                ``dt`` the EXPOSURE of each row. SIGMA is set to
+                this standard deviation and WEIGHT to
+                ``1 / SIGMA^2`` in the same pass.
+            :type sefd:
+                `float` or `np.ndarray`
+            :param seed:
+                Master seed of the noise. The noise of a row only
+                depends on it and on the row number (see
+                :func:`~cmspy.MS.thermal_noise`), whatever
+                ``chunksize``, ``workers`` or ``selection``. If
+                `None`, a seed is drawn and logged.
+            :type seed:
+                `int`
+            :param gains:
+                If set, per-antenna gains corrupting the predicted
+                visibilities as ``G_p V_pq G_q^H`` (before the
+                thermal noise), either scalar
+                (times, antennas, spws, chans) or 2x2 Jones
+                matrices (times, antennas, spws, chans, 2, 2), axes
+                of length 1 being broadcast (see
+                :func:`~cmspy.MS.jones_table` and
+                :func:`~cmspy.MS.random_gains`). May also be the
+                name of a ``.npz`` file with ``gains`` and
+                ``times`` arrays. Sources being unpolarized, the
+                predicted coherency corrupted by 2x2 Jones
+                matrices is ``diag(XX, YY)``: the XY and YX
+                correlations only hold the leakage terms (they
+                are otherwise filled like XX and YY).
+            :type gains:
+                `np.ndarray` or `str`
+            :param gain_times:
+                TIME of the gain solutions, the nearest one being
+                applied to each row.
+            :type gain_times:
+                `np.ndarray`
+        """
+        self._refresh_metadata()
+        sky_model = _sky_model_dict(sources)
+        with self.instrumentation.stage('add_data_table') as total:
+            ms = self._main_table(readonly=False)
+            nrows = ms.nrows()
+            nwritten = 0
+            signature = self._sky_model_signature()
+            culling = {
+                'min_elevation': min_elevation,
+                'min_flux': min_flux,
+                'cull_interval': cull_interval
+            } if (min_elevation is not None) or (min_flux is not None)\
+                else None
+            noise = None
+            if sefd is not None:
+                seed = _noise_seed(seed)
+                noise = {'sefd': np.asarray(sefd).tolist(), 'seed': seed}
+            if gains is not None:
+                # Loaded once, shared by all the blocks
+                gains = jones_table(gains, gain_times)
+                gain_times = None
+            jones = None if gains is None else gains['signature']
+            accumulate = False
+            if incremental and (selection is None):
+                record = self._read_sky_model(ms)
+                if (record is not None) and\
+                    (record['signature'] == signature) and\
+                    (record.get('culling') == culling) and\
+                    (record.get('noise') == noise) and\
+                    (record.get('jones') == jones):
+                    sources = _sky_model_delta(record['sources'], sky_model)
+                    # The recorded noise is already in CORRECTED_DATA
+                    sefd = None
+                    accumulate = True
+                    log.info(
+                        'Incremental update of {} source(s).'.format(
+                            len(sources)
+                        )
+                    )
+                else:
+                    log.info(
+                        'No sky model recorded for this setup, '
+                        'full prediction.'
+                    )
+            options = {
+                'sources': sources,
+                'chunksize': chunksize,
+                'memory_limit': memory_limit,
+                'engine': engine,
+                'anchor': anchor,
+                'workers': workers,
+                'partition': partition,
+                'uvw_from': uvw_from,
+                'precision': precision,
+                'selection': selection,
+                'epsilon': epsilon,
+                'min_elevation': min_elevation,
+                'min_flux': min_flux,
+                'cull_interval': cull_interval,
+                'sefd': sefd,
+                'seed': seed,
+                'gains': gains
+            }
+            if len(sources) == 0:
+                # CORRECTED_DATA is still reset (to the noise only)
+                # so that it matches the recorded empty sky model
+                options.update(
+                    engine='fused',
+                    min_elevation=None,
+                    min_flux=None
+                )
+            if (len(sources) == 0) and accumulate:
+                written = []
+            elif pipeline and ((workers is None) or (int(workers) <= 1)):
+                if memory_limit is not None:
+                    options['memory_limit'] = memory_limit / _pipeline_buffers
+                model, blocks = self._prediction_plan(ms=ms, **options)
+                written = _predict_pipelined(
+                    ms=ms,
+                    blocks=blocks,
+                    model=model,
+                    instrument=self.instrumentation,
+                    accumulate=accumulate
+                )
+            else:
+                written = _write_predictions(
+                    ms=ms,
+                    predictions=self._predictions(**options),
+                    instrument=self.instrumentation,
+                    accumulate=accumulate
+                )
+            for nrow in written:
+                nwritten += nrow
+                total.add(
+                    rows=nrow,
+                    visibilities=nrow * self.chan_freq.shape[1]
+                )
+                log.info(
+                    'Rows {} / {} predicted.'.format(
+                        nwritten,
+                        nrows
+                    )
+                )
+            if selection is None:
+                ms.putcolkeyword(
+                    'CORRECTED_DATA',
+                    sky_model_keyword,
+                    json.dumps({
+                        'signature': signature,
+                        'sources': sky_model,
+                        'culling': culling,
+                        'noise': noise,
+                        'jones': jones
+                    })
+                )
+            elif sky_model_keyword in ms.getcolkeywords('CORRECTED_DATA'):
+                ms.removecolkeyword('CORRECTED_DATA', sky_model_keyword)
+            ms.flush()
+            ms.close()
+            del ms
+        self.instrumentation.emit('add_data_table')
+        return
+
+
+    def predict(self, sources, chunksize=None, memory_limit=None,
+            engine='fused', anchor=32, workers=None, partition='rows',
+            uvw_from='ms', precision='double', selection=None,
+            epsilon=1e-4, min_elevation=None, min_flux=None,
+            cull_interval=600., sefd=None, seed=None, gains=None,
+            gain_times=None):
+        """ Predict the visibilities of ``sources`` block of rows
+            by block of rows, without writing them. Parameters
+            are the same as :meth:`add_data_table`.
+
+            :returns: Generator of ``(block, visibilities)``,
+                ``block`` being either a ``(startrow, nrow)``
+                tuple or an array of row numbers.
+            :rtype: `generator`
+        """
+        predictions = self._predictions(
+            sources=sources,
+            chunksize=chunksize,
+            memory_limit=memory_limit,
+            engine=engine,
+            anchor=anchor,
+            workers=workers,
+            partition=partition,
+            uvw_from=uvw_from,
+            precision=precision,
+            selection=selection,
+            epsilon=epsilon,
+            min_elevation=min_elevation,
+            min_flux=min_flux,
+            cull_interval=cull_interval,
+            sefd=sefd,
+            seed=seed,
+            gains=gains,
+            gain_times=gain_times
+        )
+        for block, data, _ in predictions:
+            yield block, data
+        return
+
+
+    def select_rows(self, selection, chunksize=1000000, ms=None):
+        """ Row numbers of the main table matching
+            ``selection``.
+
+            :param selection:
+                Either a TaQL expression (e.g.
+                ``'DATA_DESC_ID IN [0, 1] AND ANTENNA1 != ANTENNA2'``,
+                MS on disk only) or a dictionnary of filters on
+                the ``'TIME'``, ``'DATA_DESC_ID'``, ``'ANTENNA1'``
+                and ``'ANTENNA2'`` columns, all to be fulfilled.
+                A filter given as a ``(start, stop)`` tuple keeps
+                ``start <= value < stop`` (either bound may be
+                `None`, times may be :class:`~astropy.time.Time`),
+                a value or a list of values keeps the rows equal
+                to one of them.
+            :type selection:
+                `str` or `dict`
+            :param chunksize:
+                Number of rows read at once to evaluate a
+                dictionnary of filters.
+            :type chunksize:
+                `int`
+
+            :returns: Sorted row numbers.
+            :rtype: `np.ndarray`
+
+            :Example:
+
+            >>> ms.select_rows({
+                    'TIME': (Time('2020-01-01T12:00:00'), None),
+                    'DATA_DESC_ID': [3, 4],
+                    'ANTENNA1': 0
+                })
+
+        """
+        own_table = ms is None
+        if own_table:
+            self._refresh_metadata()
+            ms = self._main_table(readonly=True)
+        if isinstance(selection, str):
+            if not hasattr(ms, 'query'):
+                raise ValueError(
+                    'TaQL selections are only available for MS on disk.'
+                )
+            subset = ms.query(selection)
+            rownrs = np.asarray(subset.rownumbers(ms), dtype=np.int64)
+            subset.close()
+        else:
+            unknown = set(selection) - set(_selection_columns)
+            if unknown:
+                raise ValueError(
+                    'Selection only applies to {}, not {}'.format(
+                        _selection_columns,
+                        sorted(unknown)
+                    )
+                )
+            rownrs = []
+            for startrow, nrow in self._row_blocks(ms.nrows(), 0, 0, chunksize):
+                mask = np.ones(nrow, dtype=bool)
+                for column, condition in selection.items():
+                    values = ms.getcol(column, startrow=startrow, nrow=nrow)
+                    mask &= _selection_mask(values, condition)
+                rownrs.append(startrow + np.where(mask)[0])
+            rownrs = np.concatenate(rownrs).astype(np.int64)\
+                if rownrs else np.zeros(0, dtype=np.int64)
+        if own_table:
+            ms.close()
+        log.info(
+            '{} / {} rows selected.'.format(
+                rownrs.size,
+                self.nrows
+            )
+        )
+        return rownrs
+
+
+    def check_uvw(self, chunksize=None):
+        """ Compare the UVW column to the UVW computed from the
+            ANTENNA positions and the TIME column (see
+            :func:`~cmspy.Astro.antenna_uvw`).
+
+            :param chunksize:
+                Number of rows processed at once.
+            :type chunksize:
+                `int`
+
+            :returns: Maximal absolute difference in meters
+            :rtype: `float`
+        """
+        self._refresh_metadata()
+        deviation = 0.
+        if self.nrows == 0:
+            return deviation
+        ms = self._main_table(readonly=True)
+        for block in self._row_blocks(self.nrows, 0, 0, chunksize):
+            uvw, _ = _compute_block_uvw(
+                ms,
+                block,
+                self.antenna_positions,
+                self.phase_center
+            )
+            if uvw.size:
+                deviation = max(
+                    deviation,
+                    np.abs(uvw - _get_block(ms, block, 'UVW')).max()
+                )
+        ms.close()
+        del ms
+        log.info(
+            'UVW of {} deviate by at most {:.3e} m.'.format(
+                self.msfile,
+                deviation
+            )
+        )
+        return deviation
+
+
+    def regenerate_uvw(self, chunksize=None):
+        """ Overwrite the UVW column with the UVW computed from
+            the ANTENNA positions and the TIME column (see
+            :func:`~cmspy.Astro.antenna_uvw`).
+
+            :param chunksize:
+                Number of rows processed at once.
+            :type chunksize:
+                `int`
+        """
+        self._refresh_metadata()
+        if self.nrows == 0:
+            return
+        ms = self._main_table(readonly=False)
+        for block in self._row_blocks(self.nrows, 0, 0, chunksize):
+            uvw, _ = _compute_block_uvw(
+                ms,
+                block,
+                self.antenna_positions,
+                self.phase_center
+            )
+            _put_block(ms, block, 'UVW', uvw)
+        # Visibilities no longer match the recorded sky model
+        if sky_model_keyword in ms.getcolkeywords('CORRECTED_DATA'):
+            ms.removecolkeyword('CORRECTED_DATA', sky_model_keyword)
+        ms.flush()
+        ms.close()
+        del ms
+        self.invalidate_metadata()
+        log.info(
+            'UVW of {} regenerated.'.format(
+                self.msfile
+            )
+        )
+        return
+
+
+    # --------------------------------------------------------- #
+    # ----------------------- Internal ------------------------ #
+    def _predictions(self, workers=None, **options):
+        """ Generator of the ``(block, visibilities, sigma)`` of
+            :meth:`predict`, ``sigma`` being the thermal noise of
+            each row (see :func:`_add_noise`), `None` without
+            noise.
+        """
+        self._refresh_metadata()
+        ms = self._main_table(readonly=True)
+        model, blocks = self._prediction_plan(
+            ms=ms,
+            workers=workers,
+            **options
+        )
+        workers = 1 if workers is None else int(workers)
+        if workers > 1:
+            predictions = _predict_parallel(
+                msfile=self.msfile,
+                blocks=blocks,
+                model=model,
+                workers=workers,
+                instrument=self.instrumentation
+            )
+        else:
+            predictions = (
+                (block,) + _predict_block(
+                    ms, block, model, self.instrumentation
+                )
+                for block in blocks
+            )
+        for prediction in predictions:
+            yield prediction
+        ms.close()
+        del ms
+        return
+
+
+    def _prediction_plan(self, ms, sources, chunksize, memory_limit,
+            engine, anchor, workers, partition, uvw_from, precision,
+            selection=None, epsilon=1e-4, min_elevation=None,
+            min_flux=None, cull_interval=600., sefd=None, seed=None,
+            gains=None, gain_times=None):
+        """ Check the prediction options (see
+            :meth:`add_data_table`) and return the ``model``
+            given to :func:`_predict_block` with the list of
+            blocks of rows of the main table ``ms``.
+        """
+        if engine not in ['fused', 'antenna', 'recurrence', 'fft', 'loop']:
+            raise ValueError(
+                'Unknown prediction engine {}'.format(engine)
+            )
+        if partition not in ['rows', 'spw']:
+            raise ValueError(
+                'Unknown partition {}'.format(partition)
+            )
+        if uvw_from not in ['ms', 'antennas']:
+            raise ValueError(
+                'Unknown UVW origin {}'.format(uvw_from)
+            )
+        if precision not in ['double', 'single']:
+            raise ValueError(
+                'Unknown precision {}'.format(precision)
+            )
+        workers = 1 if workers is None else int(workers)
+        nrows = self.nrows
+        chans = self.chan_freq
+        phase_center = self.phase_center
+        catalog = read_catalog(sources)
+        model = {
+            'engine': engine,
+            'anchor': anchor,
+            'precision': precision,
+            'phase_center': phase_center,
+            'chan_freq': chans,
+            'nbands': self.nbands,
+            'lmn': catalog2lmn(
+                catalog=(catalog['ra'], catalog['dec']),
+                phase_center=phase_center
+            ),
+            'flux': catalog['flux'],
+            'radec': (catalog['ra'], catalog['dec']),
+            'positions': self.antenna_positions\
+                if uvw_from == 'antennas' else None,
+            'visible': None,
+            'noise': self._noise_model(sefd, seed),
+            'jones': gains if isinstance(gains, dict) or (gains is None)\
+                else jones_table(gains, gain_times)
+        }
+        shape, dtype = _data_cell(ms, 'DATA')
+        model['npol'] = shape[-1]
+        model['dtype'] = dtype if precision == 'double' else np.complex64
+        selected = None
+        if selection is not None:
+            selected = self.select_rows(selection, ms=ms)
+            nrows = selected.size
+        if nrows == 0:
+            return model, []
+        if (min_elevation is not None) or (min_flux is not None):
+            visible, window0 = self._culling_index(
+                ms=ms,
+                catalog=catalog,
+                min_elevation=min_elevation,
+                min_flux=min_flux,
+                interval=cull_interval
+            )
+            # Sources never predicted are dropped once for all
+            kept = visible.any(axis=0)
+            model['lmn'] = tuple(coord[kept] for coord in model['lmn'])
+            model['flux'] = model['flux'][kept]
+            model['radec'] = tuple(coord[kept] for coord in model['radec'])
+            model['visible'] = visible[:, kept]
+            model['window0'] = window0
+            model['interval'] = cull_interval
+            log.info(
+                'Culling: {} / {} sources kept, {:.1f}% of the '
+                'source-windows predicted.'.format(
+                    kept.sum(),
+                    kept.size,
+                    100 * visible.mean() if visible.size else 0.
+                )
+            )
+        if engine == 'recurrence':
+            # Report accuracy against the direct evaluation
+            nsample = min(nrows, 256)
+            error, rel_error = recurrence_error(
+                uvw=ms.getcol('UVW', nrow=nsample),
+                desc=ms.getcol('DATA_DESC_ID', nrow=nsample),
+                chan_freq=chans,
+                lmn=model['lmn'],
+                flux=model['flux'],
+                anchor=anchor,
+                precision=precision
+            )
+            log.info(
+                'Frequency recurrence error: {:.3e} '
+                '({:.3e} relative to total flux).'.format(
+                    error,
+                    rel_error
+                )
+            )
+        elif engine == 'fft':
+            # Grids cover the longest baseline at the highest frequency
+            cell = getattr(sources, 'meta', {}).get('cell')
+            positions = self.antenna_positions
+            baselines = positions[:, None, :] - positions[None, :, :]
+            model['fft'] = fft_grid(
+                lmn=model['lmn'],
+                flux=model['flux'],
+                uvw_max=1.01 * np.sqrt((baselines**2).sum(axis=-1)).max() *\
+                    chans.max() / const.c.value,
+                epsilon=epsilon,
+                precision=precision,
+                cell=None if cell is None else np.radians(cell)
+            )
+            nsample = min(nrows, 256)
+            error, rel_error = fft_error(
+                uvw=ms.getcol('UVW', nrow=nsample),
+                desc=ms.getcol('DATA_DESC_ID', nrow=nsample),
+                chan_freq=chans,
+                lmn=model['lmn'],
+                flux=model['flux'],
+                grid=model['fft']
+            )
+            log.info(
+                'FFT prediction error: {:.3e} '
+                '({:.3e} relative to total flux).'.format(
+                    error,
+                    rel_error
+                )
+            )
+        if (workers > 1) and (chunksize is None) and (memory_limit is None):
+            chunksize = -(-nrows // workers)
+        if partition == 'spw':
+            if selected is None:
+                desc = ms.getcol('DATA_DESC_ID')
+                selected = np.arange(nrows)
+            else:
+                desc = _get_block(ms, selected, 'DATA_DESC_ID')
+            blocks = []
+            for spw in np.unique(desc):
+                rownrs = selected[desc == spw]
+                blocks += [
+                    _compact_block(rownrs[startrow:startrow + nrow])
+                    for startrow, nrow in self._row_blocks(
+                        nrows=rownrs.size,
+                        nchans=chans.shape[1],
+                        npol=model['npol'],
+                        chunksize=chunksize,
+                        memory_limit=memory_limit
+                    )
+                ]
+            del desc
+        else:
+            blocks = self._row_blocks(
+                nrows=nrows,
+                nchans=chans.shape[1],
+                npol=model['npol'],
+                chunksize=chunksize,
+                memory_limit=memory_limit
+            )
+            if selected is not None:
+                blocks = [
+                    _compact_block(selected[startrow:startrow + nrow])
+                    for startrow, nrow in blocks
+                ]
+        return model, blocks
+
+
+    def _main_table(self, readonly=True):
+        """ Open the main table of the MS.
+        """
+        return table(
+            tablename=self.msfile,
+            ack=False,
+            readonly=readonly
+        )
+
+
+    def _run_makems(self):
+        """ Run `makems` on the parset written from the current
+            attributes.
         """
         self.write_parset()
         log.info(
@@ -99,131 +1072,1116 @@ class MeasurementSet(MSParset):
         return
 
 
-    def add_desc_tables(self):
-        """ Empty created MS is missing some required tables for
-            further analysis with radio imager softwares.
+    def _create_native(self):
+        """ Build the empty MS with python-casacore, from the
+            current attributes of MSParset.
         """
-        # OBSERVATION table
-        ms = table(
-            tablename=join(self.msfile, 'OBSERVATION'),
+        if not self.check_conformity():
+            raise Exception(
+                'Attributes are not properly filled.'
+            )
+        log.info(
+            'Creating empty MS {}...'.format(
+                self.msfile
+            )
+        )
+        antenna = table(
+            tablename=self._anttable,
+            ack=False,
+            readonly=True
+        )
+        nant = antenna.nrows()
+        positions = antenna.getcol('POSITION')
+        freqs = self.frequencies
+        nchans = freqs.shape[1]
+        times = self.times
+        dt = self.dt.to(u.s).value
+        ra = self.ra.to(u.rad).value
+        dec = self.dec.to(u.rad).value
+        npol = 4
+
+        # Main table
+        ms = default_ms(
+            self.msfile,
+            maketabdesc([
+                makearrcoldesc(
+                    column,
+                    0.j,
+                    shape=[nchans, npol],
+                    valuetype='complex',
+                    options=4
+                ) for column in ['DATA', 'MODEL_DATA', 'CORRECTED_DATA']
+            ])
+        )
+        ms.putcolkeyword('UVW', 'MEASINFO', {'type': 'uvw', 'Ref': 'J2000'})
+
+        # ANTENNA table
+        sub = table(
+            tablename=join(self.msfile, 'ANTENNA'),
             ack=False,
             readonly=False
         )
-        observer = ms.getcol('OBSERVER')
-        project = ms.getcol('PROJECT')
-        schedule = ms.getcol('SCHEDULE_TYPE')
-        telescope = ms.getcol('TELESCOPE_NAME')
-        observer[0] = 'alan.loh@obspm.fr'
-        project[0] = 'Fake Data'
-        schedule[0] = 'NenuFAR'
-        telescope[0] = 'NenuFAR'
-        ms.putcol('OBSERVER', observer)
-        ms.putcol('PROJECT', project)
-        ms.putcol('SCHEDULE_TYPE', schedule)
-        ms.putcol('TELESCOPE_NAME', telescope)
-        ms.flush()
-        ms.close()
-        del observer, project, schedule, telescope, ms
-        
-        # SPECTRAL_WINDOW and DATA_DESCRIPTION tables
-        # I think everything is fine here
-        
+        sub.addrows(nant)
+        for column in antenna.colnames():
+            if column in sub.colnames():
+                sub.putcol(column, antenna.getcol(column))
+        sub.close()
+        antenna.close()
+        del antenna
+
+        # FEED table
+        sub = table(
+            tablename=join(self.msfile, 'FEED'),
+            ack=False,
+            readonly=False
+        )
+        sub.addrows(nant)
+        sub.putcol('ANTENNA_ID', np.arange(nant))
+        sub.putcol('FEED_ID', np.zeros(nant, dtype=int))
+        sub.putcol('SPECTRAL_WINDOW_ID', np.full(nant, -1))
+        sub.putcol('BEAM_ID', np.full(nant, -1))
+        sub.putcol('TIME', np.full(nant, times.mean()))
+        sub.putcol('INTERVAL', np.full(nant, self.nt * dt))
+        sub.putcol('NUM_RECEPTORS', np.full(nant, 2))
+        sub.putcol('POLARIZATION_TYPE', np.tile(['X', 'Y'], (nant, 1)))
+        sub.putcol('POL_RESPONSE', np.tile(np.eye(2, dtype=complex), (nant, 1, 1)))
+        sub.putcol('BEAM_OFFSET', np.zeros((nant, 2, 2)))
+        sub.putcol('RECEPTOR_ANGLE', np.tile([0., np.pi/2], (nant, 1)))
+        sub.putcol('POSITION', np.zeros((nant, 3)))
+        sub.close()
+
+        # SPECTRAL_WINDOW table
+        sub = table(
+            tablename=join(self.msfile, 'SPECTRAL_WINDOW'),
+            ack=False,
+            readonly=False
+        )
+        df = self.df.to(u.Hz).value
+        sub.addrows(self.nbands)
+        sub.putcol('NAME', ['SB-{}'.format(i) for i in range(self.nbands)])
+        sub.putcol('NUM_CHAN', np.full(self.nbands, nchans))
+        sub.putcol('CHAN_FREQ', freqs)
+        sub.putcol('CHAN_WIDTH', np.full(freqs.shape, df))
+        sub.putcol('EFFECTIVE_BW', np.full(freqs.shape, df))
+        sub.putcol('RESOLUTION', np.full(freqs.shape, df))
+        sub.putcol('REF_FREQUENCY', freqs.mean(axis=1))
+        sub.putcol('TOTAL_BANDWIDTH', np.full(self.nbands, nchans * df))
+        sub.putcol('MEAS_FREQ_REF', np.full(self.nbands, 5)) # TOPO
+        sub.putcol('NET_SIDEBAND', np.ones(self.nbands, dtype=int))
+        sub.close()
+
+        # POLARIZATION and DATA_DESCRIPTION tables
+        sub = table(
+            tablename=join(self.msfile, 'POLARIZATION'),
+            ack=False,
+            readonly=False
+        )
+        sub.addrows(1)
+        sub.putcol('NUM_CORR', np.array([npol]))
+        sub.putcol('CORR_TYPE', np.array([[9, 10, 11, 12]])) # XX XY YX YY
+        sub.putcol('CORR_PRODUCT', np.array([[[0, 0], [0, 1], [1, 0], [1, 1]]]))
+        sub.close()
+        sub = table(
+            tablename=join(self.msfile, 'DATA_DESCRIPTION'),
+            ack=False,
+            readonly=False
+        )
+        sub.addrows(self.nbands)
+        sub.putcol('SPECTRAL_WINDOW_ID', np.arange(self.nbands))
+        sub.putcol('POLARIZATION_ID', np.zeros(self.nbands, dtype=int))
+        sub.close()
+
         # FIELD and POINTING tables
-        ms = table(
+        sub = table(
+            tablename=join(self.msfile, 'FIELD'),
+            ack=False,
+            readonly=False
+        )
+        direction = np.array([[[ra, dec]]])
+        sub.addrows(1)
+        sub.putcol('NAME', ['BEAM_0'])
+        sub.putcol('CODE', [''])
+        sub.putcol('TIME', np.array([times[0] - dt/2]))
+        sub.putcol('NUM_POLY', np.zeros(1, dtype=int))
+        sub.putcol('DELAY_DIR', direction)
+        sub.putcol('PHASE_DIR', direction)
+        sub.putcol('REFERENCE_DIR', direction)
+        sub.close()
+        sub = table(
             tablename=join(self.msfile, 'POINTING'),
             ack=False,
             readonly=False
         )
-        tracking = ms.getcol('TRACKING')
-        tracking[...] = True
-        ms.putcol('TRACKING', tracking)
+        sub.addrows(nant)
+        sub.putcol('ANTENNA_ID', np.arange(nant))
+        sub.putcol('TIME', np.full(nant, times.mean()))
+        sub.putcol('TIME_ORIGIN', np.full(nant, times[0] - dt/2))
+        sub.putcol('INTERVAL', np.full(nant, self.nt * dt))
+        sub.putcol('NAME', ['BEAM_0'] * nant)
+        sub.putcol('NUM_POLY', np.zeros(nant, dtype=int))
+        sub.putcol('DIRECTION', np.repeat(direction, nant, axis=0))
+        sub.putcol('TARGET', np.repeat(direction, nant, axis=0))
+        sub.putcol('TRACKING', np.ones(nant, dtype=bool))
+        sub.close()
+
+        # OBSERVATION table
+        sub = table(
+            tablename=join(self.msfile, 'OBSERVATION'),
+            ack=False,
+            readonly=False
+        )
+        sub.addrows(1)
+        sub.putcol('TIME_RANGE', np.array([[times[0] - dt/2, times[-1] + dt/2]]))
+        for key, value in observation_info.items():
+            sub.putcol(key, [value])
+        sub.close()
+        del sub
+
+        # Main table, filled per block of time steps
+        nbl = nant * (nant + 1) // 2
+        ms.addrows(self.nt * self.nbands * nbl)
+        ntimes = max(1, 100000 // (self.nbands * nbl))
+        for tstart in range(0, self.nt, ntimes):
+            columns = self._main_columns(
+                positions=positions,
+                tstart=tstart,
+                tstop=min(tstart + ntimes, self.nt)
+            )
+            nrow = columns['TIME'].size
+            startrow = tstart * self.nbands * nbl
+            columns['WEIGHT'] = np.ones((nrow, npol), dtype=np.float32)
+            columns['SIGMA'] = np.ones((nrow, npol), dtype=np.float32)
+            columns['FLAG'] = np.zeros((nrow, nchans, npol), dtype=bool)
+            zeros = np.zeros((nrow, nchans, npol), dtype=np.complex64)
+            for column in ['DATA', 'MODEL_DATA', 'CORRECTED_DATA']:
+                columns[column] = zeros
+            with self.instrumentation.stage('init_empty.write') as stage:
+                for column, values in columns.items():
+                    ms.putcol(column, values, startrow=startrow, nrow=nrow)
+                stage.add(
+                    rows=nrow,
+                    bytes_written=sum(
+                        values.nbytes for values in columns.values()
+                    )
+                )
+            del columns, zeros
         ms.flush()
         ms.close()
-        del tracking, ms
-
+        del ms
         log.info(
-            'OBSERVATION and POINTING tables updated.'
+            'Empty MS {} created'.format(
+                self.msfile
+            )
         )
         return
 
 
-    def add_data_table(self, sources):
-        """ Add the data related tables, seize opportunity to
-            possibly simulate point sources.
+    def _sky_model_signature(self):
+        """ Setup the recorded sky model is only valid for.
+        """
+        return {
+            'phase_center': [
+                self.phase_center.ra.deg,
+                self.phase_center.dec.deg
+            ],
+            'chan_freq': self.chan_freq.tolist(),
+            'nrows': self.nrows
+        }
 
-            :param sources:
-                Dictionnary like 
-                {
-                    'source1': {'ra': 0, 'dec': 0, 'flux': 1},
-                    'source2': {'ra': 0, 'dec': 0, 'flux': 1}
-                }
-            :type sources:
-                `dict`
+
+    def _culling_index(self, ms, catalog, min_elevation, min_flux,
+            interval):
+        """ Sources to predict in each time window of
+            ``interval`` seconds (windows being aligned on
+            multiples of ``interval``) covering the TIME column
+            of ``ms``.
+
+            A source is kept in a window if its flux reaches
+            ``min_flux`` and if its elevation reaches
+            ``min_elevation`` at any time of the window. The
+            elevation is computed for all the sources at once at
+            the edges and at the center of each window (see
+            :func:`~cmspy.Astro.elevation`), the threshold being
+            lowered by the largest change of elevation in a
+            quarter of window so that no source above it is
+            missed.
+
+            :returns: (visibility mask (windows, sources), start
+                time of the first window in MJD seconds)
+            :rtype: `tuple`
+        """
+        if interval <= 0:
+            raise ValueError(
+                'cull_interval should be positive'
+            )
+        keep = np.ones(len(catalog['ra']), dtype=bool)
+        if min_flux is not None:
+            keep &= np.abs(catalog['flux']) >= min_flux
+        time = ms.getcol('TIME')
+        window0 = np.floor(time.min() / interval) * interval
+        nwindows = int((time.max() - window0) // interval) + 1
+        del time
+        if min_elevation is None:
+            return np.tile(keep, (nwindows, 1)), window0
+        samples = window0 + interval * np.arange(2*nwindows + 1) / 2.
+        alt = elevation(
+            catalog=(catalog['ra'], catalog['dec']),
+            times=samples,
+            location=self.antenna_positions.mean(axis=0)
+        )
+        # Sidereal rate bounds the elevation change between samples
+        margin = np.degrees(7.2921e-5 * interval / 4.)
+        above = alt >= min_elevation - margin
+        visible = above[:, 0:-1:2] | above[:, 1::2] | above[:, 2::2]
+        return (visible & keep[:, None]).T, window0
+
+
+    def _noise_model(self, sefd, seed):
+        """ Thermal noise parameters given to the prediction
+            (see :meth:`add_data_table`), `None` without noise.
+        """
+        if sefd is None:
+            return None
+        nant = len(self.antenna_positions)
+        sefd = np.broadcast_to(np.asarray(sefd, dtype=np.float64), (nant,))
+        return {
+            'sefd': sefd.copy(),
+            'seed': _noise_seed(seed),
+            'chan_width': np.abs(self.chan_width).mean(axis=1)
+        }
+
+
+    @staticmethod
+    def _read_sky_model(ms):
+        """ Sky model recorded in the CORRECTED_DATA keywords
+            of the main table ``ms``, `None` if there is none.
+        """
+        keywords = ms.getcolkeywords('CORRECTED_DATA')
+        if sky_model_keyword not in keywords:
+            return None
+        return json.loads(keywords[sky_model_keyword])
+
+
+    def _refresh_metadata(self):
+        """ Reload the metadata if the tables they are read from
+            were modified. This stats the sub-tables, hence is
+            only called once per public method.
+        """
+        signature = self._metadata_signature()
+        if (self._metadata is None) or\
+            (self._metadata['signature'] != signature):
+            self._metadata = self._load_metadata()
+            self._metadata['signature'] = signature
+        return self._metadata
+
+
+    def _metadata_signature(self):
+        """ Identify the state of the tables the metadata are
+            read from, thanks to their modification times.
+        """
+        signature = [
+            self.msfile,
+            os.stat(join(self.msfile, 'table.dat')).st_mtime_ns
+        ]
+        for subtable in ['POINTING', 'SPECTRAL_WINDOW', 'ANTENNA']:
+            path = join(self.msfile, subtable)
+            signature.append(
+                max(
+                    entry.stat().st_mtime_ns
+                    for entry in os.scandir(path)
+                    if entry.is_file() and entry.name != 'table.lock'
+                )
+            )
+        return tuple(signature)
+
+
+    def _load_metadata(self):
+        """ Read the MS metadata.
         """
-        na = np.newaxis
         ms = table(
-            tablename=self.msfile,
+            tablename=join(self.msfile, 'POINTING'),
             ack=False,
-            readonly=False
+            readonly=True
         )
-        # Get data from MS
-        uvw = ms.getcol('UVW')
-        data = ms.getcol('DATA')
-        time = ms.getcol('TIME')
-        desc = ms.getcol('DATA_DESC_ID')
-        # Convert UVW in lambdas units
-        msspw = table(
+        phase_center = to_skycoord(
+            np.degrees(ms.getcol('TARGET')[0, 0])
+        )
+        ms.close()
+        ms = table(
             tablename=join(self.msfile, 'SPECTRAL_WINDOW'),
             ack=False,
             readonly=True
         )
-        chans = msspw.getcol('CHAN_FREQ')
-        msspw.close()
-        del msspw
+        chan_freq = ms.getcol('CHAN_FREQ')
+        chan_width = ms.getcol('CHAN_WIDTH')
+        ms.close()
+        ms = table(
+            tablename=join(self.msfile, 'ANTENNA'),
+            ack=False,
+            readonly=True
+        )
+        antenna_positions = ms.getcol('POSITION')
+        ms.close()
+        ms = table(
+            tablename=self.msfile,
+            ack=False,
+            readonly=True
+        )
+        nrows = ms.nrows()
+        ms.close()
+        del ms
+        log.info(
+            'Metadata of {} loaded.'.format(
+                self.msfile
+            )
+        )
+        return {
+            'phase_center': phase_center,
+            'chan_freq': chan_freq,
+            'chan_width': chan_width,
+            'antenna_positions': antenna_positions,
+            'nrows': nrows
+        }
+
+
+    @staticmethod
+    def _row_blocks(nrows, nchans, npol, chunksize=None, memory_limit=None):
+        """ Split the ``nrows`` rows of the main table into
+            ``(startrow, nrow)`` blocks. The size of a block is
+            either ``chunksize`` or derived from ``memory_limit``
+            (in MB) and a rough estimate of the memory needed
+            to predict one row (UVW in lambdas, Fourier terms
+            and the visibilities themselves).
+        """
+        if chunksize is None:
+            if memory_limit is None:
+                chunksize = max(nrows, 1)
+            else:
+                row_bytes = nchans * (3*8 + 3*8 + 2*16 + npol*16) + 3*8 + 4
+                chunksize = int(memory_limit * 1024**2 / row_bytes)
+        chunksize = int(chunksize)
+        if chunksize < 1:
+            raise ValueError(
+                'Block size should be at least one row.'
+            )
+        for startrow in range(0, nrows, chunksize):
+            yield startrow, min(chunksize, nrows - startrow)
+
+
+# ============================================================= #
+
+
+# ============================================================= #
+# ---------------------- Block prediction --------------------- #
+# ============================================================= #
+def _data_cell(ms, column):
+    """ Cell shape (chans, pols) and dtype of the visibility
+        ``column``, from its description if the shape is fixed
+        so that tables without rows are handled.
+    """
+    desc = ms.getcoldesc(column)
+    dtype = np.complex128 if desc['valueType'] == 'dcomplex'\
+        else np.complex64
+    if 'shape' in desc:
+        return tuple(int(n) for n in desc['shape']), dtype
+    return ms.getcell(column, 0).shape, dtype
+
+
+def _get_block(ms, block, column):
+    """ Read ``column`` for a block of rows, given either as a
+        ``(startrow, nrow)`` tuple or as an array of row numbers.
+    """
+    if isinstance(block, tuple):
+        startrow, nrow = block
+        return ms.getcol(column, startrow=startrow, nrow=nrow)
+    return ms.selectrows(block).getcol(column)
+
+
+def _put_block(ms, block, column, data):
+    """ Write ``column`` for a block of rows (see
+        :func:`_get_block`).
+    """
+    if isinstance(block, tuple):
+        startrow, nrow = block
+        ms.putcol(column, data, startrow=startrow, nrow=nrow)
+    else:
+        ms.selectrows(block).putcol(column, data)
+    return
+
+
+_selection_columns = ['TIME', 'DATA_DESC_ID', 'ANTENNA1', 'ANTENNA2']
+
+
+def _selection_mask(values, condition):
+    """ Rows of a column fulfilling a filter of
+        :meth:`MeasurementSet.select_rows`.
+    """
+    if isinstance(condition, tuple):
+        start, stop = [
+            bound.utc.mjd * 86400. if hasattr(bound, 'mjd') else bound
+            for bound in condition
+        ]
+        mask = np.ones(values.shape, dtype=bool)
+        if start is not None:
+            mask &= values >= start
+        if stop is not None:
+            mask &= values < stop
+        return mask
+    return np.isin(values, np.atleast_1d(condition))
+
+
+def _compact_block(rownrs):
+    """ Block of sorted row numbers, as a ``(startrow, nrow)``
+        tuple if they are contiguous (faster to read and write).
+    """
+    if rownrs[-1] - rownrs[0] + 1 == rownrs.size:
+        return int(rownrs[0]), int(rownrs.size)
+    return rownrs
+
+
+def _get_block_into(ms, block, column, buffer):
+    """ Read ``column`` for a block of rows (see
+        :func:`_get_block`) in the first rows of ``buffer``,
+        without allocating a new array.
+    """
+    if isinstance(block, tuple):
+        startrow, nrow = block
+        out = buffer[:nrow]
+        ms.getcolnp(column, out, startrow=startrow, nrow=nrow)
+    else:
+        out = buffer[:len(block)]
+        ms.selectrows(block).getcolnp(column, out)
+    return out
+
+
+def _sky_model_dict(sources):
+    """ Sky model as ``{name: {'ra', 'dec', 'flux'}}`` of
+        floats (in deg and Jy), i.e. as recorded in the MS.
+    """
+    catalog = read_catalog(sources)
+    return {
+        str(name): {
+            'ra': float(ra),
+            'dec': float(dec),
+            'flux': float(flux)
+        } for name, ra, dec, flux in zip(
+            catalog['name'],
+            catalog['ra'],
+            catalog['dec'],
+            catalog['flux']
+        )
+    }
+
+
+def _sky_model_delta(old, new):
+    """ Sources to predict (with signed fluxes) so that
+        visibilities of the ``old`` sky model become the ones of
+        the ``new`` sky model.
+    """
+    delta = {}
+    for name, src in old.items():
+        if name not in new:
+            delta['-' + name] = dict(src, flux=-src['flux'])
+        elif (new[name]['ra'], new[name]['dec']) == (src['ra'], src['dec']):
+            if new[name]['flux'] != src['flux']:
+                delta['~' + name] = dict(
+                    src,
+                    flux=new[name]['flux'] - src['flux']
+                )
+        else:
+            delta['-' + name] = dict(src, flux=-src['flux'])
+            delta['+' + name] = dict(new[name])
+    for name, src in new.items():
+        if name not in old:
+            delta['+' + name] = dict(src)
+    return delta
+
+
+def _write_predictions(ms, predictions, instrument, accumulate,
+        column='CORRECTED_DATA'):
+    """ Write the ``(block, visibilities, sigma)`` of
+        ``predictions`` in ``column`` of ``ms`` (added to its
+        content if ``accumulate``), yielding the number of rows
+        written. SIGMA and WEIGHT are written as well if
+        ``sigma`` is given (see :func:`_put_weights`).
+    """
+    for block, data, sigma in predictions:
+        with instrument.stage('add_data_table.write') as stage:
+            if accumulate:
+                data += _get_block(ms, block, column)
+                stage.add(bytes_read=data.nbytes)
+            _put_block(ms, block, column, data)
+            if sigma is not None:
+                _put_weights(ms, block, sigma, data.shape[-1])
+            stage.add(
+                rows=data.shape[0],
+                visibilities=data.shape[0] * data.shape[1],
+                bytes_written=data.nbytes
+            )
+        yield data.shape[0]
+        del data
+
+
+def _queue_get(q, stop):
+    """ Get an item of ``q``, `None` if ``stop`` is set.
+    """
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return None
+
+
+def _queue_put(q, item, stop):
+    """ Put an item in ``q``, `False` if ``stop`` is set
+        before there is room for it.
+    """
+    while True:
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            if stop.is_set():
+                return False
+
+
+def _predict_pipelined(ms, blocks, model, instrument, accumulate,
+        column='CORRECTED_DATA', nbuffers=_pipeline_buffers):
+    """ Predict ``blocks`` of rows of ``ms`` and write them in
+        ``column`` (added to its content if ``accumulate``),
+        reading block k+1 in a reader thread and writing block
+        k-1 in a writer thread while block k is predicted.
+
+        Casacore calls are serialized by a lock, the overlap
+        coming from the prediction kernels which release the
+        GIL. Input columns and visibilities use ``nbuffers``
+        (three being enough for the stages never to wait for
+        one another, fewer if there are fewer blocks) buffers
+        of the largest block size, allocated once and recycled.
+
+        :returns: Generator of the number of rows of each block,
+            all blocks being written when it is exhausted.
+        :rtype: `generator`
+    """
+    blocks = list(blocks)
+    if len(blocks) == 0:
+        return
+    maxrows = max(
+        block[1] if isinstance(block, tuple) else len(block)
+        for block in blocks
+    )
+    lock = threading.Lock()
+    stop = threading.Event()
+    errors = []
+    free_inputs = queue.Queue()
+    free_outputs = queue.Queue()
+    for _ in range(min(nbuffers, len(blocks))):
+        free_inputs.put({
+            name: np.empty(
+                (maxrows,) + _column_buffers[name][0],
+                dtype=_column_buffers[name][1]
+            ) for name in _block_columns(model)
+        })
+        free_outputs.put(
+            np.empty(
+                (maxrows, model['chan_freq'].shape[1], model['npol']),
+                dtype=model['dtype']
+            )
+        )
+    inputs = queue.Queue(maxsize=1)
+    outputs = queue.Queue(maxsize=1)
+
+    def reader():
+        try:
+            for block in blocks:
+                buffers = _queue_get(free_inputs, stop)
+                if buffers is None:
+                    return
+                with lock:
+                    cols = _read_block(ms, block, model, instrument, buffers)
+                if not _queue_put(inputs, (block, buffers, cols), stop):
+                    return
+            _queue_put(inputs, None, stop)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def writer():
+        try:
+            current = None
+            if accumulate:
+                shape, dtype = _data_cell(ms, column)
+                current = np.empty((maxrows,) + shape, dtype=dtype)
+            while True:
+                item = _queue_get(outputs, stop)
+                if item is None:
+                    return
+                block, buffer, data, sigma = item
+                with instrument.stage('add_data_table.write') as stage:
+                    with lock:
+                        if accumulate:
+                            data += _get_block_into(ms, block, column, current)
+                            stage.add(bytes_read=data.nbytes)
+                        _put_block(ms, block, column, data)
+                        if sigma is not None:
+                            _put_weights(ms, block, sigma, data.shape[-1])
+                    stage.add(
+                        rows=data.shape[0],
+                        visibilities=data.shape[0] * data.shape[1],
+                        bytes_written=data.nbytes
+                    )
+                free_outputs.put(buffer)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [
+        threading.Thread(target=reader, daemon=True),
+        threading.Thread(target=writer, daemon=True)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = _queue_get(inputs, stop)
+            if item is None:
+                break
+            block, buffers, cols = item
+            buffer = _queue_get(free_outputs, stop)
+            if buffer is None:
+                break
+            nrow = cols['DATA_DESC_ID'].size
+            data, sigma = _compute_block(
+                cols, model, instrument, buffer[:nrow], block
+            )
+            free_inputs.put(buffers)
+            if not _queue_put(outputs, (block, buffer, data, sigma), stop):
+                break
+            yield nrow
+        # Let the writer flush the last blocks
+        _queue_put(outputs, None, stop)
+        threads[1].join()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return
+
+
+def _block_columns(model):
+    """ Main table columns needed to predict ``model``.
+    """
+    columns = ['DATA_DESC_ID']
+    if model['positions'] is None:
+        columns.append('UVW')
+    if (model['engine'] == 'antenna') or (model['positions'] is not None):
+        columns += ['TIME', 'ANTENNA1', 'ANTENNA2']
+    elif model['visible'] is not None:
+        columns.append('TIME')
+    if model['jones'] is not None:
+        columns += [
+            column for column in ['TIME', 'ANTENNA1', 'ANTENNA2']
+            if column not in columns
+        ]
+    if model['noise'] is not None:
+        columns += [
+            column for column in ['ANTENNA1', 'ANTENNA2', 'EXPOSURE']
+            if column not in columns
+        ]
+    return columns
+
+
+def _read_block(ms, block, model, instrument, buffers=None):
+    """ Read the columns needed to predict a block of rows of
+        ``ms``, in the preallocated ``buffers`` (dictionnary of
+        arrays of at least the block size) if given.
+    """
+    with instrument.stage('predict.read') as stage:
+        cols = {
+            column: _get_block(ms, block, column) if buffers is None\
+                else _get_block_into(ms, block, column, buffers[column])
+            for column in _block_columns(model)
+        }
+        stage.add(
+            rows=cols['DATA_DESC_ID'].size,
+            bytes_read=sum(col.nbytes for col in cols.values())
+        )
+    return cols
+
+
+def _predict_block(ms, block, model, instrument):
+    """ Predict the visibilities of a block of rows of ``ms``.
+        ``model`` gathers the sky model and the prediction
+        options prepared by :meth:`MeasurementSet.predict`,
+        statistics being recorded in ``instrument``.
+
+        :returns: (visibilities, sigma), see :func:`_compute_block`
+        :rtype: `tuple`
+    """
+    cols = _read_block(ms, block, model, instrument)
+    return _compute_block(cols, model, instrument, block=block)
+
+
+def _compute_block(cols, model, instrument, data=None, block=None):
+    """ Predict the visibilities of a ``block`` of rows from
+        its columns ``cols`` (see :func:`_read_block`), in the
+        preallocated ``data`` buffer if given.
+
+        :returns: (visibilities, thermal noise of each row or
+            `None` without noise)
+        :rtype: `tuple`
+    """
+    chans = model['chan_freq']
+    desc = cols['DATA_DESC_ID']
+    ant_uvw = None
+    if model['positions'] is None:
+        uvw = cols['UVW']
+    else:
+        with instrument.stage('predict.uvw') as stage:
+            uvw, ant_uvw = _uvw_from_positions(
+                cols['TIME'],
+                cols['ANTENNA1'],
+                cols['ANTENNA2'],
+                model['positions'],
+                model['phase_center']
+            )
+            stage.add(rows=desc.size)
+    if data is None:
+        data = np.zeros(
+            (uvw.shape[0], chans.shape[1], model['npol']),
+            dtype=model['dtype']
+        )
+    else:
+        data[...] = 0
+    with instrument.stage('predict.compute') as stage:
+        for rows, visible in _source_groups(cols, model):
+            if rows is None:
+                _compute_sources(
+                    model, uvw, cols, ant_uvw, visible, data
+                )
+                continue
+            sub_cols = {
+                column: values[rows] for column, values in cols.items()
+            }
+            sub_ant_uvw = None
+            if ant_uvw is not None:
+                # Per-antenna UVW of the time steps of the group
+                sub_ant_uvw = ant_uvw[np.isin(
+                    np.unique(cols['TIME']),
+                    sub_cols['TIME']
+                )]
+            if isinstance(rows, slice):
+                _compute_sources(
+                    model, uvw[rows], sub_cols, sub_ant_uvw, visible,
+                    data[rows]
+                )
+            else:
+                sub_data = np.zeros(
+                    (rows.size,) + data.shape[1:],
+                    dtype=data.dtype
+                )
+                _compute_sources(
+                    model, uvw[rows], sub_cols, sub_ant_uvw, visible,
+                    sub_data
+                )
+                data[rows] = sub_data
+        stage.add(
+            rows=data.shape[0],
+            visibilities=data.shape[0] * data.shape[1]
+        )
+    if model['jones'] is not None:
+        with instrument.stage('predict.corrupt') as stage:
+            if model['jones']['polarized']:
+                # Coherency of unpolarized sources
+                data[..., 1:3] = 0
+            apply_jones(
+                data,
+                model['jones'],
+                cols['TIME'],
+                cols['ANTENNA1'],
+                cols['ANTENNA2'],
+                desc
+            )
+            stage.add(
+                rows=data.shape[0],
+                visibilities=data.shape[0] * data.shape[1]
+            )
+    sigma = None
+    if model['noise'] is not None:
+        with instrument.stage('predict.noise') as stage:
+            sigma = _add_noise(data, block, cols, model['noise'])
+            stage.add(
+                rows=data.shape[0],
+                visibilities=data.shape[0] * data.shape[1]
+            )
+    del uvw, desc, cols
+    return data, sigma
+
+
+def _source_groups(cols, model):
+    """ Split a block of rows per culling window (see
+        :meth:`MeasurementSet._culling_index`), yielding the
+        rows (`None` for all of them, a slice or row indices)
+        with the mask of the sources to predict (`None` for all
+        of them).
+    """
+    visible = model['visible']
+    if (visible is None) or (model['engine'] == 'fft'):
+        yield None, None
+        return
+    windows = np.clip(
+        ((cols['TIME'] - model['window0']) // model['interval'])\
+            .astype(np.int64),
+        0,
+        visible.shape[0] - 1
+    )
+    values, inverse = np.unique(windows, return_inverse=True)
+    if values.size == 1:
+        yield None, visible[values[0]]
+        return
+    for i, window in enumerate(values):
+        rows = np.nonzero(inverse.ravel() == i)[0]
+        if rows[-1] - rows[0] + 1 == rows.size:
+            rows = slice(rows[0], rows[-1] + 1)
+        yield rows, visible[window]
+
+
+def _compute_sources(model, uvw, cols, ant_uvw, visible, data):
+    """ Accumulate in ``data`` the visibilities of the sources
+        of ``model`` selected by the ``visible`` mask (all of
+        them if `None`) with the chosen engine.
+    """
+    na = np.newaxis
+    chans = model['chan_freq']
+    engine = model['engine']
+    desc = cols['DATA_DESC_ID']
+    lmn = model['lmn']
+    flux = model['flux']
+    ra, dec = model['radec']
+    if flux.size == 0:
+        return
+    if visible is not None:
+        if not visible.any():
+            return
+        lmn = tuple(coord[visible] for coord in lmn)
+        flux = flux[visible]
+        ra = ra[visible]
+        dec = dec[visible]
+    if engine == 'fused':
+        # Construct fake visibilities in one pass
+        add_srcs(
+            uvw=uvw,
+            desc=desc,
+            chan_freq=chans,
+            lmn=lmn,
+            flux=flux,
+            vis=data,
+            precision=model['precision']
+        )
+    elif engine == 'antenna':
+        # Per-antenna phasors combined per baseline
+        add_srcs_antenna(
+            uvw=uvw,
+            time=cols['TIME'],
+            ant1=cols['ANTENNA1'],
+            ant2=cols['ANTENNA2'],
+            desc=desc,
+            chan_freq=chans,
+            lmn=lmn,
+            flux=flux,
+            vis=data,
+            ant_uvw=ant_uvw,
+            precision=model['precision']
+        )
+    elif engine == 'recurrence':
+        add_srcs_recurrence(
+            uvw=uvw,
+            desc=desc,
+            chan_freq=chans,
+            lmn=lmn,
+            flux=flux,
+            vis=data,
+            anchor=model['anchor'],
+            precision=model['precision']
+        )
+    elif engine == 'fft':
+        # Degridding of the w-planes
+        add_srcs_fft(
+            uvw=uvw,
+            desc=desc,
+            chan_freq=chans,
+            grid=model['fft'],
+            vis=data
+        )
+    else:
+        # Convert UVW in lambdas units
         freq = np.take(
             chans,
-            np.arange(self.nbands)[desc],
+            np.arange(model['nbands'])[desc],
             axis=0
         ) # in Hz
         wavelength = const.c.value / freq
         uvw_l = uvw[:, na, :] / wavelength[..., na]
-        # Loop over time, spw and sources
-        # for time_stamp in np.unique(time):
-        #     for spw_stamp in np.unique(desc):
-        #         # Build selection mask
-        #         selmask = (time == time_stamp)
-        #         selmask *= (desc == spw_stamp)
-        #         # Reinitialize everything to 0
-        #         data[selmask, ...] = np.complex(0)
-        #         # Construct fake visibilities
-        #         for name in sources.keys():
-        #             src = sources[name]
-        #             data[selmask, ...] += add_src(
-        #                 uvw=uvw_l[selmask, ...],
-        #                 src_coord=(src['ra'], src['dec']),
-        #                 flux=src['flux'],
-        #                 phase_center=self.phase_center
-        #             )[..., na]
-        # Reinitialize everything to 0
-        data[...] = np.complex(0)
-        for name in sources.keys():
-            src = sources[name]
+        # Construct fake visibilities
+        for i in range(flux.size):
             data += add_src(
                 uvw=uvw_l,
-                src_coord=(src['ra'], src['dec']),
-                flux=src['flux'],
-                phase_center=self.phase_center
+                src_coord=(ra[i], dec[i]),
+                flux=flux[i],
+                phase_center=model['phase_center'],
+                precision=model['precision']
             )[..., na]
-        ms.putcol('CORRECTED_DATA', data)
-        ms.flush()
-        ms.close()
-        del uvw, time, desc, data, ms
-        return
+        del freq, wavelength, uvw_l
+    return
 
 
-    # --------------------------------------------------------- #
-    # ----------------------- Internal ------------------------ #
+def _noise_seed(seed):
+    """ Master seed of the noise, drawn (and logged) if `None`.
+    """
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy)
+        log.info(
+            'Noise drawn with seed {}.'.format(seed)
+        )
+    return int(seed)
 
 
-# ============================================================= #
+def _block_rownrs(block):
+    """ Row numbers of a block of rows.
+    """
+    if isinstance(block, tuple):
+        startrow, nrow = block
+        return np.arange(startrow, startrow + nrow)
+    return np.asarray(block)
+
 
+def _add_noise(data, block, cols, noise):
+    """ Add the thermal noise of the rows of ``block`` (see
+        :func:`~cmspy.MS.thermal_noise`) to ``data``.
+
+        :returns: Standard deviation of the noise of each row
+        :rtype: `np.ndarray`
+    """
+    sigma = noise_sigma(
+        noise['sefd'][cols['ANTENNA1']],
+        noise['sefd'][cols['ANTENNA2']],
+        noise['chan_width'][cols['DATA_DESC_ID']],
+        cols['EXPOSURE']
+    )
+    data += sigma[:, None, None] * thermal_noise(
+        rownrs=_block_rownrs(block),
+        shape=data.shape[1:],
+        seed=noise['seed']
+    )
+    return sigma
+
+
+def _put_weights(ms, block, sigma, npol):
+    """ Write the SIGMA (thermal noise ``sigma`` of each row,
+        see :func:`_add_noise`) and WEIGHT (``1 / SIGMA^2``) of
+        a block of rows.
+    """
+    sigma = np.repeat(sigma[:, None], npol, axis=1).astype(np.float32)
+    _put_block(ms, block, 'SIGMA', sigma)
+    _put_block(ms, block, 'WEIGHT', 1. / sigma**2)
+    return
+
+
+def _compute_block_uvw(ms, block, positions, phase_center):
+    """ Compute the UVW of a block of rows from the antenna
+        positions (see :func:`_uvw_from_positions`).
+    """
+    return _uvw_from_positions(
+        _get_block(ms, block, 'TIME'),
+        _get_block(ms, block, 'ANTENNA1'),
+        _get_block(ms, block, 'ANTENNA2'),
+        positions,
+        phase_center
+    )
+
+
+def _uvw_from_positions(time, ant1, ant2, positions, phase_center):
+    """ Compute the UVW of rows from the antenna positions, the
+        Earth rotation being evaluated once per distinct time
+        step. The per-antenna UVW (ordered as the sorted unique
+        times) are returned as well.
+    """
+    times, tidx = np.unique(time, return_inverse=True)
+    tidx = tidx.ravel()
+    ant_uvw = antenna_uvw(
+        positions=positions,
+        times=times,
+        phase_center=phase_center
+    )
+    return ant_uvw[tidx, ant2] - ant_uvw[tidx, ant1], ant_uvw
+
+
+def _init_worker(nthreads, model):
+    """ Share the cores between the worker processes and keep
+        the prediction ``model``, sent once per worker instead
+        of once per block.
+    """
+    global _worker_model
+    numba.set_num_threads(nthreads)
+    _worker_model = model
+    return
+
+
+def _predict_task(msfile, block):
+    """ Predict a block of rows in a worker process, the MS
+        being opened read-only without locking since the rows
+        read are never modified. The statistics of the worker
+        are sent back along with the visibilities.
+    """
+    model = _worker_model
+    instrument = Instrumentation(enabled=model['instrumented'])
+    ms = table(
+        tablename=msfile,
+        ack=False,
+        readonly=True,
+        lockoptions='autonoread'
+    )
+    data, sigma = _predict_block(ms, block, model, instrument)
+    ms.close()
+    del ms
+    return block, data, sigma, instrument.report.to_dict()
+
+
+def _predict_parallel(msfile, blocks, model, workers, instrument):
+    """ Predict ``blocks`` in a pool of ``workers`` processes,
+        yielding ``(block, visibilities, sigma)`` as soon as they
+        are ready. At most ``2 * workers`` blocks are in flight to
+        bound the memory.
+    """
+    blocks = iter(blocks)
+    context = multiprocessing.get_context('spawn')
+    model = dict(model, instrumented=instrument.enabled)
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(
+                max(1, numba.config.NUMBA_NUM_THREADS // workers),
+                model
+            )
+        ) as executor:
+        pending = set()
+        for block in blocks:
+            pending.add(
+                executor.submit(_predict_task, msfile, block)
+            )
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    block, data, sigma, report = future.result()
+                    instrument.report.merge(report)
+                    yield block, data, sigma
+        for future in as_completed(pending):
+            block, data, sigma, report = future.result()
+            instrument.report.merge(report)
+            yield block, data, sigma
+    return
+# ============================================================= #
@@ -21,14 +21,17 @@ from os.path import (
     isfile,
     basename
 )
-import zipfile
 import numpy as np
 import logging
 import astropy.units as u
 from astropy.time import Time, TimeDelta
 
-from cmspy.Astro import to_skycoord
-from cmspy.AntennaTable import nenufar_antennas
+from cmspy.Astro import to_skycoord, antenna_uvw
+from cmspy.AntennaTable import (
+    nenufar_antennas,
+    extract_antennas,
+    read_antennas
+)
 
 
 log = logging.getLogger(__name__)
@@ -115,6 +118,10 @@ class MSParset(object):
             raise TypeError(
                 'nbands should be integer'
             )
+        if n < 1:
+            raise ValueError(
+                'nbands should be positive'
+            )
         self._nbands = n
         return
 
@@ -128,6 +135,10 @@ class MSParset(object):
             raise TypeError(
                 'nf should be integer'
             )
+        if n < 1:
+            raise ValueError(
+                'nf should be positive'
+            )
         self._nf = n
         return
 
@@ -141,6 +152,10 @@ class MSParset(object):
             raise TypeError(
                 'nt should be integer'
             )
+        if n < 1:
+            raise ValueError(
+                'nt should be positive'
+            )
         self._nt = n
         return
 
@@ -216,6 +231,39 @@ class MSParset(object):
         return
 
 
+    @property
+    def frequencies(self):
+        """ Channel central frequencies (nbands, nf/nbands) in Hz.
+        """
+        nchans = self.nf // self.nbands
+        df = self.df.to(u.Hz).value
+        if len(self.f0) == 1:
+            starts = self.f0[0].to(u.Hz).value +\
+                np.arange(self.nbands) * nchans * df
+        else:
+            starts = np.array([fi.to(u.Hz).value for fi in self.f0])
+        return starts[:, None] + (np.arange(nchans) + 0.5) * df
+
+
+    @property
+    def times(self):
+        """ Central times of each integration, in MJD seconds
+            (UTC), as stored in the TIME column.
+        """
+        dt = self.dt.to(u.s).value
+        return self.t0.utc.mjd * 86400. + (np.arange(self.nt) + 0.5) * dt
+
+
+    @property
+    def antenna_positions(self):
+        """ ITRF positions (antennas, 3) in meters of the antenna
+            table, read from its cached extraction (see
+            :func:`~cmspy.AntennaTable.extract_antennas`).
+        """
+        _, positions = read_antennas(self.antennatable)
+        return positions
+
+
     # --------------------------------------------------------- #
     # ------------------------ Methods ------------------------ #
     def check_conformity(self):
@@ -236,14 +284,9 @@ class MSParset(object):
             )
             conform *= False
         if self.antennatable.endswith('.zip'):
-            with zipfile.ZipFile(self.antennatable) as zipf:
-                zipf.extractall(self.savepath)
-            self._anttable = join(
-                self.savepath,
-                basename(self.antennatable).replace('.zip', '')
-            )
+            self._anttable = extract_antennas(self.antennatable)
             log.info(
-                'Antenna table {} created.'.format(
+                'Antenna table {} used.'.format(
                     self._anttable
                 )
             )
@@ -305,6 +348,50 @@ class MSParset(object):
 
     # --------------------------------------------------------- #
     # ----------------------- Internal ------------------------ #
+    def _main_columns(self, positions, tstart=0, tstop=None):
+        """ Generate the main table columns describing the
+            observation (TIME, ANTENNA1/2, DATA_DESC_ID, UVW...)
+            for the time steps ``tstart`` to ``tstop``. Rows are
+            ordered by time, subband and baseline (including
+            autocorrelations).
+
+            :param positions:
+                ITRF antenna positions (antennas, 3).
+            :type positions:
+                `np.ndarray`
+
+            :returns: Columns as arrays
+            :rtype: `dict`
+        """
+        tstop = self.nt if tstop is None else tstop
+        times = self.times[tstart:tstop]
+        dt = self.dt.to(u.s).value
+        ant1, ant2 = np.triu_indices(len(positions))
+        nbl = ant1.size
+        nrow = times.size * self.nbands * nbl
+        ant_uvw = antenna_uvw(
+            positions=positions,
+            times=times,
+            phase_center=(self.ra, self.dec)
+        )
+        tidx = np.repeat(np.arange(times.size), self.nbands * nbl)
+        a1 = np.tile(ant1, times.size * self.nbands)
+        a2 = np.tile(ant2, times.size * self.nbands)
+        return {
+            'TIME': times[tidx],
+            'TIME_CENTROID': times[tidx],
+            'INTERVAL': np.full(nrow, dt),
+            'EXPOSURE': np.full(nrow, dt),
+            'ANTENNA1': a1,
+            'ANTENNA2': a2,
+            'DATA_DESC_ID': np.tile(
+                np.repeat(np.arange(self.nbands), nbl),
+                times.size
+            ),
+            'UVW': ant_uvw[tidx, a2] - ant_uvw[tidx, a1]
+        }
+
+
     def _fill_attr(self, kwargs):
         """
         """
@@ -0,0 +1,364 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+__author__ = 'Alan Loh'
+__copyright__ = 'Copyright 2020, cmspy'
+__credits__ = ['Alan Loh']
+__maintainer__ = 'Alan'
+__email__ = 'alan.loh@obspm.fr'
+__status__ = 'Production'
+__all__ = [
+    'VirtualMeasurementSet'
+]
+
+
+from cmspy.CustomMS import MeasurementSet
+from cmspy.Astro import to_skycoord
+from cmspy.AntennaTable import read_antennas
+
+import numpy as np
+import astropy.units as u
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+data_columns = ['DATA', 'MODEL_DATA', 'CORRECTED_DATA']
+weight_columns = ['SIGMA', 'WEIGHT']
+
+
+# ============================================================= #
+# ------------------------ ArrayTable ------------------------- #
+# ============================================================= #
+class ArrayTable(object):
+    """ In-memory stand-in for the subset of the casacore
+        :class:`~casacore.tables.table` interface used by the
+        prediction pipeline. Visibility columns are only
+        allocated when first written.
+    """
+
+    def __init__(self, columns, cell_shape, rownrs=None, keywords=None):
+        self._columns = columns
+        self._cell_shape = cell_shape
+        self._rownrs = rownrs
+        self._keywords = {} if keywords is None else keywords
+
+
+    # --------------------------------------------------------- #
+    # ------------------------ Methods ------------------------ #
+    def nrows(self):
+        if self._rownrs is not None:
+            return self._rownrs.size
+        return self._columns['TIME'].size
+
+
+    def colnames(self):
+        return sorted(
+            set(self._columns.keys()) | set(data_columns) | set(weight_columns)
+        )
+
+
+    def getcol(self, columnname, startrow=0, nrow=-1):
+        column = self._column(columnname)
+        return column[self._rows(startrow, nrow)].copy()
+
+
+    def getcolnp(self, columnname, nparray, startrow=0, nrow=-1):
+        nparray[...] = self._column(columnname)[self._rows(startrow, nrow)]
+        return
+
+
+    def getcell(self, columnname, rownr):
+        return self.getcol(columnname, startrow=rownr, nrow=1)[0]
+
+
+    def getcoldesc(self, columnname):
+        if columnname not in data_columns:
+            raise KeyError(
+                'No description of column {}.'.format(columnname)
+            )
+        column = self._columns.get(columnname)
+        dtype = np.complex64 if column is None else column.dtype
+        return {
+            'valueType': 'dcomplex' if dtype == np.complex128 else 'complex',
+            'ndim': len(self._cell_shape),
+            'shape': np.array(self._cell_shape)
+        }
+
+
+    def putcol(self, columnname, value, startrow=0, nrow=-1):
+        if columnname not in self._columns:
+            self._columns[columnname] = self._column(columnname)
+        self._columns[columnname][self._rows(startrow, nrow)] = value
+        return
+
+
+    def selectrows(self, rownrs):
+        rownrs = np.asarray(rownrs)
+        if self._rownrs is not None:
+            rownrs = self._rownrs[rownrs]
+        return ArrayTable(
+            self._columns,
+            self._cell_shape,
+            rownrs,
+            self._keywords
+        )
+
+
+    def getcolkeywords(self, columnname):
+        return dict(self._keywords.get(columnname, {}))
+
+
+    def putcolkeyword(self, columnname, keyword, value):
+        self._keywords.setdefault(columnname, {})[keyword] = value
+        return
+
+
+    def removecolkeyword(self, columnname, keyword):
+        del self._keywords[columnname][keyword]
+        return
+
+
+    def flush(self):
+        return
+
+
+    def close(self):
+        return
+
+
+    # --------------------------------------------------------- #
+    # ----------------------- Internal ------------------------ #
+    def _rows(self, startrow, nrow):
+        """ Index of the rows ``startrow`` to ``startrow + nrow``.
+        """
+        stop = None if nrow < 0 else startrow + nrow
+        if self._rownrs is None:
+            return slice(startrow, stop)
+        return self._rownrs[startrow:stop]
+
+
+    def _column(self, columnname):
+        """ Get a column, visibility columns being zeros (and
+            SIGMA/WEIGHT ones) until they are written.
+        """
+        if columnname in self._columns:
+            return self._columns[columnname]
+        if columnname in data_columns:
+            return np.zeros(
+                (self._columns['TIME'].size,) + self._cell_shape,
+                dtype=np.complex64
+            )
+        if columnname in weight_columns:
+            return np.ones(
+                (self._columns['TIME'].size, self._cell_shape[-1]),
+                dtype=np.float32
+            )
+        raise KeyError(
+            'Column {} does not exist'.format(columnname)
+        )
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------ VirtualMeasurementSet -------------------- #
+# ============================================================= #
+class VirtualMeasurementSet(MeasurementSet):
+    """ In-memory :class:`~cmspy.CustomMS.MeasurementSet`: the
+        main table columns (UVW, TIME, antenna indices...) are
+        generated from the MSParset attributes and kept as NumPy
+        arrays, so that the prediction pipeline runs without any
+        disk I/O. Writing a real MS is an optional final step
+        (see :meth:`write`).
+
+        :Example:
+
+        >>> from cmspy.CustomMS import VirtualMeasurementSet
+        >>> vms = VirtualMeasurementSet(nt=60, nf=16, nbands=1)
+        >>> vms.add_data_table(sources)
+        >>> vms.visibilities
+
+    """
+
+    npol = 4
+
+    def __init__(self, **kwargs):
+        self._table = None
+        super().__init__(
+            **kwargs
+        )
+
+
+    # --------------------------------------------------------- #
+    # --------------------- Getter/Setter --------------------- #
+    @property
+    def metadata(self):
+        """ Same as :attr:`MeasurementSet.metadata`, checked on
+            every access since they only depend on the MSParset
+            attributes (no file to stat).
+        """
+        return self._refresh_metadata()
+
+
+    @property
+    def visibilities(self):
+        """ Predicted visibilities (rows, chans, pols), `None`
+            until :meth:`add_data_table` is called.
+        """
+        return self._main_table()._columns.get('CORRECTED_DATA')
+
+
+    # --------------------------------------------------------- #
+    # ------------------------ Methods ------------------------ #
+    def init_empty(self, native=True):
+        """ Generate the main table columns in memory.
+        """
+        self._table = None
+        self._main_table()
+        return
+
+
+    def add_desc_tables(self):
+        """ Nothing to do, kept for compatibility with
+            :class:`~cmspy.CustomMS.MeasurementSet`.
+        """
+        return
+
+
+    # --------------------------------------------------------- #
+    # ----------------------- Internal ------------------------ #
+    def _predictions(self, workers=None, **options):
+        """ Same as :meth:`MeasurementSet._predictions`, without
+            worker processes since there is no file to share.
+        """
+        if (workers is not None) and (workers > 1):
+            raise ValueError(
+                'Worker processes are not available for '
+                'in-memory MeasurementSets.'
+            )
+        return super()._predictions(**options)
+
+
+    def write(self, msname=None, savepath=None, chunksize=None):
+        """ Write a real MS (see
+            :meth:`MeasurementSet.init_empty` with
+            ``native=True``) and copy the in-memory visibility
+            (and SIGMA/WEIGHT) columns into it.
+
+            :param msname:
+                Name of the MS, defaults to ``msname``.
+            :type msname:
+                `str`
+            :param savepath:
+                Directory of the MS, defaults to ``savepath``.
+            :type savepath:
+                `str`
+            :param chunksize:
+                Number of rows copied at once.
+            :type chunksize:
+                `int`
+
+            :returns: The MS written on disk.
+            :rtype: :class:`~cmspy.CustomMS.MeasurementSet`
+        """
+        ms = MeasurementSet(
+            msname=self.msname if msname is None else msname,
+            savepath=self.savepath if savepath is None else savepath,
+            ra=self.ra,
+            dec=self.dec,
+            f0=self.f0,
+            df=self.df,
+            nf=self.nf,
+            nbands=self.nbands,
+            t0=self.t0,
+            dt=self.dt,
+            nt=self.nt
+        )
+        ms._antennatable = self.antennatable
+        ms.init_empty(native=True)
+        source = self._main_table()
+        target = ms._main_table(readonly=False)
+        columns = [
+            column for column in data_columns + weight_columns
+            if column in source._columns
+        ]
+        blocks = self._row_blocks(source.nrows(), 0, 0, chunksize)
+        for startrow, nrow in blocks:
+            for column in columns:
+                target.putcol(
+                    column,
+                    source.getcol(column, startrow, nrow),
+                    startrow=startrow,
+                    nrow=nrow
+                )
+        target.flush()
+        target.close()
+        log.info(
+            'In-memory columns {} written in {}.'.format(
+                columns,
+                ms.msfile
+            )
+        )
+        return ms
+
+
+    def _main_table(self, readonly=True):
+        """ In-memory main table, (re)generated if the MSParset
+            attributes changed.
+        """
+        signature = self._metadata_signature()
+        if (self._table is None) or (self._table[0] != signature):
+            columns = self._main_columns(
+                positions=self.antenna_positions
+            )
+            self._table = (
+                signature,
+                ArrayTable(
+                    columns=columns,
+                    cell_shape=(self.nf // self.nbands, self.npol)
+                )
+            )
+            log.info(
+                'In-memory main table of {} rows generated.'.format(
+                    columns['TIME'].size
+                )
+            )
+        return self._table[1]
+
+
+    def _metadata_signature(self):
+        """ The metadata only depend on the MSParset attributes.
+        """
+        return (
+            self.ra.to(u.deg).value,
+            self.dec.to(u.deg).value,
+            tuple(fi.to(u.Hz).value for fi in self.f0),
+            self.df.to(u.Hz).value,
+            self.nf,
+            self.nbands,
+            self.t0.isot,
+            self.dt.to(u.s).value,
+            self.nt,
+            self.antennatable
+        )
+
+
+    def _load_metadata(self):
+        """ Metadata derived from the MSParset attributes.
+        """
+        _, positions = read_antennas(self.antennatable)
+        nbl = len(positions) * (len(positions) + 1) // 2
+        return {
+            'phase_center': to_skycoord((self.ra, self.dec)),
+            'chan_freq': self.frequencies,
+            'chan_width': np.full_like(
+                self.frequencies,
+                self.df.to(u.Hz).value
+            ),
+            'antenna_positions': positions,
+            'nrows': self.nt * self.nbands * nbl
+        }
+# ============================================================= #
+
@@ -2,5 +2,30 @@
 # -*- coding: utf-8 -*-
 
 
-from .plot_func import *
-from .util_func import *
+from cmspy import _lazy_exports
+
+
+_exports = {
+    'uv_density': '.plot_func',
+    'plot_uv': '.plot_func',
+    'add_src': '.util_func',
+    'add_srcs': '.util_func',
+    'derive_antenna_uvw': '.util_func',
+    'add_srcs_antenna': '.util_func',
+    'add_srcs_recurrence': '.util_func',
+    'recurrence_error': '.util_func',
+    'fft_grid': '.fft_func',
+    'fft_plane': '.fft_func',
+    'add_srcs_fft': '.fft_func',
+    'fft_error': '.fft_func',
+    'averaging_factors': '.average_func',
+    'average_ms': '.average_func',
+    'noise_block_rows': '.noise_func',
+    'noise_sigma': '.noise_func',
+    'thermal_noise': '.noise_func',
+    'random_gains': '.jones_func',
+    'jones_table': '.jones_func',
+    'apply_jones': '.jones_func'
+}
+__all__ = list(_exports)
+__getattr__, __dir__ = _lazy_exports(__name__, _exports)
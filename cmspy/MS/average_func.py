@@ -0,0 +1,544 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+""" Baseline-dependent averaging of MeasurementSets.
+
+    Each baseline is averaged over as many time steps and
+    channels as allowed by a decorrelation tolerance: averaging
+    a fringe whose phase drifts linearly by ``dphi`` radians
+    reduces its amplitude by ``sinc(dphi / 2)``, i.e. by about
+    ``dphi^2 / 24``. Over ``kt`` time steps of ``dt`` seconds
+    and ``kf`` channels of ``df`` Hz, the phase of a source at
+    the edge of the field (distance ``r`` in direction cosines
+    to the phase center) drifts by at most
+    ``2 pi r |b| (kt dt omega f + kf df) / c`` for a baseline of
+    length ``|b|`` at frequency ``f`` (``omega`` being the Earth
+    rotation rate), the tolerance being shared equally between
+    time and frequency.
+"""
+
+
+__author__ = 'Alan Loh'
+__copyright__ = 'Copyright 2020, cmspy'
+__credits__ = ['Alan Loh']
+__maintainer__ = 'Alan'
+__email__ = 'alan.loh@obspm.fr'
+__status__ = 'Production'
+__all__ = [
+    'averaging_factors',
+    'average_ms'
+]
+
+
+from cmspy.MS.util_func import light_speed
+
+from os.path import join, isdir
+import shutil
+import numpy as np
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+# Earth rotation rate (rad/s)
+earth_rotation_rate = 7.2921150e-5
+
+# Columns averaged over the visibilities
+data_columns = ['DATA', 'MODEL_DATA', 'CORRECTED_DATA']
+
+# Columns taken from the first row of each averaged cell
+index_columns = [
+    'ANTENNA1', 'ANTENNA2', 'FEED1', 'FEED2', 'FIELD_ID', 'SCAN_NUMBER',
+    'ARRAY_ID', 'OBSERVATION_ID', 'PROCESSOR_ID', 'STATE_ID'
+]
+
+# Main table columns not carried to the averaged MS
+dropped_columns = ['FLAG_CATEGORY', 'WEIGHT_SPECTRUM', 'SIGMA_SPECTRUM']
+
+
+# ============================================================= #
+# --------------------- averaging_factors --------------------- #
+# ============================================================= #
+def averaging_factors(baseline, freq_max, chan_width, nchans, dt,
+        tolerance=0.01, fov=90., max_steps=None, max_channels=None):
+    """ Numbers of time steps and of channels that can be
+        averaged for each baseline within a decorrelation
+        tolerance (see the module description).
+
+        :param baseline:
+            Baseline lengths in meters.
+        :type baseline:
+            `np.ndarray`
+        :param freq_max:
+            Highest frequency (Hz) of each baseline's spectral
+            window.
+        :type freq_max:
+            `np.ndarray` or `float`
+        :param chan_width:
+            Channel width (Hz).
+        :type chan_width:
+            `np.ndarray` or `float`
+        :param nchans:
+            Number of channels per spectral window, the channel
+            factors being divisors of it.
+        :type nchans:
+            `int`
+        :param dt:
+            Integration time (s).
+        :type dt:
+            `float`
+        :param tolerance:
+            Largest fractional loss of amplitude of a source at
+            the edge of the field.
+        :type tolerance:
+            `float`
+        :param fov:
+            Radius (deg) of the field of view from the phase
+            center, ``90`` for the whole visible sky around the
+            zenith.
+        :type fov:
+            `float`
+        :param max_steps:
+            Largest number of time steps averaged together.
+        :type max_steps:
+            `int`
+        :param max_channels:
+            Largest number of channels averaged together.
+        :type max_channels:
+            `int`
+
+        :returns: (time factors, channel factors) per baseline
+        :rtype: `tuple` of `np.ndarray`
+    """
+    if not (0 < tolerance < 1):
+        raise ValueError(
+            'tolerance should be between 0 and 1'
+        )
+    baseline = np.asarray(baseline, dtype=np.float64)
+    # Largest phase drift for each dimension
+    dphi = np.sqrt(12. * tolerance)
+    radius = 2. * np.sin(np.radians(min(fov, 180.)) / 2.)
+    drift = 2. * np.pi * radius * baseline / light_speed
+    with np.errstate(divide='ignore'):
+        kt = np.floor(dphi / (drift * earth_rotation_rate * freq_max * dt))
+        kf = np.floor(dphi / (drift * chan_width))
+    max_steps = np.inf if max_steps is None else max_steps
+    max_channels = nchans if max_channels is None\
+        else min(max_channels, nchans)
+    kt = np.clip(np.nan_to_num(kt, posinf=max_steps), 1, max_steps)
+    kf = np.clip(np.nan_to_num(kf, posinf=max_channels), 1, max_channels)
+    # Channel factors restricted to the divisors of nchans
+    divisors = np.array([d for d in range(1, nchans + 1) if nchans % d == 0])
+    kf = divisors[np.searchsorted(divisors, kf, side='right') - 1]
+    return kt.astype(np.int64), kf.astype(np.int64)
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------ average_ms ------------------------- #
+# ============================================================= #
+def average_ms(msname, output, tolerance=0.01, fov=90., max_interval=None,
+        max_channels=None, exact_uvw=True, memory_limit=1024.):
+    """ Write a baseline-dependent averaged copy of a MS (see
+        :func:`averaging_factors`), short baselines being
+        averaged over more time steps and channels than long
+        ones.
+
+        Each averaged row gets the mean TIME and TIME_CENTROID
+        of its time steps, the summed INTERVAL and EXPOSURE,
+        and its UVW at that time. Visibilities are averaged with
+        the WEIGHT of the unflagged samples, an output sample
+        being flagged if all its inputs are. WEIGHT is summed,
+        SIGMA being the noise of the average.
+
+        Channel averaging factors being baseline dependent, the
+        averaged MS gets one spectral window (and data
+        description) per input window and factor, and its data
+        columns have variable shapes. Rows are written by
+        intervals of ``max_interval`` and data descriptions,
+        ordered by time and baseline within each of them.
+
+        The input is read by blocks of time steps (sized from
+        ``memory_limit``) and of data description, each
+        averaging cell being read with the block it starts in,
+        so that the memory does not depend on the observation
+        length. A block only extends beyond its time steps by the
+        longest averaging interval, capped by ``max_interval``.
+
+        :param msname:
+            Path to the input MS.
+        :type msname:
+            `str`
+        :param output:
+            Path to the averaged MS (overwritten).
+        :type output:
+            `str`
+        :param tolerance:
+            Largest fractional loss of amplitude of a source at
+            ``fov`` from the phase center.
+        :type tolerance:
+            `float`
+        :param fov:
+            Radius (deg) of the field of view.
+        :type fov:
+            `float`
+        :param max_interval:
+            Longest averaging interval (s). If `None`, the whole
+            observation may be averaged.
+        :type max_interval:
+            `float`
+        :param max_channels:
+            Largest number of channels averaged together.
+        :type max_channels:
+            `int`
+        :param exact_uvw:
+            Compute the UVW of the averaged rows from the
+            ANTENNA positions at their mean time (see
+            :func:`~cmspy.Astro.antenna_uvw`), otherwise average
+            the input UVW.
+        :type exact_uvw:
+            `bool`
+        :param memory_limit:
+            Rough memory (MB) used by the time steps of a block
+            of input rows.
+        :type memory_limit:
+            `float`
+
+        :returns: Number of input visibilities over the number of
+            averaged ones.
+        :rtype: `float`
+
+        :Example:
+
+        >>> from cmspy.MS import average_ms
+        >>> average_ms('sim.ms', 'sim_bda.ms', tolerance=0.01, fov=30)
+
+    """
+    from casacore.tables import table
+    ms = table(msname, readonly=True, ack=False, lockoptions='autonoread')
+    spw_table = table(ms.getkeyword('SPECTRAL_WINDOW'), ack=False)
+    num_chan = spw_table.getcol('NUM_CHAN')
+    if np.unique(num_chan).size != 1:
+        raise ValueError(
+            'Spectral windows should have the same number of channels.'
+        )
+    nchans = int(num_chan[0])
+    chan_freq = np.array([
+        spw_table.getcell('CHAN_FREQ', i) for i in range(num_chan.size)
+    ])
+    chan_width = np.array([
+        spw_table.getcell('CHAN_WIDTH', i) for i in range(num_chan.size)
+    ])
+    spw_table.close()
+    sub = table(ms.getkeyword('DATA_DESCRIPTION'), ack=False)
+    desc_spw = sub.getcol('SPECTRAL_WINDOW_ID')
+    sub.close()
+    sub = table(ms.getkeyword('ANTENNA'), ack=False)
+    positions = sub.getcol('POSITION')
+    sub.close()
+    sub = table(ms.getkeyword('FIELD'), ack=False)
+    phase_center = tuple(np.degrees(sub.getcol('PHASE_DIR')[0, 0]))
+    sub.close()
+
+    # Averaging factors per row, from the baseline lengths
+    time = ms.getcol('TIME')
+    desc = ms.getcol('DATA_DESC_ID')
+    ant1 = ms.getcol('ANTENNA1')
+    ant2 = ms.getcol('ANTENNA2')
+    dt = float(np.median(ms.getcol('INTERVAL'))) if time.size else 1.
+    steps, tidx = np.unique(time, return_inverse=True)
+    tidx = tidx.ravel()
+    max_steps = steps.size if max_interval is None\
+        else max(int(max_interval // dt), 1)
+    spw = desc_spw[desc]
+    kt, kf = averaging_factors(
+        baseline=np.linalg.norm(positions[ant2] - positions[ant1], axis=-1),
+        freq_max=chan_freq.max(axis=1)[spw],
+        chan_width=np.abs(chan_width).mean(axis=1)[spw],
+        nchans=nchans,
+        dt=dt,
+        tolerance=tolerance,
+        fov=fov,
+        max_steps=max_steps,
+        max_channels=max_channels
+    )
+
+    # Output MS and its spectral windows, one per input and factor
+    out = _init_output(ms, output)
+    out_desc = _add_windows(
+        out,
+        desc_spw,
+        np.unique(np.stack([desc, kf]), axis=1)
+    )
+
+    # Time steps per block, bounding the memory of _average_rows
+    ncorr = ms.getcell('FLAG', 0).shape[-1] if time.size else 1
+    ndata = len([column for column in data_columns if column in ms.colnames()])
+    row_bytes = nchans * ncorr * (48 * ndata + 32)
+    step_rows = max(time.size / max(steps.size, 1), 1.)
+    block_steps = min(
+        max_steps,
+        max(int(memory_limit * 1024**2 / (row_bytes * step_rows)), 1)
+    )
+
+    nvis_in = time.size * nchans
+    nvis_out = 0
+    nrows_out = 0
+    # Cells of kt time steps of each baseline, in the block of
+    # their first time step
+    cell = tidx // kt
+    block = cell * kt // block_steps
+    for b in np.unique(block):
+        in_block = block == b
+        for d in np.unique(desc[in_block]):
+            rows = np.nonzero(in_block & (desc == d))[0]
+            cells = _average_rows(
+                ms=ms,
+                rows=rows,
+                cell=cell[rows],
+                kf=kf[rows],
+                time=time[rows]
+            )
+            for factor, columns in cells:
+                columns['DATA_DESC_ID'] = np.full(
+                    columns['TIME'].size,
+                    out_desc[(d, factor)],
+                    dtype=np.int32
+                )
+                if exact_uvw:
+                    columns['UVW'] = _exact_uvw(
+                        columns, positions, phase_center
+                    )
+                nrow = columns['TIME'].size
+                out.addrows(nrow)
+                for column, values in columns.items():
+                    out.putcol(column, values, startrow=nrows_out, nrow=nrow)
+                nrows_out += nrow
+                nvis_out += nrow * (nchans // factor)
+    out.flush()
+    out.close()
+    ms.close()
+    ratio = nvis_in / max(nvis_out, 1)
+    log.info(
+        '{} averaged in {}: {} rows, {:.1f}x fewer visibilities.'.format(
+            msname,
+            output,
+            nrows_out,
+            ratio
+        )
+    )
+    return ratio
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------- Internal -------------------------- #
+# ============================================================= #
+def _read(ms, rows, column):
+    """ Values of ``column`` at the sorted row numbers ``rows``,
+        read at once if they are contiguous.
+    """
+    if rows[-1] - rows[0] + 1 == rows.size:
+        return ms.getcol(column, startrow=int(rows[0]), nrow=rows.size)
+    return ms.selectrows(rows).getcol(column)
+
+
+def _init_output(ms, output):
+    """ Empty copy of the MS ``ms`` with all its subtables and
+        variable shape data columns.
+    """
+    from casacore.tables import table, makearrcoldesc, maketabdesc
+    if isdir(output):
+        shutil.rmtree(output)
+    ms.copy(output, deep=True, copynorows=True)
+    out = table(output, readonly=False, ack=False)
+    for name, value in ms.getkeywords().items():
+        if isinstance(value, str) and value.startswith('Table: '):
+            sub = table(value, ack=False)
+            outsub = table(join(output, name), readonly=False, ack=False)
+            if sub.nrows() > 0:
+                sub.copyrows(outsub)
+            outsub.close()
+            sub.close()
+    colnames = out.colnames()
+    out.removecols([
+        column for column in data_columns + dropped_columns
+        if column in colnames
+    ])
+    out.addcols(maketabdesc([
+        makearrcoldesc(column, 0.j, ndim=2, valuetype='complex')
+        for column in data_columns if column in colnames
+    ]))
+    return out
+
+
+def _add_windows(out, desc_spw, pairs):
+    """ Add the spectral windows and data descriptions of the
+        averaged channels for each (data description, channel
+        factor) of ``pairs``.
+
+        :returns: Output data description of each pair
+        :rtype: `dict`
+    """
+    from casacore.tables import table
+    spw_table = table(
+        join(out.name(), 'SPECTRAL_WINDOW'),
+        readonly=False,
+        ack=False
+    )
+    desc_table = table(
+        join(out.name(), 'DATA_DESCRIPTION'),
+        readonly=False,
+        ack=False
+    )
+    out_desc = {}
+    for d, factor in pairs.T:
+        d, factor = int(d), int(factor)
+        if factor == 1:
+            out_desc[(d, factor)] = d
+            continue
+        spw = int(desc_spw[d])
+        new_spw = spw_table.nrows()
+        spw_table.copyrows(spw_table, startrowin=spw, nrow=1)
+        freq = spw_table.getcell('CHAN_FREQ', spw)
+        width = spw_table.getcell('CHAN_WIDTH', spw)
+        nchans = freq.size // factor
+        spw_table.putcell(
+            'NAME',
+            new_spw,
+            '{}-AVG{}'.format(
+                spw_table.getcell('NAME', spw),
+                factor
+            )
+        )
+        spw_table.putcell('NUM_CHAN', new_spw, nchans)
+        spw_table.putcell(
+            'CHAN_FREQ',
+            new_spw,
+            freq.reshape(nchans, factor).mean(axis=1)
+        )
+        for column in ['CHAN_WIDTH', 'EFFECTIVE_BW', 'RESOLUTION']:
+            spw_table.putcell(
+                column,
+                new_spw,
+                spw_table.getcell(column, spw).reshape(
+                    nchans,
+                    factor
+                ).sum(axis=1)
+            )
+        out_desc[(d, factor)] = desc_table.nrows()
+        desc_table.copyrows(desc_table, startrowin=d, nrow=1)
+        desc_table.putcell(
+            'SPECTRAL_WINDOW_ID',
+            out_desc[(d, factor)],
+            new_spw
+        )
+    spw_table.close()
+    desc_table.close()
+    return out_desc
+
+
+def _average_rows(ms, rows, cell, kf, time):
+    """ Average the ``rows`` of ``ms`` (one data description)
+        per baseline and time ``cell``, then over ``kf``
+        channels.
+
+        :returns: List of (channel factor, output columns), rows
+            being ordered by time and baseline.
+        :rtype: `list`
+    """
+    ant1 = _read(ms, rows, 'ANTENNA1')
+    ant2 = _read(ms, rows, 'ANTENNA2')
+    # Cells of each baseline, sorted by time then baseline
+    keys = np.stack([ant1, ant2, cell])
+    _, group = np.unique(keys, axis=1, return_inverse=True)
+    group = group.ravel()
+    order = np.argsort(group, kind='stable')
+    starts = np.concatenate([[0], np.nonzero(np.diff(group[order]))[0] + 1])
+    counts = np.diff(np.append(starts, rows.size))
+
+    def gsum(values):
+        return np.add.reduceat(values[order], starts, axis=0)
+
+    first = order[starts]
+    read = {'ANTENNA1': ant1, 'ANTENNA2': ant2}
+    columns = {
+        column: (
+            read[column] if column in read else _read(ms, rows, column)
+        )[first]
+        for column in index_columns if column in ms.colnames()
+    }
+    columns['TIME'] = gsum(time) / counts
+    columns['TIME_CENTROID'] = gsum(_read(ms, rows, 'TIME_CENTROID')) / counts
+    columns['INTERVAL'] = gsum(_read(ms, rows, 'INTERVAL'))
+    columns['EXPOSURE'] = gsum(_read(ms, rows, 'EXPOSURE'))
+    columns['UVW'] = gsum(_read(ms, rows, 'UVW')) / counts[:, None]
+    sigma = _read(ms, rows, 'SIGMA')
+    columns['SIGMA'] = np.sqrt(gsum(sigma**2)) / counts[:, None]
+    columns['FLAG_ROW'] = gsum(
+        _read(ms, rows, 'FLAG_ROW').astype(np.int64)
+    ) == counts
+    flag = _read(ms, rows, 'FLAG')
+    weight = _read(ms, rows, 'WEIGHT')[:, None, :] * ~flag
+    nflag = gsum(flag.astype(np.int64))
+    wsum = gsum(weight)
+    data = {}
+    for column in data_columns:
+        if column in ms.colnames():
+            values = _read(ms, rows, column)
+            data[column] = (gsum(values * weight), gsum(values))
+            del values
+    del flag, weight
+
+    # Output order: time then baseline
+    out_order = np.lexsort((
+        columns['ANTENNA2'],
+        columns['ANTENNA1'],
+        columns['TIME']
+    ))
+    factors = kf[first]
+    cells = []
+    for factor in np.unique(factors):
+        sel = out_order[factors[out_order] == factor]
+        nchans = wsum.shape[1] // factor
+
+        def csum(values):
+            return values[sel].reshape(
+                (sel.size, nchans, factor) + values.shape[2:]
+            ).sum(axis=2)
+
+        out = {column: values[sel] for column, values in columns.items()}
+        out['SIGMA'] = out['SIGMA'] / np.sqrt(factor)
+        w = csum(wsum)
+        n = counts[sel, None, None] * factor
+        out['FLAG'] = csum(nflag) == n
+        out['WEIGHT'] = w.mean(axis=1).astype(np.float32)
+        for column, (weighted, plain) in data.items():
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[column] = np.where(
+                    w > 0,
+                    csum(weighted) / w,
+                    csum(plain) / n
+                ).astype(np.complex64)
+        out['SIGMA'] = out['SIGMA'].astype(np.float32)
+        cells.append((int(factor), out))
+    return cells
+
+
+def _exact_uvw(columns, positions, phase_center):
+    """ UVW of the averaged rows at their mean time.
+    """
+    from cmspy.Astro import antenna_uvw
+    times, tidx = np.unique(columns['TIME'], return_inverse=True)
+    tidx = tidx.ravel()
+    ant_uvw = antenna_uvw(
+        positions=positions,
+        times=times,
+        phase_center=phase_center
+    )
+    return ant_uvw[tidx, columns['ANTENNA2']] -\
+        ant_uvw[tidx, columns['ANTENNA1']]
+# ============================================================= #
+
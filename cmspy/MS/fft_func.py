@@ -0,0 +1,526 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+""" Visibility prediction by FFT and degridding (w-stacking).
+
+    The sky model is turned into one regular uv grid per w-plane,
+    each visibility being then interpolated from the grids at its
+    (u, v, w) in wavelengths with a separable "exponential of
+    semicircle" kernel ``exp(beta * (sqrt(1 - (2t/W)^2) - 1))``
+    of ``W`` cells. The uv grids of a w-plane are computed from the
+    point sources by spreading them on an oversampled (l, m) grid
+    with the same kernel, one FFT and a deconvolution. Kernel
+    tapers are corrected exactly for each source, so that the
+    relative accuracy only depends on the kernel support ``W``
+    (about ``10^(2 - W)`` with the oversampling factor of 2).
+
+    Sources lying on a regular (l, m) lattice, e.g. the pixels
+    of a model image (see :func:`~cmspy.Astro.read_image`), are
+    placed directly on the (l, m) grid instead of being spread.
+
+    Each w-plane is computed once (on first use) and kept, in
+    memory or in a temporary memory-mapped file. The cost is
+    ``O(nsrcs W^2 + M log M)`` per w-plane (``M`` oversampled
+    grid cells, ``O(nsrcs)`` for a lattice) plus ``O(W^3)`` per
+    visibility, instead of ``O(nsrcs)`` per visibility for the
+    direct sum.
+"""
+
+
+__author__ = 'Alan Loh'
+__copyright__ = 'Copyright 2020, cmspy'
+__credits__ = ['Alan Loh']
+__maintainer__ = 'Alan'
+__email__ = 'alan.loh@obspm.fr'
+__status__ = 'Production'
+__all__ = [
+    'fft_grid',
+    'fft_plane',
+    'add_srcs_fft',
+    'fft_error'
+]
+
+
+from cmspy.MS.util_func import (
+    light_speed,
+    _cis,
+    _precision,
+    add_srcs
+)
+
+import uuid
+import tempfile
+import threading
+import numpy as np
+import numba
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+# Oversampling of the uv grid (with respect to the sky extent)
+# and of the (l, m) grid (with respect to the uv grid extent)
+oversampling = 2.
+
+
+# Planes computed by the last fft_grid used, per process
+_planes_cache = {}
+_planes_lock = threading.Lock()
+
+
+# ============================================================= #
+# -------------------------- Kernel --------------------------- #
+# ============================================================= #
+@numba.jit(nopython=True, fastmath=True, nogil=True, cache=True)
+def _es_kernel(t, support, beta):
+    """ Exponential of semicircle kernel at ``t`` cells from its
+        center.
+    """
+    x = 2. * t / support
+    if abs(x) >= 1.:
+        return 0.
+    return np.exp(beta * (np.sqrt(1. - x*x) - 1.))
+
+
+def _es_correction(y, support, beta):
+    """ Fourier transform of the kernel at ``y`` (in cycles per
+        cell), i.e. the taper it applies in the dual domain.
+    """
+    nodes, weights = np.polynomial.legendre.leggauss(4*support + 64)
+    t = nodes * support / 2.
+    kernel = np.exp(beta * (np.sqrt(1. - nodes**2) - 1.)) *\
+        weights * support / 2.
+    y = np.asarray(y, dtype=np.float64)
+    return np.cos(2*np.pi*y.ravel()[:, None]*t[None, :]).dot(kernel)\
+        .reshape(y.shape)
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------- fft_grid -------------------------- #
+# ============================================================= #
+def fft_grid(lmn, flux, uvw_max, epsilon=1e-4, precision='double',
+        max_cache_mb=2048, cell=None):
+    """ Plan the w-stacking prediction of point sources: kernel,
+        uv and w grid spacings and sizes, and source weights
+        corrected for the kernel tapers.
+
+        Grid spacings follow from the extent of the sources
+        (``du = 1 / (4 max|l|)``, same for v with m and for w
+        with n - 1), so that compact fields need small grids.
+        The number of w-planes grows with ``uvw_max`` times the
+        spread of n - 1 over the sources, i.e. with the field of
+        view.
+
+        :param lmn:
+            Image domain coordinates of the sources.
+        :type lmn:
+            `tuple` of `np.ndarray`
+        :param flux:
+            Fluxes of the sources.
+        :type flux:
+            `np.ndarray`
+        :param uvw_max:
+            Largest absolute u, v or w (in wavelengths) to be
+            predicted, e.g. the longest baseline divided by the
+            shortest wavelength.
+        :type uvw_max:
+            `float`
+        :param epsilon:
+            Target relative accuracy, setting the kernel support
+            ``W = ceil(-log10(epsilon)) + 2`` (between 3 and 16
+            cells). Each extra digit costs ``(W + 1)^3 / W^3`` on
+            the degridding and ``(W + 1)^2 / W^2`` on the
+            spreading.
+        :type epsilon:
+            `float`
+        :param precision:
+            ``'double'`` or ``'single'`` (complex64 grids).
+        :type precision:
+            `str`
+        :param max_cache_mb:
+            Each w-plane is computed once, when first needed by
+            :func:`add_srcs_fft`, and kept in memory if all the
+            planes fit in this budget, in a temporary
+            memory-mapped file otherwise.
+        :type max_cache_mb:
+            `float`
+        :param cell:
+            Spacing (in radians) along l and m of the lattice the
+            sources lie on, if any (e.g. the pixel size of a model
+            image in SIN projection centered on the phase center).
+            The sources are then placed on the (l, m) grid without
+            being spread. Ignored, with a warning, if the sources
+            are not on this lattice.
+        :type cell:
+            `float` or `tuple`
+
+        :returns: Grid description used by :func:`fft_plane`
+            and :func:`add_srcs_fft`.
+        :rtype: `dict`
+    """
+    zero, _ = _precision(precision)
+    l, m, n = [
+        np.ascontiguousarray(np.atleast_1d(x), dtype=np.float64)
+        for x in lmn
+    ]
+    flux = np.broadcast_to(flux, l.shape).astype(np.float64)
+    support = int(np.clip(np.ceil(-np.log10(epsilon)) + 2, 3, 16))
+    beta = 2.3 * support
+    x = n - 1.
+    nshift = 0.5 * (x.min() + x.max()) if x.size else 0.
+    x = x - nshift
+    # Grid spacings such that |du*l| <= 1/(2*oversampling)
+    du, dv, dw = [
+        1. / (2 * oversampling * max(np.abs(coord).max(initial=0.), 1e-6))
+        for coord in (l, m, x)
+    ]
+    half = support // 2 + 1
+    pixels = _lattice(l, m, cell)
+    if pixels is None:
+        nu = 2 * (int(np.ceil(uvw_max / du)) + half)
+        nv = 2 * (int(np.ceil(uvw_max / dv)) + half)
+        mu = int(oversampling * nu)
+        mv = int(oversampling * nv)
+    else:
+        cl, cm = np.broadcast_to(cell, (2,))
+        du, nu, mu, pl = _lattice_axis(pixels[0], cl, uvw_max, half)
+        dv, nv, mv, pm = _lattice_axis(pixels[1], cm, uvw_max, half)
+        pixels = (pixels[0] * pl, pixels[1] * pm)
+    nw = int(np.ceil(2 * uvw_max / dw)) + 2 * half
+    w0 = -uvw_max - half * dw
+    weights = flux / (
+        _es_correction(du * l, support, beta) *
+        _es_correction(dv * m, support, beta) *
+        _es_correction(dw * x, support, beta)
+    )
+    grid = {
+        'token': uuid.uuid4().hex,
+        'support': support,
+        'beta': beta,
+        'du': du,
+        'dv': dv,
+        'dw': dw,
+        'nu': nu,
+        'nv': nv,
+        'nw': nw,
+        'mu': mu,
+        'mv': mv,
+        'pixels': pixels,
+        'w0': w0,
+        'nshift': nshift,
+        'uvw_max': uvw_max,
+        'l': l,
+        'm': m,
+        'x': x,
+        'weights': weights,
+        'zero': zero,
+        'max_cache_mb': max_cache_mb
+    }
+    log.info(
+        'FFT grid of {} w-planes of {}x{} cells, kernel of {} cells '
+        '({:.1f} MB of planes{}).'.format(
+            nw,
+            nu,
+            nv,
+            support,
+            nw * nu * nv * zero.nbytes / 1024**2,
+            '' if pixels is None else ', sources on a lattice'
+        )
+    )
+    return grid
+
+
+def _lattice(l, m, cell):
+    """ Integer (l, m) lattice indices of the sources, `None` if
+        ``cell`` is not given or the sources are not on it.
+    """
+    if (cell is None) or (l.size == 0):
+        return None
+    cl, cm = np.broadcast_to(np.asarray(cell, dtype=np.float64), (2,))
+    il = np.rint(l / cl)
+    im = np.rint(m / cm)
+    if max(np.abs(l / cl - il).max(), np.abs(m / cm - im).max()) > 1e-6:
+        log.warning(
+            'Sources are not on a lattice of {} rad, they are spread '
+            'on the grid.'.format(cell)
+        )
+        return None
+    return il.astype(np.int64), im.astype(np.int64)
+
+
+def _lattice_axis(index, cell, uvw_max, half):
+    """ uv spacing, uv grid size, (l, m) grid size and lattice
+        step (in grid cells) along one axis for sources at
+        ``index * cell``. The (l, m) grid spacing is ``cell / step``
+        so that the sources fall on its cells, and the FFT of its
+        ``m`` cells covers the ``n`` cells of the uv grid.
+    """
+    extent = max(np.abs(index).max(), 1)
+    step = max(1, int(np.ceil(2 * cell * uvw_max)))
+    while True:
+        # |du * l| <= 1/(2*oversampling) as for spread sources
+        m = 2 * int(np.ceil(oversampling * step * extent))
+        d = step / (m * cell)
+        n = 2 * (int(np.ceil(uvw_max / d)) + half)
+        if n <= m:
+            return d, n, m, step
+        step += 1
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------- fft_plane ------------------------- #
+# ============================================================= #
+@numba.jit(nopython=True, fastmath=True, nogil=True, cache=True)
+def _spread(xl, xm, weights, image, support, beta):
+    """ Spread complex ``weights`` at (``xl``, ``xm``), in cells of
+        the periodic ``image``, with the kernel.
+    """
+    nl, nm = image.shape
+    half = support / 2.
+    kl = np.empty(support)
+    km = np.empty(support)
+    for s in range(weights.size):
+        il0 = int(np.floor(xl[s] - half)) + 1
+        im0 = int(np.floor(xm[s] - half)) + 1
+        for a in range(support):
+            kl[a] = _es_kernel(xl[s] - (il0 + a), support, beta)
+            km[a] = _es_kernel(xm[s] - (im0 + a), support, beta)
+        for a in range(support):
+            row = (il0 + a) % nl
+            value = weights[s] * kl[a]
+            for b in range(support):
+                image[row, (im0 + b) % nm] += value * km[b]
+    return
+
+
+def fft_plane(grid, k):
+    """ uv grid of w-plane ``k`` (at ``w0 + k dw``), the cell
+        ``[i, j]`` being at ``u = (i - nu/2) du`` and
+        ``v = (j - nv/2) dv``.
+
+        :param grid:
+            Grid description (see :func:`fft_grid`).
+        :type grid:
+            `dict`
+        :param k:
+            Index of the w-plane.
+        :type k:
+            `int`
+
+        :returns: Plane (nu, nv)
+        :rtype: `np.ndarray`
+    """
+    nu, nv = grid['nu'], grid['nv']
+    mu, mv = grid['mu'], grid['mv']
+    support, beta = grid['support'], grid['beta']
+    wk = grid['w0'] + k * grid['dw']
+    weights = grid['weights'] * np.exp(-2.j * np.pi * wk * grid['x'])
+    # Periodic (l, m) grid dual to a larger uv grid
+    image = np.zeros((mu, mv), dtype=np.complex128)
+    if grid['pixels'] is None:
+        _spread(
+            grid['l'] * mu * grid['du'],
+            grid['m'] * mv * grid['dv'],
+            weights,
+            image,
+            support,
+            beta
+        )
+    else:
+        np.add.at(
+            image,
+            (grid['pixels'][0] % mu, grid['pixels'][1] % mv),
+            weights
+        )
+    iu = np.arange(nu) - nu // 2
+    iv = np.arange(nv) - nv // 2
+    plane = np.fft.fft2(image)[np.ix_(iu % mu, iv % mv)]
+    if grid['pixels'] is None:
+        plane /= _es_correction(iu / mu, support, beta)[:, None]
+        plane /= _es_correction(iv / mv, support, beta)[None, :]
+    return plane.astype(grid['zero'].dtype)
+
+
+def _planes(grid, kmin, kmax):
+    """ w-planes of ``grid``, the ones from ``kmin`` to ``kmax``
+        being computed if not done yet. Planes are computed once
+        per process and kept in memory, or in a temporary
+        memory-mapped file beyond the cache budget of ``grid``.
+    """
+    token = grid['token']
+    with _planes_lock:
+        if token not in _planes_cache:
+            _planes_cache.clear()
+            shape = (grid['nw'], grid['nu'], grid['nv'])
+            dtype = grid['zero'].dtype
+            nbytes = np.prod(shape) * dtype.itemsize
+            if nbytes > grid['max_cache_mb'] * 1024**2:
+                planes = np.memmap(
+                    tempfile.TemporaryFile(),
+                    dtype=dtype,
+                    mode='w+',
+                    shape=shape
+                )
+                log.info(
+                    'w-planes ({:.1f} MB) kept in a temporary '
+                    'file.'.format(nbytes / 1024**2)
+                )
+            else:
+                planes = np.empty(shape, dtype=dtype)
+            _planes_cache[token] = (planes, np.zeros(shape[0], dtype=bool))
+        planes, done = _planes_cache[token]
+        for k in range(kmin, kmax + 1):
+            if not done[k]:
+                planes[k] = fft_plane(grid, k)
+                done[k] = True
+    return np.asarray(planes)
+# ============================================================= #
+
+
+# ============================================================= #
+# ----------------------- add_srcs_fft ------------------------ #
+# ============================================================= #
+@numba.jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def _degrid(planes, w0, du, dv, dw, nshift, support, beta,
+        uvw, desc, chan_freq, vis, zero):
+    """ Accumulate in ``vis`` (rows, chans, pols) the
+        visibilities interpolated from the ``support^3`` cells
+        of the w-planes around their (u, v, w).
+    """
+    nw, nu, nv = planes.shape
+    nrows = uvw.shape[0]
+    nchans = chan_freq.shape[1]
+    npols = vis.shape[2]
+    half = support / 2.
+    for r in numba.prange(nrows):
+        spw = desc[r]
+        ku = np.empty(support)
+        kv = np.empty(support)
+        kw = np.empty(support)
+        for c in range(nchans):
+            scale = chan_freq[spw, c] / light_speed
+            w = uvw[r, 2] * scale
+            xu = uvw[r, 0] * scale / du
+            xv = uvw[r, 1] * scale / dv
+            xw = (w - w0) / dw
+            iu0 = int(np.floor(xu - half)) + 1
+            iv0 = int(np.floor(xv - half)) + 1
+            iw0 = int(np.floor(xw - half)) + 1
+            for a in range(support):
+                ku[a] = _es_kernel(xu - (iu0 + a), support, beta)
+                kv[a] = _es_kernel(xv - (iv0 + a), support, beta)
+                kw[a] = _es_kernel(xw - (iw0 + a), support, beta)
+            acc = zero
+            for g in range(support):
+                k = iw0 + g
+                if (kw[g] == 0.) or (k < 0) or (k >= nw):
+                    continue
+                partial_w = zero
+                for a in range(support):
+                    row = iu0 + a + nu // 2
+                    partial = zero
+                    for b in range(support):
+                        partial += kv[b] * planes[k, row, iv0 + b + nv // 2]
+                    partial_w += ku[a] * partial
+                acc += kw[g] * partial_w
+            acc *= _cis(-2. * np.pi * w * nshift, zero)
+            for p in range(npols):
+                vis[r, c, p] += acc
+    return
+
+
+def add_srcs_fft(uvw, desc, chan_freq, grid, vis=None, npol=4):
+    """ Predict the visibilities of the sources planned by
+        :func:`fft_grid`, by degridding its w-planes.
+
+        :param uvw:
+            UVW coordinates (rows, 3) in meters.
+        :type uvw:
+            `np.ndarray`
+        :param desc:
+            Spectral window index of each row (rows,).
+        :type desc:
+            `np.ndarray`
+        :param chan_freq:
+            Channel frequencies (spws, chans) in Hz.
+        :type chan_freq:
+            `np.ndarray`
+        :param grid:
+            Grid description (see :func:`fft_grid`).
+        :type grid:
+            `dict`
+        :param vis:
+            Pre-allocated visibilities (rows, chans, pols).
+        :type vis:
+            `np.ndarray`
+
+        :returns: vis
+        :rtype: `np.ndarray`
+    """
+    zero = grid['zero']
+    uvw = np.ascontiguousarray(uvw, dtype=np.float64)
+    chan_freq = np.ascontiguousarray(chan_freq, dtype=np.float64)
+    desc = np.ascontiguousarray(desc, dtype=np.int64)
+    if vis is None:
+        vis = np.zeros(
+            (uvw.shape[0], chan_freq.shape[1], npol),
+            dtype=zero.dtype
+        )
+    if uvw.shape[0] == 0:
+        return vis
+    fmax = chan_freq.max(axis=1)[desc] / light_speed
+    fmin = chan_freq.min(axis=1)[desc] / light_speed
+    extent = np.abs(uvw).max(axis=1) * fmax
+    if extent.max() > grid['uvw_max'] * (1 + 1e-9):
+        raise ValueError(
+            'UVW up to {:.1f} wavelengths, beyond the FFT grid '
+            '({:.1f}).'.format(extent.max(), grid['uvw_max'])
+        )
+    # Only the w-planes within the kernel support of the rows
+    w = np.concatenate([uvw[:, 2] * fmin, uvw[:, 2] * fmax])
+    half = grid['support'] / 2.
+    kmin = int(np.floor((w.min() - grid['w0']) / grid['dw'] - half)) + 1
+    kmax = int(np.floor((w.max() - grid['w0']) / grid['dw'] + half))
+    planes = _planes(
+        grid,
+        max(kmin, 0),
+        min(kmax, grid['nw'] - 1)
+    )
+    _degrid(
+        planes,
+        grid['w0'],
+        grid['du'],
+        grid['dv'],
+        grid['dw'],
+        grid['nshift'],
+        grid['support'],
+        grid['beta'],
+        uvw,
+        desc,
+        chan_freq,
+        vis,
+        zero
+    )
+    return vis
+
+
+def fft_error(uvw, desc, chan_freq, lmn, flux, grid):
+    """ Compare the FFT prediction (:func:`add_srcs_fft`) to the
+        direct double precision one (:func:`add_srcs`) over the
+        given rows.
+
+        :returns: (maximal absolute error, maximal error
+            relative to the total flux)
+        :rtype: `tuple`
+    """
+    direct = add_srcs(uvw, desc, chan_freq, lmn, flux, npol=1)
+    fft = add_srcs_fft(uvw, desc, chan_freq, grid, npol=1)
+    error = np.abs(fft - direct).max() if direct.size else 0.
+    total_flux = np.abs(np.broadcast_to(flux, lmn[0].shape)).sum()
+    return error, error / total_flux if total_flux else error
+# ============================================================= #
+
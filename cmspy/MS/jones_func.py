@@ -0,0 +1,322 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+""" Per-antenna Jones corruption of visibilities.
+
+    Visibilities are corrupted as ``V'_pq = G_p V_pq G_q^H``,
+    ``G`` being either a scalar complex gain or a 2x2 Jones
+    matrix (polarizations XX, XY, YX, YY of a row forming the
+    2x2 matrix ``[[XX, XY], [YX, YY]]``). Gain tables are
+    indexed ``(times, antennas, spectral windows, channels)``
+    (followed by ``(2, 2)`` if polarized), any axis of length 1
+    being broadcast. The gains of each row are gathered by time
+    index, ANTENNA1, ANTENNA2 and DATA_DESC_ID inside the kernel,
+    without per-row copies of the table.
+"""
+
+
+__author__ = 'Alan Loh'
+__copyright__ = 'Copyright 2020, cmspy'
+__credits__ = ['Alan Loh']
+__maintainer__ = 'Alan'
+__email__ = 'alan.loh@obspm.fr'
+__status__ = 'Production'
+__all__ = [
+    'random_gains',
+    'jones_table',
+    'apply_jones'
+]
+
+
+import hashlib
+import numpy as np
+import numba
+import logging
+
+
+log = logging.getLogger(__name__)
+
+
+# ============================================================= #
+# ----------------------- random_gains ------------------------ #
+# ============================================================= #
+def random_gains(nant, ntimes=1, nchans=1, nspw=1, amplitude=0.1,
+        phase=30., bandpass=0.05, leakage=0., polarized=False,
+        seed=None):
+    """ Draw a gain table, product of per-antenna time-variable
+        gains and of per-antenna bandpasses.
+
+        :param nant:
+            Number of antennas.
+        :type nant:
+            `int`
+        :param ntimes:
+            Number of gain solutions in time.
+        :type ntimes:
+            `int`
+        :param nchans:
+            Number of channels per spectral window.
+        :type nchans:
+            `int`
+        :param nspw:
+            Number of spectral windows.
+        :type nspw:
+            `int`
+        :param amplitude:
+            Standard deviation of the gain amplitudes around 1.
+        :type amplitude:
+            `float`
+        :param phase:
+            Standard deviation of the gain phases (deg).
+        :type phase:
+            `float`
+        :param bandpass:
+            Standard deviation of the bandpass amplitudes around 1
+            (and of their phases in rad).
+        :type bandpass:
+            `float`
+        :param leakage:
+            Standard deviation of the real and imaginary parts of
+            the off-diagonal terms, if ``polarized``.
+        :type leakage:
+            `float`
+        :param polarized:
+            Draw 2x2 Jones matrices (independent X and Y gains)
+            instead of scalar gains.
+        :type polarized:
+            `bool`
+        :param seed:
+            Seed of the random generator.
+        :type seed:
+            `int`
+
+        :returns: Gains (times, antennas, spws, chans), followed
+            by (2, 2) if ``polarized``
+        :rtype: `np.ndarray` of `np.complex128`
+    """
+    rng = np.random.default_rng(seed)
+    feeds = (2,) if polarized else ()
+
+    def draw(shape, amp_std, phase_std):
+        return (1. + amp_std * rng.standard_normal(shape)) *\
+            np.exp(1j * phase_std * rng.standard_normal(shape))
+
+    gains = draw((ntimes, nant, 1, 1) + feeds, amplitude, np.radians(phase))
+    gains = gains * draw((1, nant, nspw, nchans) + feeds, bandpass, bandpass)
+    if not polarized:
+        return gains
+    jones = np.zeros(gains.shape[:-1] + (2, 2), dtype=np.complex128)
+    jones[..., 0, 0] = gains[..., 0]
+    jones[..., 1, 1] = gains[..., 1]
+    shape = gains.shape[:-1] + (2,)
+    jones[..., [0, 1], [1, 0]] = leakage * (
+        rng.standard_normal(shape) + 1j * rng.standard_normal(shape)
+    )
+    return jones
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------ jones_table ------------------------ #
+# ============================================================= #
+def jones_table(gains, times=None):
+    """ Check and prepare a gain table for :func:`apply_jones`.
+
+        :param gains:
+            Gains (times, antennas, spws, chans) or 2x2 Jones
+            matrices (times, antennas, spws, chans, 2, 2), axes of
+            length 1 being broadcast. May also be the name of a
+            ``.npz`` file with ``gains`` and ``times`` arrays.
+        :type gains:
+            `np.ndarray` or `str`
+        :param times:
+            Times (MJD, s, as the TIME column) of the gain
+            solutions, the nearest solution being used for each
+            row. Only optional if there is a single solution.
+        :type times:
+            `np.ndarray`
+
+        :returns: Gain table
+        :rtype: `dict`
+    """
+    if isinstance(gains, str):
+        with np.load(gains) as npz:
+            if 'times' in npz.files:
+                times = npz['times']
+            gains = npz['gains']
+        log.info(
+            'Gain table {} loaded.'.format(gains.shape)
+        )
+    gains = np.ascontiguousarray(gains, dtype=np.complex128)
+    if gains.ndim not in (4, 6) or\
+        (gains.ndim == 6 and gains.shape[-2:] != (2, 2)):
+        raise ValueError(
+            'Gains should be of shape (times, antennas, spws, chans) '
+            'or (times, antennas, spws, chans, 2, 2), got {}.'.format(
+                gains.shape
+            )
+        )
+    if times is not None:
+        times = np.asarray(times, dtype=np.float64).ravel()
+        if times.size != gains.shape[0]:
+            raise ValueError(
+                '{} gain times for {} gain solutions.'.format(
+                    times.size,
+                    gains.shape[0]
+                )
+            )
+        if np.any(np.diff(times) <= 0):
+            raise ValueError(
+                'Gain times should be strictly increasing.'
+            )
+    elif gains.shape[0] > 1:
+        raise ValueError(
+            'Gain times are required for {} gain solutions.'.format(
+                gains.shape[0]
+            )
+        )
+    sha = hashlib.sha256(gains.tobytes())
+    sha.update(repr(gains.shape).encode())
+    if times is not None:
+        sha.update(times.tobytes())
+    return {
+        'gains': gains,
+        'times': times,
+        'polarized': gains.ndim == 6,
+        'signature': sha.hexdigest()
+    }
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------ apply_jones ------------------------ #
+# ============================================================= #
+@numba.jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def _corrupt_scalar(vis, gains, tindex, ant1, ant2, desc):
+    """ ``vis *= g_p conj(g_q)`` for every row, channel and
+        polarization.
+    """
+    nrows, nchans, npols = vis.shape
+    for r in numba.prange(nrows):
+        t = tindex[r]
+        p = ant1[r]
+        q = ant2[r]
+        s = desc[r]
+        for c in range(nchans):
+            g = gains[t, p, s, c] * np.conj(gains[t, q, s, c])
+            for k in range(npols):
+                vis[r, c, k] *= g
+
+
+@numba.jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def _corrupt_jones(vis, gains, tindex, ant1, ant2, desc):
+    """ ``vis = G_p vis G_q^H`` for every row and channel, the
+        four polarizations being the 2x2 visibility matrix.
+    """
+    nrows, nchans, _ = vis.shape
+    for r in numba.prange(nrows):
+        t = tindex[r]
+        p = ant1[r]
+        q = ant2[r]
+        s = desc[r]
+        for c in range(nchans):
+            v00 = vis[r, c, 0]
+            v01 = vis[r, c, 1]
+            v10 = vis[r, c, 2]
+            v11 = vis[r, c, 3]
+            # G_p V
+            a00 = gains[t, p, s, c, 0, 0] * v00 + gains[t, p, s, c, 0, 1] * v10
+            a01 = gains[t, p, s, c, 0, 0] * v01 + gains[t, p, s, c, 0, 1] * v11
+            a10 = gains[t, p, s, c, 1, 0] * v00 + gains[t, p, s, c, 1, 1] * v10
+            a11 = gains[t, p, s, c, 1, 0] * v01 + gains[t, p, s, c, 1, 1] * v11
+            # (G_p V) G_q^H
+            h00 = np.conj(gains[t, q, s, c, 0, 0])
+            h01 = np.conj(gains[t, q, s, c, 1, 0])
+            h10 = np.conj(gains[t, q, s, c, 0, 1])
+            h11 = np.conj(gains[t, q, s, c, 1, 1])
+            vis[r, c, 0] = a00 * h00 + a01 * h10
+            vis[r, c, 1] = a00 * h01 + a01 * h11
+            vis[r, c, 2] = a10 * h00 + a11 * h10
+            vis[r, c, 3] = a10 * h01 + a11 * h11
+
+
+def apply_jones(vis, table, time, ant1, ant2, desc):
+    """ Corrupt visibilities in place with per-antenna gains,
+        ``V'_pq = G_p V_pq G_q^H``.
+
+        :param vis:
+            Visibilities (rows, chans, pols), polarizations being
+            XX, XY, YX, YY for 2x2 Jones matrices. They are
+            corrupted as given: for unpolarized sources, XY and
+            YX should be zero.
+        :type vis:
+            `np.ndarray`
+        :param table:
+            Gain table (see :func:`jones_table`).
+        :type table:
+            `dict`
+        :param time:
+            TIME of the rows.
+        :type time:
+            `np.ndarray`
+        :param ant1:
+            ANTENNA1 of the rows.
+        :type ant1:
+            `np.ndarray`
+        :param ant2:
+            ANTENNA2 of the rows.
+        :type ant2:
+            `np.ndarray`
+        :param desc:
+            DATA_DESC_ID of the rows.
+        :type desc:
+            `np.ndarray`
+
+        :returns: ``vis``
+        :rtype: `np.ndarray`
+    """
+    gains = table['gains']
+    if vis.shape[0] == 0:
+        return vis
+    if table['times'] is None:
+        tindex = np.zeros(vis.shape[0], dtype=np.int64)
+    else:
+        edges = (table['times'][1:] + table['times'][:-1]) / 2.
+        tindex = np.searchsorted(edges, time)
+    nant = max(ant1.max(), ant2.max()) + 1
+    nspw = desc.max() + 1
+    if (gains.shape[1] > 1) and (gains.shape[1] < nant):
+        raise ValueError(
+            'Gains of {} antennas for antenna indices up to {}.'.format(
+                gains.shape[1],
+                nant - 1
+            )
+        )
+    if (gains.shape[2] > 1) and (gains.shape[2] < nspw):
+        raise ValueError(
+            'Gains of {} spectral windows for {} used.'.format(
+                gains.shape[2],
+                nspw
+            )
+        )
+    nant = max(nant, gains.shape[1])
+    nspw = max(nspw, gains.shape[2])
+    # Zero-stride views, nothing is copied
+    gains = np.broadcast_to(
+        gains,
+        (gains.shape[0], nant, nspw, vis.shape[1]) + gains.shape[4:]
+    )
+    if table['polarized']:
+        if vis.shape[2] != 4:
+            raise ValueError(
+                '2x2 Jones matrices require 4 polarizations, got {}.'.format(
+                    vis.shape[2]
+                )
+            )
+        _corrupt_jones(vis, gains, tindex, ant1, ant2, desc)
+    else:
+        _corrupt_scalar(vis, gains, tindex, ant1, ant2, desc)
+    return vis
+# ============================================================= #
+
@@ -0,0 +1,113 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+__author__ = 'Alan Loh'
+__copyright__ = 'Copyright 2020, cmspy'
+__credits__ = ['Alan Loh']
+__maintainer__ = 'Alan'
+__email__ = 'alan.loh@obspm.fr'
+__status__ = 'Production'
+__all__ = [
+    'noise_block_rows',
+    'noise_sigma',
+    'thermal_noise'
+]
+
+
+import numpy as np
+
+
+# Rows sharing one random stream
+noise_block_rows = 1024
+
+
+# ============================================================= #
+# ------------------------ noise_sigma ------------------------ #
+# ============================================================= #
+def noise_sigma(sefd1, sefd2, chan_width, exposure):
+    """ Thermal noise of the real and imaginary parts of a
+        visibility, ``sqrt(SEFD1 SEFD2 / (2 df dt))``.
+
+        :param sefd1:
+            System equivalent flux density (Jy) of the first
+            antenna.
+        :type sefd1:
+            `float` or `np.ndarray`
+        :param sefd2:
+            System equivalent flux density (Jy) of the second
+            antenna.
+        :type sefd2:
+            `float` or `np.ndarray`
+        :param chan_width:
+            Channel width ``df`` (Hz).
+        :type chan_width:
+            `float` or `np.ndarray`
+        :param exposure:
+            Integration time ``dt`` (s).
+        :type exposure:
+            `float` or `np.ndarray`
+
+        :returns: Standard deviation (Jy)
+        :rtype: `float` or `np.ndarray`
+    """
+    return np.sqrt(
+        np.asarray(sefd1) * sefd2 / (2. * np.abs(chan_width) * exposure)
+    )
+# ============================================================= #
+
+
+# ============================================================= #
+# ----------------------- thermal_noise ----------------------- #
+# ============================================================= #
+def thermal_noise(rownrs, shape, seed, block_rows=noise_block_rows):
+    """ Complex Gaussian noise of unit standard deviation (on
+        both the real and imaginary parts) for rows of a MS.
+
+        Rows are grouped in fixed blocks of ``block_rows`` rows
+        (from row 0), each block drawing its noise from its own
+        stream ``SeedSequence(seed, spawn_key=(block,))``. The
+        noise of a row therefore only depends on ``seed`` and on
+        its row number, whatever the rows requested at once or
+        the process drawing them.
+
+        :param rownrs:
+            Row numbers in the MS.
+        :type rownrs:
+            `np.ndarray`
+        :param shape:
+            Shape (chans, pols) of the noise of a row.
+        :type shape:
+            `tuple`
+        :param seed:
+            Master seed.
+        :type seed:
+            `int`
+        :param block_rows:
+            Number of rows per random stream.
+        :type block_rows:
+            `int`
+
+        :returns: Noise (rows, chans, pols)
+        :rtype: `np.ndarray` of `np.complex64`
+    """
+    rownrs = np.asarray(rownrs, dtype=np.int64)
+    shape = tuple(shape)
+    noise = np.empty((rownrs.size,) + shape, dtype=np.complex64)
+    blocks = rownrs // block_rows
+    order = np.argsort(blocks, kind='stable')
+    values, starts = np.unique(blocks[order], return_index=True)
+    ends = np.append(starts[1:], rownrs.size)
+    for block, start, end in zip(values, starts, ends):
+        rng = np.random.default_rng(
+            np.random.SeedSequence(seed, spawn_key=(int(block),))
+        )
+        draws = rng.standard_normal(
+            (block_rows,) + shape + (2,),
+            dtype=np.float32
+        ).view(np.complex64)[..., 0]
+        rows = order[start:end]
+        noise[rows] = draws[rownrs[rows] - block * block_rows]
+    return noise
+# ============================================================= #
+
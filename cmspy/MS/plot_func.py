@@ -9,76 +9,230 @@ __maintainer__ = 'Alan'
 __email__ = 'alan.loh@obspm.fr'
 __status__ = 'Production'
 __all__ = [
+    'uv_density',
     'plot_uv'
 ]
 
 
-from casacore.tables import table
-
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.axes_grid1 import make_axes_locatable
 
 
 # ============================================================= #
-# -------------------------- plot_uv -------------------------- #
+# ------------------------ uv_density ------------------------- #
 # ============================================================= #
-def plot_uv(msname, query=''):
+def _uv_chunks(ms, chunksize, unit, spw_freqs):
+    """ Yield the (u, v) coordinates of ``ms`` by blocks of
+        ``chunksize`` rows, in meters or in wavelengths (one
+        point per row and channel).
     """
+    from cmspy.MS.util_func import light_speed
+    nrows = ms.nrows()
+    for startrow in range(0, nrows, chunksize):
+        nrow = min(chunksize, nrows - startrow)
+        uvw = ms.getcol('UVW', startrow=startrow, nrow=nrow)
+        if unit == 'm':
+            yield uvw[:, 0], uvw[:, 1]
+        else:
+            desc = ms.getcol('DATA_DESC_ID', startrow=startrow, nrow=nrow)
+            scale = spw_freqs[desc] / light_speed # (rows, chans)
+            yield (
+                (uvw[:, 0:1] * scale).ravel(),
+                (uvw[:, 1:2] * scale).ravel()
+            )
+        del uvw
+
+
+def uv_density(msname, query='', nbins=200, extent=None, unit='m',
+        chunksize=100000, conjugate=False):
+    """ Histogram of the uv coverage of a MS on a fixed
+        ``(nbins, nbins)`` grid, accumulated while reading the
+        UVW column by blocks of rows, so that the memory does
+        not depend on the size of the MS.
+
+        :param msname:
+            Path to the MS, or a
+            :class:`~cmspy.CustomMS.MeasurementSet` (possibly
+            in memory) whose cached metadata then give the
+            channel frequencies instead of reading the
+            sub-tables again.
+        :type msname:
+            `str` or :class:`~cmspy.CustomMS.MeasurementSet`
+        :param query:
+            Selection of the rows, a TaQL expression (e.g.
+            ``'ANTENNA1 != ANTENNA2'``) or, for a
+            :class:`~cmspy.CustomMS.MeasurementSet`, anything
+            accepted by
+            :meth:`~cmspy.CustomMS.MeasurementSet.select_rows`.
+        :type query:
+            `str` or `dict`
+        :param nbins:
+            Number of bins along u and v.
+        :type nbins:
+            `int`
+        :param extent:
+            Half size of the grid (in ``unit``), which covers
+            ``[-extent, extent]`` along u and v. If `None`, it is
+            set from the largest absolute u or v found in a first
+            pass over the MS.
+        :type extent:
+            `float`
+        :param unit:
+            ``'m'`` (one point per row) or ``'lambda'`` (one
+            point per row and channel, in wavelengths).
+        :type unit:
+            `str`
+        :param chunksize:
+            Number of rows read at once.
+        :type chunksize:
+            `int`
+        :param conjugate:
+            Also count the symmetric points ``(-u, -v)``.
+        :type conjugate:
+            `bool`
+
+        :returns: (grid (v, u), u bin edges, v bin edges)
+        :rtype: `tuple`
+
+        :Example:
+
+        >>> from cmspy.MS import uv_density
+        >>> grid, u_edges, v_edges = uv_density(
+                'my.ms',
+                unit='lambda'
+            )
+
     """
-    ms = table(
-        tablename=msname,
-        tabledesc=False,
-        nrow=0,
-        readonly=True,
-        lockoptions='default',
-        ack=True
-    )
-    if query != '':
-        ms = ms.query(query)
+    from casacore.tables import table
+    from cmspy.CustomMS import MeasurementSet
+    if unit not in ['m', 'lambda']:
+        raise ValueError(
+            'Unknown unit {}'.format(unit)
+        )
+    spw_freqs = None
+    if isinstance(msname, MeasurementSet):
+        base = msname._main_table(readonly=True)
+    else:
+        base = table(
+            tablename=msname,
+            readonly=True,
+            lockoptions='autonoread',
+            ack=False
+        )
+    # The query result is closed before the table it selects from
+    tables = [base]
+    try:
+        if isinstance(msname, MeasurementSet):
+            if unit == 'lambda':
+                # Indexed by DATA_DESC_ID, as for the prediction
+                spw_freqs = msname.chan_freq
+            if query != '':
+                tables.append(
+                    base.selectrows(msname.select_rows(query, ms=base))
+                )
+        else:
+            if unit == 'lambda':
+                # Channel frequencies of each DATA_DESC_ID
+                sub = table(base.getkeyword('SPECTRAL_WINDOW'), ack=False)
+                chan_freq = sub.getcol('CHAN_FREQ')
+                sub.close()
+                sub = table(base.getkeyword('DATA_DESCRIPTION'), ack=False)
+                spw_freqs = chan_freq[sub.getcol('SPECTRAL_WINDOW_ID')]
+                sub.close()
+            if query != '':
+                tables.append(base.query(query))
+        ms = tables[-1]
 
-    uvw = ms.getcol('UVW')
+        if extent is None:
+            extent = 0.
+            for u, v in _uv_chunks(ms, chunksize, unit, spw_freqs):
+                if u.size:
+                    extent = max(extent, np.abs(u).max(), np.abs(v).max())
+            # Keep the largest baselines inside the grid
+            extent = 1.05 * extent if extent > 0 else 1.
+        edges = np.linspace(-extent, extent, nbins + 1)
 
-    ms.close()
-    del ms
+        grid = np.zeros(nbins * nbins, dtype=np.int64)
+        signs = [1, -1] if conjugate else [1]
+        for u, v in _uv_chunks(ms, chunksize, unit, spw_freqs):
+            for sign in signs:
+                iu = np.floor((sign*u + extent) * (nbins / (2*extent)))
+                iv = np.floor((sign*v + extent) * (nbins / (2*extent)))
+                inside = (iu >= 0) & (iu < nbins) & (iv >= 0) & (iv < nbins)
+                grid += np.bincount(
+                    (iv[inside] * nbins + iu[inside]).astype(np.int64),
+                    minlength=nbins * nbins
+                )
+    finally:
+        for tab in reversed(tables):
+            tab.close()
+    return grid.reshape((nbins, nbins)), edges, edges.copy()
+# ============================================================= #
 
-    fig, ax = plt.subplots(figsize=(10, 10))
 
-    hbins = ax.hexbin(
-        x=uvw[:, 0],
-        y=uvw[:, 1],
-        C=None,
+# ============================================================= #
+# -------------------------- plot_uv -------------------------- #
+# ============================================================= #
+def plot_uv(msname, query='', nbins=200, extent=None, unit='m',
+        chunksize=100000, conjugate=False, figname=None):
+    """ Plot the uv coverage density computed by
+        :func:`uv_density` (see it for the parameters).
+
+        :param figname:
+            Name of the figure file to save. If `None`, the
+            figure is shown with :mod:`matplotlib.pyplot`,
+            otherwise it is rendered without any display (e.g.
+            on headless nodes).
+        :type figname:
+            `str`
+
+        :returns: (grid (v, u), u bin edges, v bin edges)
+        :rtype: `tuple`
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.colors import LogNorm
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+    grid, u_edges, v_edges = uv_density(
+        msname=msname,
+        query=query,
+        nbins=nbins,
+        extent=extent,
+        unit=unit,
+        chunksize=chunksize,
+        conjugate=conjugate
+    )
+
+    if figname is None:
+        import matplotlib.pyplot as plt
+        fig = plt.figure(figsize=(10, 10))
+    else:
+        fig = Figure(figsize=(10, 10))
+    ax = fig.add_subplot(111)
+
+    im = ax.imshow(
+        np.ma.masked_equal(grid, 0),
+        origin='lower',
+        extent=(u_edges[0], u_edges[-1], v_edges[0], v_edges[-1]),
         cmap='YlGnBu',
-        mincnt=1,
-        bins='log',
-        gridsize=200,
-        vmin=0.1,
-        xscale='linear',
-        yscale='linear',
-        edgecolors='face',
-        linewidths=0,
-        vmax=None)
+        norm=LogNorm(vmin=1, vmax=max(grid.max(), 1)),
+        interpolation='nearest'
+    )
 
     ax.set_aspect('equal')
     ax.margins(0)
-    
+
     divider = make_axes_locatable(ax)
     cax = divider.append_axes("right", size=0.15, pad=0.2)
-    cb = fig.colorbar(hbins, cax=cax)
-    
+    cb = fig.colorbar(im, cax=cax)
+
     cb.set_label('Histogram')
-    ax.set_xlabel('u (m)')
-    ax.set_ylabel('v (m)')
+    ax.set_xlabel('u ({})'.format(unit))
+    ax.set_ylabel('v ({})'.format(unit))
 
-    lim = 1.1*np.max(
-            (np.abs(ax.get_xlim()).max(),
-            np.abs(ax.get_ylim()).max())
-        )
-    ax.set_xlim(-lim, lim)
-    ax.set_ylim(-lim, lim)
-    plt.show()
-    plt.close('all')
-    return
+    if figname is None:
+        plt.show()
+        plt.close('all')
+    else:
+        fig.savefig(figname, dpi=150, bbox_inches='tight')
+    return grid, u_edges, v_edges
 # ============================================================= #
 
-
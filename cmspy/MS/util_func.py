@@ -9,20 +9,92 @@ __maintainer__ = 'Alan'
 __email__ = 'alan.loh@obspm.fr'
 __status__ = 'Production'
 __all__ = [
-    'add_src'
+    'add_src',
+    'add_srcs',
+    'derive_antenna_uvw',
+    'add_srcs_antenna',
+    'add_srcs_recurrence',
+    'recurrence_error'
 ]
 
 
-from cmspy.Astro import radec2lmn
-
 import numpy as np
 import numba
+from numba.extending import overload
+
+
+light_speed = 299792458. # m/s, exact (astropy.constants.c)
+source_tile = 64 # sources per phasor tile of compute_vis_antenna
+
+
+# ============================================================= #
+# ------------------------- Precision ------------------------- #
+# ============================================================= #
+@numba.jit(nopython=True, fastmath=True, cache=True)
+def _cis64(phase):
+    """ exp(i*phase) in double precision.
+    """
+    return np.cos(phase) + 1.j*np.sin(phase)
+
+
+@numba.jit(nopython=True, fastmath=True, cache=True)
+def _cis32(phase):
+    """ exp(i*phase) in single precision, the (float64) phase
+        being first reduced to [-pi, pi] so that the float32
+        cast only costs ~1e-7 rad, whatever the phase.
+    """
+    turns = phase * (0.5/np.pi)
+    turns -= np.floor(turns + 0.5)
+    reduced = np.float32(2*np.pi*turns)
+    return np.complex64(np.cos(reduced) + np.complex64(1j)*np.sin(reduced))
+
+
+def _cis(phase, zero):
+    """ exp(i*phase) in the precision of ``zero``. This NumPy
+        version is only used outside compiled kernels, which
+        call :func:`_cis32` or :func:`_cis64` (see the overload
+        below).
+    """
+    dtype = np.asarray(zero).dtype
+    phase = np.asarray(phase, dtype=np.float64)
+    if dtype == np.complex64:
+        turns = phase * (0.5/np.pi)
+        phase = 2*np.pi*(turns - np.floor(turns + 0.5))
+    return np.asarray(np.cos(phase) + 1.j*np.sin(phase), dtype=dtype)[()]
+
+
+@overload(_cis)
+def _cis_overload(phase, zero):
+    # Selected at compile time from the type of zero, which keeps
+    # the kernels cacheable (unlike a function passed as argument)
+    if zero == numba.types.complex64:
+        return lambda phase, zero: _cis32(phase)
+    return lambda phase, zero: _cis64(phase)
+
+
+precisions = {
+    # precision: (complex zero, flux dtype)
+    'double': (np.complex128(0), np.float64),
+    'single': (np.complex64(0), np.float32)
+}
+
+
+def _precision(precision):
+    """ Complex zero and flux dtype of a ``precision``, see
+        :data:`precisions`.
+    """
+    if precision not in precisions:
+        raise ValueError(
+            'precision should be one of {}'.format(list(precisions))
+        )
+    return precisions[precision]
+# ============================================================= #
 
 
 # ============================================================= #
 # ------------------------ compute_ft ------------------------- #
 # ============================================================= #
-@numba.jit(nopython=True, parallel=True,fastmath=True)
+@numba.jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
 def compute_ft(ul, vm, wn):
     """
     """
@@ -33,17 +105,27 @@ def compute_ft(ul, vm, wn):
 # ============================================================= #
 # -------------------------- add_src -------------------------- #
 # ============================================================= #
-def add_src(uvw, src_coord, flux, phase_center):
+def add_src(uvw, src_coord, flux, phase_center, precision='double'):
     """
         :param uvw:
             UVW coordinates (baselines x time x spw, chans, 3),
             they should be converted in lambdas.
         :type uvw:
             `np.ndarray`
+        :param precision:
+            ``'double'`` (complex128 output) or ``'single'``:
+            the phase is computed in float64 and reduced to
+            [-pi, pi] before the float32 cos/sin, the output
+            being complex64 (see :func:`add_srcs` for the error
+            bound).
+        :type precision:
+            `str`
 
         :returns: vis
         :rtype: `np.ndarray`
     """
+    from cmspy.Astro import radec2lmn
+    _precision(precision)
     l, m, n = radec2lmn(
         skycoord=src_coord,
         phase_center=phase_center
@@ -51,6 +133,576 @@ def add_src(uvw, src_coord, flux, phase_center):
     ul = uvw[..., 0] * l
     vm = uvw[..., 1] * m
     wn = uvw[..., 2] * (n - 1)
-    return flux * compute_ft(ul, vm, wn)
+    if precision == 'double':
+        return flux * compute_ft(ul, vm, wn)
+    turns = -(ul + vm + wn)
+    turns -= np.floor(turns + 0.5)
+    phase = (2*np.pi*turns).astype(np.float32)
+    vis = np.empty(phase.shape, dtype=np.complex64)
+    vis.real = np.cos(phase)
+    vis.imag = np.sin(phase)
+    vis *= np.asarray(flux, dtype=np.float32)
+    return vis
+# ============================================================= #
+
+
+
+# ============================================================= #
+# ------------------------ compute_vis ------------------------ #
+# ============================================================= #
+@numba.jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def compute_vis(uvw, desc, chan_freq, l, m, n, flux, vis, zero):
+    """ Accumulate the visibilities of all point sources in
+        ``vis`` (rows, chans, pols) in a single pass, without
+        any intermediate array of the size of ``vis``.
+        ``uvw`` are in meters, the wavelength of each row
+        being given by ``chan_freq[desc]`` (in Hz).
+        The phases are computed in float64, the type of
+        ``zero`` setting the precision of the exponentials and
+        of the accumulation (see :data:`precisions`).
+    """
+    nrows = uvw.shape[0]
+    nchans = chan_freq.shape[1]
+    npols = vis.shape[2]
+    nsrcs = l.size
+    for i in numba.prange(nrows):
+        u = uvw[i, 0]
+        v = uvw[i, 1]
+        w = uvw[i, 2]
+        spw = desc[i]
+        for c in range(nchans):
+            scale = -2. * np.pi * chan_freq[spw, c] / light_speed
+            acc = zero
+            for s in range(nsrcs):
+                phase = scale * (u*l[s] + v*m[s] + w*(n[s] - 1))
+                acc += flux[s] * _cis(phase, zero)
+            for p in range(npols):
+                vis[i, c, p] += acc
+    return
+# ============================================================= #
+
+
+# ============================================================= #
+# ------------------------- add_srcs -------------------------- #
+# ============================================================= #
+def add_srcs(uvw, desc, chan_freq, lmn, flux, vis=None, npol=4,
+        precision='double'):
+    """ Predict the visibilities of a collection of point
+        sources at once (see :func:`compute_vis`).
+
+        In ``'single'`` precision, the phases are still
+        computed in float64 (UVW of kilometres in wavelengths
+        need it) and reduced to [-pi, pi], then the exponentials
+        and the sum over the sources are evaluated in
+        float32/complex64. The reduced phase is exact to
+        ~2e-7 rad and each complex64 operation adds a relative
+        error of ~6e-8, so that the error of a visibility is
+        bounded by ``(3e-7 + 6e-8 * nsrcs) * sum(|flux|)``, in
+        practice closer to ``3e-7 * sqrt(nsrcs) * max(|flux|)``
+        since the round-off errors are not correlated. This is
+        of the order of the precision of the complex64 DATA
+        columns, for half the memory of complex128 buffers.
+
+        :param uvw:
+            UVW coordinates (rows, 3) in meters.
+        :type uvw:
+            `np.ndarray`
+        :param desc:
+            Spectral window index of each row (rows,).
+        :type desc:
+            `np.ndarray`
+        :param chan_freq:
+            Channel frequencies (spws, chans) in Hz.
+        :type chan_freq:
+            `np.ndarray`
+        :param lmn:
+            Image domain coordinates of the sources, as
+            returned by :func:`~cmspy.Astro.radec2lmn`.
+        :type lmn:
+            `tuple` of `np.ndarray`
+        :param flux:
+            Fluxes of the sources.
+        :type flux:
+            `np.ndarray`
+        :param vis:
+            Pre-allocated visibilities (rows, chans, pols) in
+            which the prediction is accumulated. A new
+            (zero-filled) buffer is allocated if `None`.
+        :type vis:
+            `np.ndarray`
+        :param precision:
+            ``'double'`` or ``'single'``, a new ``vis`` buffer
+            being respectively complex128 or complex64.
+        :type precision:
+            `str`
+
+        :returns: vis
+        :rtype: `np.ndarray`
+    """
+    zero, flux_dtype = _precision(precision)
+    uvw = np.ascontiguousarray(uvw, dtype=np.float64)
+    chan_freq = np.ascontiguousarray(chan_freq, dtype=np.float64)
+    desc = np.ascontiguousarray(desc, dtype=np.int64)
+    l, m, n = [
+        np.ascontiguousarray(np.atleast_1d(x), dtype=np.float64)
+        for x in lmn
+    ]
+    flux = np.ascontiguousarray(
+        np.broadcast_to(flux, l.shape),
+        dtype=flux_dtype
+    )
+    if vis is None:
+        vis = np.zeros(
+            (uvw.shape[0], chan_freq.shape[1], npol),
+            dtype=zero.dtype
+        )
+    compute_vis(uvw, desc, chan_freq, l, m, n, flux, vis, zero)
+    return vis
+# ============================================================= #
+
+
+
+# ============================================================= #
+# -------------------- derive_antenna_uvw --------------------- #
+# ============================================================= #
+@numba.jit(nopython=True, nogil=True, cache=True)
+def _propagate_antenna_uvw(uvw, tidx, ant1, ant2, ntimes, nant):
+    """ Per-antenna UVW such that
+        ``uvw = ant_uvw[t, ant2] - ant_uvw[t, ant1]``, the first
+        antenna met at each time step being the origin.
+    """
+    ant_uvw = np.zeros((ntimes, nant, 3))
+    known = np.zeros((ntimes, nant), dtype=np.bool_)
+    nrows = uvw.shape[0]
+    for i in range(nrows):
+        t = tidx[i]
+        if not known[t].any():
+            known[t, ant1[i]] = True
+    changed = True
+    while changed:
+        changed = False
+        for i in range(nrows):
+            t = tidx[i]
+            p = ant1[i]
+            q = ant2[i]
+            if known[t, p] and not known[t, q]:
+                ant_uvw[t, q] = ant_uvw[t, p] + uvw[i]
+                known[t, q] = True
+                changed = True
+            elif known[t, q] and not known[t, p]:
+                ant_uvw[t, p] = ant_uvw[t, q] - uvw[i]
+                known[t, p] = True
+                changed = True
+        if not changed:
+            # Seed any connected component left for a time step
+            for i in range(nrows):
+                t = tidx[i]
+                if not (known[t, ant1[i]] or known[t, ant2[i]]):
+                    known[t, ant1[i]] = True
+                    changed = True
+                    break
+    return ant_uvw
+
+
+def derive_antenna_uvw(uvw, time, ant1, ant2):
+    """ Derive per-antenna UVW coordinates from the baseline
+        UVW of a MS, assuming the MS convention
+        ``uvw = uvw(ANTENNA2) - uvw(ANTENNA1)``.
+
+        Per-antenna UVW are only defined up to an offset for
+        each time step, which cancels out in any baseline.
+
+        :param uvw:
+            Baseline UVW coordinates (rows, 3).
+        :type uvw:
+            `np.ndarray`
+        :param time:
+            TIME of each row.
+        :type time:
+            `np.ndarray`
+        :param ant1:
+            ANTENNA1 of each row.
+        :type ant1:
+            `np.ndarray`
+        :param ant2:
+            ANTENNA2 of each row.
+        :type ant2:
+            `np.ndarray`
+
+        :returns: (per-antenna UVW (times, antennas, 3), time
+            index of each row)
+        :rtype: `tuple`
+    """
+    _, tidx = np.unique(time, return_inverse=True)
+    tidx = tidx.ravel().astype(np.int64)
+    ant1 = np.asarray(ant1, dtype=np.int64)
+    ant2 = np.asarray(ant2, dtype=np.int64)
+    ant_uvw = _propagate_antenna_uvw(
+        np.ascontiguousarray(uvw, dtype=np.float64),
+        tidx,
+        ant1,
+        ant2,
+        tidx.max() + 1,
+        max(ant1.max(), ant2.max()) + 1
+    )
+    residual = np.abs(
+        ant_uvw[tidx, ant2] - ant_uvw[tidx, ant1] - uvw
+    ).max()
+    if residual > 1e-6 * max(np.abs(uvw).max(), 1.):
+        raise ValueError(
+            'UVW cannot be factorized per antenna '
+            '(residual of {} m).'.format(residual)
+        )
+    return ant_uvw, tidx
+# ============================================================= #
+
+
+# ============================================================= #
+# -------------------- compute_vis_antenna -------------------- #
+# ============================================================= #
+@numba.jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def compute_vis_antenna(ant_uvw, group_time, group_spw, group_start,
+        order, ant1, ant2, chan_freq, l, m, n, flux, vis, zero):
+    """ Accumulate the visibilities of all point sources in
+        ``vis`` (rows, chans, pols), the phase of each baseline
+        being factorized as ``a_q * conj(a_p)`` with ``a`` the
+        per-antenna phasors, evaluated once per group of rows
+        sharing the same time step and spectral window. Sources
+        are processed by tiles of ``source_tile``, bounding the
+        phasor buffer of each group whatever the catalog size.
+    """
+    ngroups = group_time.size
+    nant = ant_uvw.shape[1]
+    nchans = chan_freq.shape[1]
+    npols = vis.shape[2]
+    nsrcs = l.size
+    tile = max(min(source_tile, nsrcs), 1)
+    for g in numba.prange(ngroups):
+        t = group_time[g]
+        spw = group_spw[g]
+        phasors = np.full((nant, nchans, tile), zero)
+        for s0 in range(0, nsrcs, tile):
+            ns = min(tile, nsrcs - s0)
+            for a in range(nant):
+                u = ant_uvw[t, a, 0]
+                v = ant_uvw[t, a, 1]
+                w = ant_uvw[t, a, 2]
+                for c in range(nchans):
+                    scale = -2. * np.pi * chan_freq[spw, c] / light_speed
+                    for s in range(ns):
+                        phase = scale * (
+                            u*l[s0 + s] + v*m[s0 + s] + w*(n[s0 + s] - 1)
+                        )
+                        phasors[a, c, s] = _cis(phase, zero)
+            for k in range(group_start[g], group_start[g + 1]):
+                i = order[k]
+                p = ant1[i]
+                q = ant2[i]
+                for c in range(nchans):
+                    acc = zero
+                    for s in range(ns):
+                        acc += flux[s0 + s] * phasors[q, c, s] *\
+                            np.conj(phasors[p, c, s])
+                    for pol in range(npols):
+                        vis[i, c, pol] += acc
+    return
+# ============================================================= #
+
+
+# ============================================================= #
+# --------------------- add_srcs_antenna ---------------------- #
+# ============================================================= #
+def add_srcs_antenna(uvw, time, ant1, ant2, desc, chan_freq, lmn,
+        flux, vis=None, npol=4, ant_uvw=None, precision='double'):
+    """ Predict the visibilities of a collection of point
+        sources at once, computing the complex exponentials per
+        antenna instead of per baseline (see
+        :func:`compute_vis_antenna`). The cost of the
+        exponentials therefore scales with the number of
+        antennas rather than the number of baselines.
+
+        :param uvw:
+            UVW coordinates (rows, 3) in meters.
+        :type uvw:
+            `np.ndarray`
+        :param time:
+            TIME of each row.
+        :type time:
+            `np.ndarray`
+        :param ant1:
+            ANTENNA1 of each row.
+        :type ant1:
+            `np.ndarray`
+        :param ant2:
+            ANTENNA2 of each row.
+        :type ant2:
+            `np.ndarray`
+        :param desc:
+            Spectral window index of each row (rows,).
+        :type desc:
+            `np.ndarray`
+        :param chan_freq:
+            Channel frequencies (spws, chans) in Hz.
+        :type chan_freq:
+            `np.ndarray`
+        :param lmn:
+            Image domain coordinates of the sources.
+        :type lmn:
+            `tuple` of `np.ndarray`
+        :param flux:
+            Fluxes of the sources.
+        :type flux:
+            `np.ndarray`
+        :param vis:
+            Pre-allocated visibilities (rows, chans, pols).
+        :type vis:
+            `np.ndarray`
+        :param ant_uvw:
+            Per-antenna UVW (times, antennas, 3) in meters,
+            ordered as the sorted unique ``time`` values. If
+            `None`, they are derived from ``uvw`` (see
+            :func:`derive_antenna_uvw`).
+        :type ant_uvw:
+            `np.ndarray`
+        :param precision:
+            ``'double'`` or ``'single'`` (see :func:`add_srcs`).
+            In single precision, the product of two complex64
+            phasors doubles the error of the exponentials.
+        :type precision:
+            `str`
+
+        :returns: vis
+        :rtype: `np.ndarray`
+    """
+    zero, flux_dtype = _precision(precision)
+    ant1 = np.ascontiguousarray(ant1, dtype=np.int64)
+    ant2 = np.ascontiguousarray(ant2, dtype=np.int64)
+    desc = np.ascontiguousarray(desc, dtype=np.int64)
+    if ant_uvw is None:
+        ant_uvw, tidx = derive_antenna_uvw(uvw, time, ant1, ant2)
+    else:
+        _, tidx = np.unique(time, return_inverse=True)
+        tidx = tidx.ravel().astype(np.int64)
+    ant_uvw = np.ascontiguousarray(ant_uvw, dtype=np.float64)
+    chan_freq = np.ascontiguousarray(chan_freq, dtype=np.float64)
+    l, m, n = [
+        np.ascontiguousarray(np.atleast_1d(x), dtype=np.float64)
+        for x in lmn
+    ]
+    flux = np.ascontiguousarray(
+        np.broadcast_to(flux, l.shape),
+        dtype=flux_dtype
+    )
+    if vis is None:
+        vis = np.zeros(
+            (ant1.size, chan_freq.shape[1], npol),
+            dtype=zero.dtype
+        )
+    # Group rows sharing the same time step and spectral window
+    groups, group_idx = np.unique(
+        tidx * chan_freq.shape[0] + desc,
+        return_inverse=True
+    )
+    order = np.argsort(group_idx.ravel(), kind='stable')
+    group_start = np.searchsorted(
+        group_idx.ravel()[order],
+        np.arange(groups.size + 1)
+    ).astype(np.int64)
+    compute_vis_antenna(
+        ant_uvw,
+        (groups // chan_freq.shape[0]).astype(np.int64),
+        (groups % chan_freq.shape[0]).astype(np.int64),
+        group_start,
+        order.astype(np.int64),
+        ant1,
+        ant2,
+        chan_freq,
+        l, m, n,
+        flux,
+        vis,
+        zero
+    )
+    return vis
+# ============================================================= #
+
+
+
+# ============================================================= #
+# ------------------ compute_vis_recurrence ------------------- #
+# ============================================================= #
+@numba.jit(nopython=True, parallel=True, fastmath=True, nogil=True, cache=True)
+def compute_vis_recurrence(uvw, desc, freq_start, freq_step, nchans,
+        l, m, n, flux, anchor, vis, zero):
+    """ Accumulate the visibilities of all point sources in
+        ``vis`` (rows, chans, pols) for evenly spaced channels.
+        The phasor of channel ``k + 1`` is the one of channel
+        ``k`` times a per-row constant phasor, exact
+        exponentials being only evaluated every ``anchor``
+        channels to bound the round-off drift.
+    """
+    nrows = uvw.shape[0]
+    npols = vis.shape[2]
+    nsrcs = l.size
+    for i in numba.prange(nrows):
+        u = uvw[i, 0]
+        v = uvw[i, 1]
+        w = uvw[i, 2]
+        spw = desc[i]
+        f0 = freq_start[spw]
+        df = freq_step[spw]
+        acc = np.full(nchans, zero)
+        for s in range(nsrcs):
+            delay = -2. * np.pi *\
+                (u*l[s] + v*m[s] + w*(n[s] - 1)) / light_speed
+            step = _cis(delay*df, zero)
+            phasor = zero
+            for c in range(nchans):
+                if c % anchor == 0:
+                    phase = delay * (f0 + c*df)
+                    phasor = _cis(phase, zero)
+                acc[c] += flux[s] * phasor
+                phasor *= step
+        for c in range(nchans):
+            for p in range(npols):
+                vis[i, c, p] += acc[c]
+    return
+# ============================================================= #
+
+
+# ============================================================= #
+# -------------------- add_srcs_recurrence -------------------- #
+# ============================================================= #
+def _regular_channels(chan_freq):
+    """ Return the first frequency and the channel width of
+        each spectral window, checking that the channels are
+        evenly spaced.
+    """
+    chan_freq = np.asarray(chan_freq, dtype=np.float64)
+    freq_start = chan_freq[:, 0].copy()
+    if chan_freq.shape[1] > 1:
+        freq_step = chan_freq[:, 1] - chan_freq[:, 0]
+        steps = np.diff(chan_freq, axis=1)
+        if not np.allclose(steps, freq_step[:, None], rtol=1e-9, atol=0):
+            raise ValueError(
+                'Channels are not evenly spaced, frequency '
+                'recurrence cannot be used.'
+            )
+    else:
+        freq_step = np.zeros(chan_freq.shape[0])
+    return freq_start, freq_step
+
+
+def add_srcs_recurrence(uvw, desc, chan_freq, lmn, flux, vis=None,
+        npol=4, anchor=32, precision='double'):
+    """ Predict the visibilities of a collection of point
+        sources at once, for evenly spaced channels, replacing
+        most of the complex exponentials by a complex multiply
+        along the frequency axis (see
+        :func:`compute_vis_recurrence`).
+
+        Each multiply adds an error of the order of the float64
+        machine precision times the phase (in radians), so that
+        the deviation from the direct evaluation grows at most
+        linearly up to ``anchor`` channels, i.e. roughly
+        ``anchor * 1e-16 * max(|phase|) * sum(|flux|)``, well
+        below the complex64 precision of the DATA columns (see
+        :func:`recurrence_error` to measure it). In single
+        precision, the drift is ``anchor`` times the complex64
+        error of one multiply (~6e-8) instead.
+
+        :param uvw:
+            UVW coordinates (rows, 3) in meters.
+        :type uvw:
+            `np.ndarray`
+        :param desc:
+            Spectral window index of each row (rows,).
+        :type desc:
+            `np.ndarray`
+        :param chan_freq:
+            Evenly spaced channel frequencies (spws, chans)
+            in Hz.
+        :type chan_freq:
+            `np.ndarray`
+        :param lmn:
+            Image domain coordinates of the sources.
+        :type lmn:
+            `tuple` of `np.ndarray`
+        :param flux:
+            Fluxes of the sources.
+        :type flux:
+            `np.ndarray`
+        :param vis:
+            Pre-allocated visibilities (rows, chans, pols).
+        :type vis:
+            `np.ndarray`
+        :param anchor:
+            Number of channels between two exact evaluations
+            of the exponential.
+        :type anchor:
+            `int`
+        :param precision:
+            ``'double'`` or ``'single'`` (see :func:`add_srcs`).
+        :type precision:
+            `str`
+
+        :returns: vis
+        :rtype: `np.ndarray`
+    """
+    zero, flux_dtype = _precision(precision)
+    if anchor < 1:
+        raise ValueError(
+            'anchor should be a positive integer'
+        )
+    freq_start, freq_step = _regular_channels(chan_freq)
+    nchans = np.shape(chan_freq)[1]
+    uvw = np.ascontiguousarray(uvw, dtype=np.float64)
+    desc = np.ascontiguousarray(desc, dtype=np.int64)
+    l, m, n = [
+        np.ascontiguousarray(np.atleast_1d(x), dtype=np.float64)
+        for x in lmn
+    ]
+    flux = np.ascontiguousarray(
+        np.broadcast_to(flux, l.shape),
+        dtype=flux_dtype
+    )
+    if vis is None:
+        vis = np.zeros(
+            (uvw.shape[0], nchans, npol),
+            dtype=zero.dtype
+        )
+    compute_vis_recurrence(
+        uvw,
+        desc,
+        freq_start,
+        freq_step,
+        nchans,
+        l, m, n,
+        flux,
+        int(anchor),
+        vis,
+        zero
+    )
+    return vis
+
+
+def recurrence_error(uvw, desc, chan_freq, lmn, flux, anchor=32,
+        precision='double'):
+    """ Compare the frequency recurrence prediction
+        (:func:`add_srcs_recurrence`) in ``precision`` to the
+        direct double precision one (:func:`add_srcs`) over the
+        given rows.
+
+        :returns: (maximal absolute error, maximal error
+            relative to the total flux)
+        :rtype: `tuple`
+    """
+    direct = add_srcs(uvw, desc, chan_freq, lmn, flux, npol=1)
+    recurrence = add_srcs_recurrence(
+        uvw, desc, chan_freq, lmn, flux, npol=1, anchor=anchor,
+        precision=precision
+    )
+    error = np.abs(recurrence - direct).max() if direct.size else 0.
+    total_flux = np.abs(np.broadcast_to(flux, lmn[0].shape)).sum()
+    return error, error / total_flux if total_flux else error
 # ============================================================= #
 
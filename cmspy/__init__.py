@@ -24,3 +24,28 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+
+
+def _lazy_exports(package, exports):
+    """ Module ``__getattr__`` and ``__dir__`` (PEP 562) of a
+        subpackage, importing the submodule defining a name
+        (``exports[name]``) on first access only, so that
+        importing cmspy does not pull in casacore, astropy,
+        matplotlib or numba until they are needed.
+    """
+    import importlib
+
+    def __getattr__(name):
+        if name not in exports:
+            raise AttributeError(
+                'module {} has no attribute {}'.format(package, name)
+            )
+        module = importlib.import_module(exports[name], package)
+        value = getattr(module, name)
+        setattr(sys.modules[package], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package])) | set(exports))
+
+    return __getattr__, __dir__
@@ -14,9 +14,11 @@ setup(
         'numpy',
         'astropy',
         'matplotlib',
-        'python-casacore'
+        'python-casacore',
+        'numba',
+        'pyerfa'
     ],
-    python_requires='>=3.5',
+    python_requires='>=3.7',
     scripts=[],
     version=cmspy.__version__,
     description='Custom Measurement Set',
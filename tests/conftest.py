@@ -0,0 +1,61 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+""" Shared fixtures: a small MS written on disk and a sky model.
+"""
+
+
+from cmspy.CustomMS import MeasurementSet
+
+from casacore.tables import table
+import pytest
+
+
+ms_setup = {
+    'nbands': 2,
+    'nf': 8,
+    'nt': 4,
+    't0': '2026-01-01T12:00:00',
+    'ra': 299.868,
+    'dec': 40.734
+}
+
+
+@pytest.fixture
+def sources():
+    return {
+        'a': {'ra': 299.87, 'dec': 40.74, 'flux': 1.},
+        'b': {'ra': 299.7, 'dec': 40.5, 'flux': 2.}
+    }
+
+
+@pytest.fixture(scope='session')
+def empty_ms(tmp_path_factory):
+    """ Empty MS, copied by :func:`ms` for each test.
+    """
+    ms = MeasurementSet(
+        savepath=str(tmp_path_factory.mktemp('ms')),
+        msname='empty.ms',
+        **ms_setup
+    )
+    ms.init_empty(native=True)
+    return ms.msfile
+
+
+@pytest.fixture
+def ms(empty_ms, tmp_path):
+    """ Fresh copy of the empty MS.
+    """
+    msname = 'test.ms'
+    t = table(empty_ms, ack=False)
+    t.copy(str(tmp_path / msname), deep=True)
+    t.close()
+    return MeasurementSet(savepath=str(tmp_path), msname=msname)
+
+
+def read_column(ms, column='CORRECTED_DATA'):
+    t = table(ms.msfile, ack=False)
+    values = t.getcol(column)
+    t.close()
+    return values
@@ -0,0 +1,76 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+from conftest import read_column
+
+from cmspy.CustomMS import MeasurementSet
+
+from casacore.tables import table
+
+import numpy as np
+import pytest
+
+
+def test_empty_sky_model_resets_column(ms, sources):
+    ms.add_data_table(sources)
+    assert np.abs(read_column(ms)).max() > 0
+    ms.add_data_table({})
+    assert np.abs(read_column(ms)).max() == 0
+    # The recorded (empty) sky model matches the column
+    ms.add_data_table(sources, incremental=True)
+    full = read_column(ms)
+    ms.add_data_table(sources)
+    np.testing.assert_allclose(read_column(ms), full, atol=1e-5)
+
+
+def test_unchanged_incremental_update_keeps_column(ms, sources):
+    ms.add_data_table(sources)
+    before = read_column(ms)
+    ms.add_data_table(sources, incremental=True)
+    np.testing.assert_array_equal(read_column(ms), before)
+
+
+def test_incremental_update_matches_full_prediction(ms, sources):
+    ms.add_data_table({'a': sources['a']})
+    updated = dict(sources, a=dict(sources['a'], flux=3.))
+    ms.add_data_table(updated, incremental=True)
+    incremental = read_column(ms)
+    ms.add_data_table(updated)
+    np.testing.assert_allclose(read_column(ms), incremental, atol=1e-5)
+    # Removed sources are subtracted
+    ms.add_data_table({'b': sources['b']}, incremental=True)
+    incremental = read_column(ms)
+    ms.add_data_table({'b': sources['b']})
+    np.testing.assert_allclose(read_column(ms), incremental, atol=1e-5)
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'pipeline': False},
+    {'engine': 'recurrence'},
+    {'sefd': 1e6, 'seed': 7}
+])
+def test_empty_selection(ms, sources, options):
+    ms.add_data_table(sources)
+    before = read_column(ms)
+    selection = {'DATA_DESC_ID': 99}
+    ms.add_data_table(
+        {'c': dict(sources['a'], flux=5.)},
+        selection=selection,
+        **options
+    )
+    np.testing.assert_array_equal(read_column(ms), before)
+    assert list(ms.predict(sources, selection=selection)) == []
+
+
+def test_table_without_rows(empty_ms, tmp_path, sources):
+    t = table(empty_ms, ack=False)
+    subset = t.selectrows([])
+    subset.copy(str(tmp_path / 'norows.ms'), deep=True).close()
+    subset.close()
+    t.close()
+    ms = MeasurementSet(savepath=str(tmp_path), msname='norows.ms')
+    ms.add_data_table(sources)
+    assert list(ms.predict(sources)) == []
+    assert read_column(ms).shape[0] == 0
@@ -0,0 +1,41 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+from conftest import read_column
+
+from astropy.table import Table
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def reference(ms, sources):
+    ms.add_data_table(sources, engine='loop')
+    return read_column(ms)
+
+
+@pytest.mark.parametrize('engine, atol', [
+    ('fused', 1e-5),
+    ('antenna', 1e-5),
+    ('recurrence', 1e-5),
+    ('fft', 1e-3)
+])
+def test_engine_matches_loop(ms, sources, reference, engine, atol):
+    ms.add_data_table(sources, engine=engine, chunksize=100)
+    np.testing.assert_allclose(read_column(ms), reference, atol=atol)
+
+
+@pytest.mark.parametrize('engine', ['loop', 'fused', 'antenna'])
+def test_table_sky_model(ms, sources, reference, engine):
+    table = Table(
+        rows=[(name, *src.values()) for name, src in sources.items()],
+        names=['name', 'ra', 'dec', 'flux']
+    )
+    ms.add_data_table(table, engine=engine)
+    np.testing.assert_allclose(read_column(ms), reference, atol=1e-5)
+
+
+def test_single_precision_matches_loop(ms, sources, reference):
+    ms.add_data_table(sources, precision='single')
+    np.testing.assert_allclose(read_column(ms), reference, atol=1e-4)
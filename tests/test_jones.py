@@ -0,0 +1,41 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+from conftest import read_column
+
+from cmspy.MS import apply_jones, jones_table, random_gains
+
+import numpy as np
+
+
+def test_identity_gains(ms, sources):
+    ms.add_data_table(sources)
+    reference = read_column(ms)
+    ms.add_data_table(sources, gains=np.ones((1, 1, 1, 1)))
+    np.testing.assert_allclose(read_column(ms), reference, atol=1e-6)
+    # XY and YX of unpolarized sources stay empty
+    identity = np.broadcast_to(np.eye(2), (1, 1, 1, 1, 2, 2))
+    ms.add_data_table(sources, gains=identity)
+    corrupted = read_column(ms)
+    np.testing.assert_allclose(
+        corrupted[..., [0, 3]],
+        reference[..., [0, 3]],
+        atol=1e-6
+    )
+    assert np.abs(corrupted[..., 1:3]).max() == 0
+
+
+def test_scalar_gains():
+    rng = np.random.default_rng(0)
+    nrows, nant = 50, 5
+    ant1 = rng.integers(0, nant, nrows)
+    ant2 = rng.integers(0, nant, nrows)
+    desc = rng.integers(0, 2, nrows)
+    gains = random_gains(nant, nchans=3, nspw=2, seed=1)
+    vis = rng.standard_normal((nrows, 3, 4)) + 0j
+    expected = vis * (
+        gains[0, ant1, desc] * np.conj(gains[0, ant2, desc])
+    )[..., None]
+    apply_jones(vis, jones_table(gains), None, ant1, ant2, desc)
+    np.testing.assert_allclose(vis, expected)
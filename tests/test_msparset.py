@@ -0,0 +1,13 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+from cmspy.CustomMS import MSParset
+
+import pytest
+
+
+@pytest.mark.parametrize('attribute', ['nt', 'nf', 'nbands'])
+def test_empty_dimensions_rejected(attribute):
+    with pytest.raises(ValueError):
+        MSParset(**{attribute: 0})
@@ -0,0 +1,55 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+
+from conftest import read_column
+
+from cmspy.MS import noise_block_rows, thermal_noise
+
+import numpy as np
+import pytest
+
+
+sefd = 1e6
+seed = 7
+
+
+@pytest.fixture
+def noisy(ms, sources):
+    ms.add_data_table(sources, sefd=sefd, seed=seed)
+    return read_column(ms)
+
+
+@pytest.mark.parametrize('options', [
+    {'chunksize': 37},
+    {'chunksize': 100, 'pipeline': False},
+    {'chunksize': 50, 'partition': 'spw'},
+    {'chunksize': 500, 'workers': 2}
+])
+def test_noise_invariance(ms, sources, noisy, options):
+    ms.add_data_table(sources, sefd=sefd, seed=seed, **options)
+    np.testing.assert_array_equal(read_column(ms), noisy)
+
+
+def test_noise_level(ms, sources, noisy):
+    sigma = read_column(ms, 'SIGMA')
+    weight = read_column(ms, 'WEIGHT')
+    expected = np.sqrt(
+        sefd**2 / (2 * np.abs(ms.chan_width[0, 0]) * ms.dt.to('s').value)
+    )
+    np.testing.assert_allclose(sigma, expected, rtol=1e-6)
+    np.testing.assert_allclose(weight, 1. / sigma**2, rtol=1e-6)
+    ms.add_data_table(sources)
+    noise = noisy - read_column(ms)
+    assert noise.real.std() == pytest.approx(expected, rel=0.05)
+    assert noise.imag.std() == pytest.approx(expected, rel=0.05)
+
+
+def test_thermal_noise_rows():
+    rownrs = np.array([3, noise_block_rows + 1, 0, 2 * noise_block_rows])
+    noise = thermal_noise(rownrs, (2, 4), seed)
+    for i, row in enumerate(rownrs):
+        np.testing.assert_array_equal(
+            thermal_noise([row], (2, 4), seed)[0],
+            noise[i]
+        )